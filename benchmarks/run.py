@@ -0,0 +1,183 @@
+"""
+Parkive benchmark suite.
+
+Generates a deterministic synthetic vault (see vaultgen.py), times the core code paths end to end
+and writes the results as JSON, so runs on different commits can be compared and checked against
+performance budgets.
+
+    python benchmarks/run.py --files 5000 --output results.json
+    python benchmarks/run.py --files 5000 --compare baseline.json --budget budgets.toml
+"""
+from pathlib import Path
+from contextlib import contextmanager
+
+import os
+import sys
+import json
+import time
+import tomllib
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from typer.testing import CliRunner  # noqa: E402
+from parkive.cli import app  # noqa: E402
+from parkive.common import iter_managed_files  # noqa: E402
+from parkive.scan import count_mixed_words, replace_images_in_text  # noqa: E402
+from vaultgen import add_arguments, generate_vault, generator_params  # noqa: E402
+
+
+@contextmanager
+def working_directory(path: Path):
+    previous = Path.cwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def run_cli(root: Path, args: list[str]) -> None:
+    with working_directory(root):
+        result = CliRunner().invoke(app, args)
+    if result.exit_code != 0:
+        raise RuntimeError(f"parkive {' '.join(args)} failed:\n{result.output}")
+
+
+def measure(func, repeat: int, setup=None) -> dict:
+    timings = []
+    for i in range(repeat):
+        if setup is not None:
+            setup(i)
+        start = time.perf_counter()
+        func(i)
+        timings.append(time.perf_counter() - start)
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "runs": timings}
+
+
+# 在新的解释器中运行的命令，测量包括导入在内的启动耗时（保存时触发的钩子每次都要付出这部分开销）
+STARTUP_COMMANDS = {
+    "startup_help": ["--help"],
+    "startup_source_list": ["source", "list"],
+    "startup_git_help": ["git", "--help"],
+}
+
+
+def run_subprocess(root: Path, args: list[str]) -> None:
+    src = str(Path(__file__).resolve().parents[1] / "src")
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [src, os.environ.get("PYTHONPATH")]))}
+    env.pop("PARKIVE_LOG_LEVEL", None)
+    subprocess.run(
+        [sys.executable, "-c", "from parkive import main; main()", *args],
+        cwd=root, env=env, stdout=subprocess.DEVNULL, check=True,
+    )
+
+
+def run_benchmarks(root: Path, sources: dict[str, str], repeat: int, jobs: int) -> dict:
+    scan_glob = ["*.md", "**/*.md"]
+    skip_dirs = [".git", ".parkive"]
+    names = list(sources)
+    src, tgt = names[0], names[1 % len(names)]
+    files = list(iter_managed_files(root, scan_glob, skip_dirs))
+    contents = [f.read_text(encoding="utf-8") for f in files]
+    jobs_args = ["--jobs", str(jobs)]
+
+    results = {}
+    for name, args in STARTUP_COMMANDS.items():
+        results[name] = measure(lambda _: run_subprocess(root, args), repeat)
+    results["iter_managed_files"] = measure(lambda _: list(iter_managed_files(root, scan_glob, skip_dirs)), repeat)
+    results["replace_images_in_text"] = measure(
+        lambda _: [replace_images_in_text(c, sources[src], sources[tgt]) for c in contents], repeat
+    )
+    results["count_mixed_words"] = measure(lambda _: [count_mixed_words(c) for c in contents], repeat)
+    results["source_status_cold"] = measure(lambda _: run_cli(root, ["source", "status", "--no-index", *jobs_args]), repeat)
+    run_cli(root, ["source", "status", "--rebuild-index", *jobs_args])
+    results["source_status_warm"] = measure(lambda _: run_cli(root, ["source", "status", *jobs_args]), repeat)
+    results["tool_wc_cold"] = measure(lambda _: run_cli(root, ["tool", "wc", "--no-index", *jobs_args]), repeat)
+    # 偶数次从 src 切换到 tgt，奇数次切换回来，每次处理的 URL 数量相同
+    results["source_change"] = measure(
+        lambda i: run_cli(root, ["source", "change", *((src, tgt) if i % 2 == 0 else (tgt, src)), *jobs_args]),
+        repeat,
+    )
+    return results
+
+
+def current_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline_path: Path) -> None:
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))["results"]
+    print(f"\n{'benchmark':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]["median_s"], result["median_s"]
+        print(f"{name:<28}{old:>11.3f}s{new:>11.3f}s{(new - old) / old * 100:>+9.1f}%")
+
+
+def check_budget(results: dict, budget_path: Path) -> list[str]:
+    with budget_path.open("rb") as f:
+        budgets = tomllib.load(f).get("budgets", {})
+    return [
+        f"{name}: median {results[name]['median_s']:.3f}s exceeds budget {limit:.3f}s"
+        for name, limit in budgets.items()
+        if name in results and results[name]["median_s"] > limit
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument("--vault", type=Path, help="Generate the vault here and keep it, instead of a temporary directory")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--jobs", type=int, default=1, help="--jobs passed to the parkive commands")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON to this file")
+    parser.add_argument("--compare", type=Path, help="Previous results JSON to compare against")
+    parser.add_argument("--budget", type=Path, help="TOML file with a [budgets] table of benchmark = max median seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="parkive-bench-") as tmp:
+        root = (args.vault or Path(tmp) / "vault").resolve()
+        params = generator_params(args)
+        sources = generate_vault(root, **params)
+        results = run_benchmarks(root, sources, args.repeat, args.jobs)
+
+    report = {
+        "meta": {
+            "commit": current_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "jobs": args.jobs,
+            "repeat": args.repeat,
+            "vault": params,
+        },
+        "results": results,
+    }
+    for name, result in results.items():
+        print(f"{name:<28}{result['median_s']:>10.3f}s (min {result['min_s']:.3f}s)")
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if args.compare is not None:
+        compare(results, args.compare)
+    if args.budget is not None:
+        failures = check_budget(results, args.budget)
+        for failure in failures:
+            print(f"over budget: {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
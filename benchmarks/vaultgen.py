@@ -0,0 +1,137 @@
+"""
+Deterministic synthetic vault generator for the Parkive benchmarks.
+
+The same parameters and seed always produce byte-identical vaults, so timings taken on
+different commits are comparable.
+
+    python benchmarks/vaultgen.py /tmp/vault --files 5000 --depth 3
+"""
+from pathlib import Path
+
+import argparse
+import random
+
+
+EN_WORDS = [
+    "note", "image", "source", "archive", "server", "markdown", "vault", "daily", "review",
+    "project", "meeting", "draft", "reference", "summary", "backup", "sync", "git", "mirror",
+]
+CJK_TEXT = "知识库中的笔记和日记通常会将图片存储在图床服务器上通过链接访问如果有多个图床服务器的实例就需要切换图片的前缀"
+
+
+def _paragraph(rng: random.Random, words: int, cjk_ratio: float) -> str:
+    parts = []
+    for _ in range(words):
+        if rng.random() < cjk_ratio:
+            start = rng.randrange(len(CJK_TEXT) - 4)
+            parts.append(CJK_TEXT[start : start + rng.randint(2, 4)])
+        else:
+            parts.append(rng.choice(EN_WORDS))
+    return " ".join(parts)
+
+
+def _image(rng: random.Random, sources: list[str], html_ratio: float, unknown_ratio: float = 0.1) -> str:
+    if rng.random() < unknown_ratio:
+        url = f"https://unknown{rng.randrange(5)}.example.com/{rng.randrange(10**6)}.png"
+    else:
+        url = f"{rng.choice(sources)}/img/{rng.randrange(10**6)}.png"
+    if rng.random() < html_ratio:
+        return f'<img src="{url}" width="{rng.randint(100, 800)}">'
+    return f"![img]({url})"
+
+
+def generate_vault(
+    root: Path,
+    files: int = 1000,
+    mean_size_kb: float = 4.0,
+    size_sigma: float = 1.0,
+    image_density: float = 2.0,
+    html_ratio: float = 0.2,
+    cjk_ratio: float = 0.5,
+    source_count: int = 4,
+    depth: int = 2,
+    fanout: int = 8,
+    seed: int = 0,
+) -> dict[str, str]:
+    """
+    在 root 下生成一个合成知识库并返回其中配置的 sources。
+
+    - files：Markdown 文件数量
+    - mean_size_kb / size_sigma：文件大小服从对数正态分布，mean_size_kb 为中位数
+    - image_density：每 KB 文本中的图片数量
+    - html_ratio：图片中使用 <img> 标签的比例，其余为 Markdown 语法
+    - cjk_ratio：文本中 CJK 词组所占的比例
+    - source_count：sources.toml 中的来源数量
+    - depth / fanout：目录层数和每层的子目录数量
+    """
+    rng = random.Random(seed)
+    sources = {f"src{i}": f"http://10.0.{i // 256}.{i % 256}:8080" for i in range(source_count)}
+    prefixes = list(sources.values())
+
+    parkive_dir = root / ".parkive"
+    parkive_dir.mkdir(parents=True, exist_ok=True)
+    (parkive_dir / "sources.toml").write_text(
+        "[sources]\n" + "".join(f'{name} = "{url}"\n' for name, url in sources.items()),
+        encoding="utf-8",
+    )
+    (parkive_dir / "config.toml").write_text(
+        '[scope]\nscan_glob = ["*.md", "**/*.md"]\nskip_dirs = [".git", ".parkive"]\n',
+        encoding="utf-8",
+    )
+
+    for i in range(files):
+        rel_dir = Path(*(f"d{rng.randrange(fanout)}" for _ in range(rng.randint(0, depth))))
+        size = int(rng.lognormvariate(0, size_sigma) * mean_size_kb * 1024)
+        images = max(0, round(size / 1024 * image_density))
+        paragraphs = []
+        written = 0
+        while written < size or images > 0:
+            paragraph = _paragraph(rng, rng.randint(20, 80), cjk_ratio)
+            if images > 0:
+                paragraph += " " + _image(rng, prefixes, html_ratio)
+                images -= 1
+            paragraphs.append(paragraph)
+            written += len(paragraph.encode("utf-8"))
+        target = root / rel_dir / f"note{i:06d}.md"
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text("\n\n".join(paragraphs) + "\n", encoding="utf-8")
+
+        # 图片目录，用于衡量遍历时跳过非 Markdown 文件的开销
+        if i % 50 == 0:
+            assets = root / rel_dir / "assets"
+            assets.mkdir(exist_ok=True)
+            for j in range(10):
+                (assets / f"{i:06d}-{j}.png").write_bytes(b"\x89PNG\r\n")
+
+    return sources
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--mean-size-kb", type=float, default=4.0)
+    parser.add_argument("--size-sigma", type=float, default=1.0)
+    parser.add_argument("--image-density", type=float, default=2.0)
+    parser.add_argument("--html-ratio", type=float, default=0.2)
+    parser.add_argument("--cjk-ratio", type=float, default=0.5)
+    parser.add_argument("--sources", dest="source_count", type=int, default=4)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def generator_params(args: argparse.Namespace) -> dict:
+    names = ["files", "mean_size_kb", "size_sigma", "image_density", "html_ratio", "cjk_ratio", "source_count", "depth", "fanout", "seed"]
+    return {name: getattr(args, name) for name in names}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", type=Path, help="Directory to create the vault in")
+    add_arguments(parser)
+    args = parser.parse_args()
+    generate_vault(args.root, **generator_params(args))
+    print(f"generated {args.files} files in {args.root}")
+
+
+if __name__ == "__main__":
+    main()
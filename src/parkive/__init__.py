@@ -1,4 +1,18 @@
-from .cli import app
+__all__ = ["Vault", "main"]
+
+
+def __getattr__(name: str):
+    # 进程内 API 和命令行按需导入：命令行启动时不加载 Vault，使用 Vault 时也不加载 typer 和各个子命令
+    if name == "app":
+        from .cli import app
+        return app
+    if name == "Vault":
+        from .vault import Vault
+        return Vault
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def main() -> None:
+    from .cli import app
+
     app()
@@ -1,100 +1,179 @@
 from pathlib import Path
 from rich.console import Console
-from rich.logging import RichHandler
 from typing import Annotated
-from .source import source_app
-from .git import git_app
-from .tool import tool_app
+from typer.core import TyperGroup
+from .config import find_parkive_root
+from .stats import stats
 from . import config
 
 import os
 import typer
 import logging
-import tomllib
+import importlib
 
 # 创建 Rich 控制台实例
 console = Console()
 
 
-# 配置日志
-level = os.getenv("PARKIVE_LOG_LEVEL", "WARNING").upper()
-if level not in ["TRACE", "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]:
-    level = "WARNING"
+def configure_logging() -> None:
+    """
+    只有设置了 PARKIVE_LOG_LEVEL 时才配置 Rich 日志输出，未设置时不导入 rich.logging。
+    程序中没有 WARNING 及以上级别的日志，未配置时的行为与默认级别 WARNING 相同。
+    """
+    level = os.getenv("PARKIVE_LOG_LEVEL")
+    if level is None:
+        return
+    level = level.upper()
+    if level not in ["TRACE", "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]:
+        level = "WARNING"
+
+    from rich.logging import RichHandler
+    logging.basicConfig(
+        level=getattr(logging, level),
+        format="%(message)s",
+        datefmt="[%X]",
+        handlers=[RichHandler(console=console)],
+    )
+
 
-logging.basicConfig(
-    level=getattr(logging, level),
-    format="%(message)s",
-    datefmt="[%X]",
-    handlers=[RichHandler(console=console)],
-)
+configure_logging()
 log = logging.getLogger("__name__")
 
 
-# 主 CLI 应用
-app = typer.Typer(no_args_is_help=True, help="Parkive - A tool for managing your personal archive of notes and images.")
-app.add_typer(source_app, name="source", help="Image source management")
-app.add_typer(git_app, name="git", help="Git operations related to Parkive")
-app.add_typer(tool_app, name="tool", help="Utility tools for Parkive")
+# 子命令组：名称 => (模块, Typer 实例名, 帮助文本)。模块只在调用对应子命令时才导入
+LAZY_SUBCOMMANDS = {
+    "source": (".source", "source_app", "Image source management"),
+    "git": (".git", "git_app", "Git operations related to Parkive"),
+    "tool": (".tool", "tool_app", "Utility tools for Parkive"),
+    "vaults": (".registry", "vaults_app", "Registry of vaults used by --all-vaults"),
+}
 
 
-def find_parkive_root(start: Path | None = None) -> Path | None:
+class LazyGroup(TyperGroup):
     """
-    寻找包含 .parkive 目录的路径，从 start 开始向上查找，直到找到为止。如果没有找到，则返回 None。
+    按需加载子命令组的顶层命令组。生成帮助信息时只使用 LAZY_SUBCOMMANDS 中的帮助文本，不导入任何子命令模块，
+    解析到某个子命令时才导入对应模块，因此 parkive git sync 不会加载扫描、索引等与之无关的代码。
     """
-    current = (start or Path.cwd()).resolve()
-    for candidate in [current, *current.parents]:
-        if (candidate / ".parkive").is_dir():
-            return candidate
-    return None
+
+    _listing = False
+
+    def list_commands(self, ctx: typer.Context) -> list[str]:
+        return [*super().list_commands(ctx), *LAZY_SUBCOMMANDS]
+
+    def get_command(self, ctx: typer.Context, cmd_name: str):
+        command = super().get_command(ctx, cmd_name)
+        if command is not None or cmd_name not in LAZY_SUBCOMMANDS:
+            return command
+        module_name, attr, help_text = LAZY_SUBCOMMANDS[cmd_name]
+        if self._listing:
+            return TyperGroup(name=cmd_name, help=help_text)
+        command = typer.main.get_group(getattr(importlib.import_module(module_name, __package__), attr))
+        command.help = help_text
+        self.add_command(command, cmd_name)
+        return command
+
+    def parse_args(self, ctx: typer.Context, args: list[str]) -> list[str]:
+        rest = super().parse_args(ctx, args)
+        # 子命令的选项在回调之后才解析，bootstrap 需要提前知道是否指定了 --all-vaults
+        ctx.meta["parkive.all_vaults"] = self._all_vaults_requested(ctx)
+        return rest
+
+    def _all_vaults_requested(self, ctx: typer.Context) -> bool:
+        """
+        以 resilient_parsing 模式预先解析子命令及其参数，读取子命令的 all_vaults 选项。
+        只有作为选项给出的 --all-vaults 才算数，-- 之后的参数和其他选项的值（例如 tool search -- --all-vaults）不会被误认。
+        """
+        args = [*ctx._protected_args, *ctx.args]
+        if "--all-vaults" not in args:
+            return False
+        command, parent = self, ctx
+        try:
+            while isinstance(command, TyperGroup) and args:
+                name, command, args = command.resolve_command(parent, args)
+                parent = command.make_context(name, list(args), parent=parent, resilient_parsing=True)
+                args = [*parent._protected_args, *parent.args]
+        except Exception:
+            # 命令不存在等错误由之后正常的解析流程报告
+            return False
+        return parent is not ctx and bool(parent.params.get("all_vaults"))
+
+    def format_help(self, ctx: typer.Context, formatter) -> None:
+        self._listing = True
+        try:
+            super().format_help(ctx, formatter)
+        finally:
+            self._listing = False
+
+
+# 主 CLI 应用
+app = typer.Typer(cls=LazyGroup, no_args_is_help=True, help="Parkive - A tool for managing your personal archive of notes and images.")
 
 
 def load_user_config(parkive_root: Path) -> dict:
     """
     加载用户配置文件，如果存在的话。返回一个包含配置的字典。
     """
-    user_config: dict = {
-        "scope" : {
-            "scan_glob": list(config.DEFAULT_SCAN_GLOB),
-            "skip_dirs": list(config.DEFAULT_SKIP_DIRS)
-        }
-    }
-
     user_config_path = parkive_root / ".parkive" / "config.toml"
     if not user_config_path.is_file():
         console.print(
             f"No user config found at {user_config_path}. Using default configuration.",
             style=config.warning_style,
         )
-        return user_config
-    
     try:
-        with user_config_path.open("rb") as f:
-            loaded = tomllib.load(f)
-        scan_glob = loaded.get("scope", {}).get("scan_glob", None)
-        skip_dirs = loaded.get("scope", {}).get("skip_dirs", None)
-        if isinstance(scan_glob, list) and all(isinstance(i, str) for i in scan_glob):
-            user_config["scope"]["scan_glob"] = scan_glob
-        if isinstance(skip_dirs, list) and all(isinstance(i, str) for i in skip_dirs):
-            user_config["scope"]["skip_dirs"] = skip_dirs
-        log.debug(f"User config loaded from {user_config_path}: {user_config}")
-        return user_config
+        user_config = config.read_user_config(parkive_root)
     except Exception as e:
         console.print(
             f"Failed to load user config from {user_config_path}: {e}",
             style=config.error_style,
         )
         raise typer.Exit(code=1)
+    log.debug(f"User config loaded from {user_config_path}: {user_config}")
+    return user_config
+
+
+def start_profiling(ctx: typer.Context, profile: bool, stats_json: str | None, top: int, cprofile: Path | None) -> None:
+    """
+    根据全局选项启用性能统计和 cProfile，并在命令结束（包括出错退出）时输出结果。
+    """
+    stats.reset(enabled=profile or stats_json is not None, top=top)
+    profiler = None
+    if cprofile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def finish() -> None:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile)
+            log.debug(f"cProfile stats written to {cprofile}")
+        if profile:
+            stats.print_summary(Console(stderr=True))
+        if stats_json is not None:
+            stats.write_json(stats_json)
+
+    ctx.call_on_close(finish)
 
 
 @app.callback()
-def bootstrap(ctx: typer.Context):
+def bootstrap(ctx: typer.Context,
+              profile: Annotated[bool, typer.Option("--profile", help="Print per-phase timings, counters and the slowest files to stderr when the command finishes.")] = False,
+              stats_json: Annotated[str | None, typer.Option("--stats-json", help="Write the same statistics as JSON to the given file ('-' for stdout).")] = None,
+              profile_top: Annotated[int, typer.Option("--profile-top", help="Number of slowest files reported by --profile and --stats-json.")] = 10,
+              cprofile: Annotated[Path | None, typer.Option("--cprofile", help="Run the command under cProfile and dump the stats to the given file, e.g. for snakeviz or pstats. Only the main process is profiled.")] = None):
     """
+     - 启用性能统计
      - 寻找包含 .parkive 目录
      - 加载用户配置文件
     """
+    start_profiling(ctx, profile, stats_json, profile_top, cprofile)
     log.debug("This program is running in directory: " + str(Path.cwd()))
     
-    if ctx.invoked_subcommand == "init":
+    if ctx.invoked_subcommand in ["init", "vaults"]:
+        return
+    # 指定 --all-vaults 时命令作用于注册的所有知识库，不需要当前目录属于某个知识库
+    if ctx.meta.get("parkive.all_vaults"):
+        ctx.obj = {"parkive_root": None, "user_config": None}
         return
 
     parkive_root = find_parkive_root()
@@ -139,3 +218,18 @@ def init(path : Annotated[str | None, typer.Argument(help="Path to initialize th
         config_path.write_text(config_text, encoding="utf-8")
 
     console.print(f"initialized parkive at {target_dir}", style=config.success_style)
+
+
+@app.command("watch")
+def watch(ctx: typer.Context,
+          debounce: Annotated[float, typer.Option("--debounce", help="Seconds to wait for further changes before a batch of changes is processed.")] = 0.3,
+          sync_after: Annotated[float | None, typer.Option("--sync-after", help="Run 'git sync' after the vault has been quiet for this many seconds following a change. Disabled by default.")] = None,
+          poll: Annotated[bool, typer.Option("--poll", help="Poll for changes instead of using inotify. Polling is also used where inotify is unavailable.")] = False,
+          interval: Annotated[float, typer.Option("--interval", help="Polling interval in seconds.")] = 2.0,
+          jobs: Annotated[int | None, typer.Option("--jobs", "-j", help="Number of worker processes used to parse files. Defaults to the CPU count; small file sets are always processed serially.")] = None):
+    """Watch managed files and keep the scan index, source usage and word counts up to date."""
+    from .source import load_sources
+    from .watch import run_watch
+
+    parkive_root = Path(ctx.obj["parkive_root"])
+    run_watch(parkive_root, ctx.obj["user_config"], load_sources(parkive_root), debounce, sync_after, poll, interval, jobs)
@@ -1,30 +1,177 @@
 from pathlib import Path, PurePosixPath
+from collections import deque
+from contextlib import contextmanager
+from .stats import stats
 import os
+import re
+import glob
+import mmap
+import time
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
-def iter_files_to_process(parkive_root: Path, scan_glob: list[str], skip_dirs: list[str], specified_files: list[str] | None = None):
+
+# 文件数少于该值时多进程的启动开销大于收益，直接串行处理
+PARALLEL_MIN_FILES = 64
+PARALLEL_MAX_BATCH = 256
+# 不小于该大小的文件通过 mmap 按字节扫描，不解码整个文件
+LARGE_FILE_BYTES = 32 * 1024 * 1024
+
+
+def iter_files_to_process(parkive_root: Path, scan_glob: list[str], skip_dirs: list[str], specified_files: list[str] | None = None,
+                          changed: bool = False, since: str | None = None):
     """根据参数将调用分流到不同的生成器函数"""
     if specified_files is not None:
-        yield from iter_specified_files(specified_files)
+        files = iter_specified_files(specified_files)
+    elif changed or since is not None:
+        files = iter_changed_files(parkive_root, scan_glob, skip_dirs, since)
     else:
-        yield from iter_managed_files(parkive_root, scan_glob, skip_dirs)
+        files = iter_managed_files(parkive_root, scan_glob, skip_dirs)
+    matched = 0
+    try:
+        for file_path in files:
+            matched += 1
+            yield file_path
+    finally:
+        stats.count("files matched", matched)
 
 
-def iter_managed_files(parkive_root: Path, scan_glob: list[str], skip_dirs: list[str]):
-    skip_set = set(skip_dirs)
-    normalized_globs = [pattern.strip().strip("'\"`") for pattern in scan_glob]     #去除空白和引号，避免用户配置中的格式问题导致匹配失败
+def _compile_segment(part: str) -> str:
+    # glob.translate 生成形如 (?s:...)\Z 的正则，去掉结尾的 \Z 以便拼接
+    return glob.translate(part, recursive=False, include_hidden=True, seps="/")[:-2]
+
+
+class PathMatcher:
+    """
+    将一组 glob 模式预先编译好，判断相对 posix 路径是否匹配其中任意一个，结果与对每个模式调用 PurePosixPath.match 相同：
+    相对模式从右侧逐段匹配，"**" 等同于 "*"，区分大小写；绝对模式不可能匹配相对路径，直接忽略。
+
+    所有模式的最后一段合并为一个正则，先用文件名做一次匹配即可排除绝大多数文件；
+    只有一段的模式在文件名匹配时即可确定结果，多段模式才需要逐段比较。
+    """
+
+    def __init__(self, patterns: list[str]):
+        single_segments = []
+        last_segments = []
+        self._multi_segment_patterns = []
+        for pattern in patterns:
+            pattern_path = PurePosixPath(pattern)
+            if not pattern_path.parts:
+                raise ValueError("empty pattern")
+            if pattern_path.anchor:
+                continue
+            segments = [_compile_segment(part) for part in pattern_path.parts]
+            last_segments.append(segments[-1])
+            if len(segments) == 1:
+                single_segments.append(segments[0])
+            else:
+                self._multi_segment_patterns.append([re.compile(seg).fullmatch for seg in reversed(segments)])
+        self._name_re = re.compile("|".join(last_segments) or r"(?!)")
+        self._single_re = re.compile("|".join(single_segments) or r"(?!)")
+
+    def match_name(self, name: str) -> bool:
+        """只检查最后一段，用于在拼接完整路径之前快速排除文件。"""
+        return self._name_re.fullmatch(name) is not None
+
+    def match(self, rel_path: str) -> bool:
+        name = rel_path.rpartition("/")[2]
+        if self._single_re.fullmatch(name) is not None:
+            return True
+        if not self._multi_segment_patterns:
+            return False
+        parts = rel_path.split("/")[::-1]
+        for segments in self._multi_segment_patterns:
+            if len(parts) >= len(segments) and all(seg(part) for seg, part in zip(segments, parts)):
+                return True
+        return False
+
+
+def _is_glob_pattern(pattern: str) -> bool:
+    return any(c in pattern for c in "*?[")
+
+
+class DirFilter:
+    """
+    判断目录是否应被跳过。skip_dirs 中不含通配符的项按目录名精确比较；
+    含通配符的项作为 glob 模式，按 PurePosixPath.match 的规则与目录的相对路径匹配，
+    例如 "node_modules"、"*.assets"、"attachments/*"。
+    """
+
+    def __init__(self, skip_dirs: list[str]):
+        self._names = {d for d in skip_dirs if not _is_glob_pattern(d)}
+        patterns = [d.strip("/") for d in skip_dirs if _is_glob_pattern(d)]
+        self._matcher = PathMatcher(patterns) if patterns else None
+
+    def skip(self, name: str, rel_path: str) -> bool:
+        if name in self._names:
+            return True
+        return self._matcher is not None and self._matcher.match(rel_path)
+
+
+def iter_managed_files(parkive_root: Path, scan_glob: list[str], skip_dirs: list[str], visited_dirs: list[str] | None = None):
     """
     迭代 parkive_root 下所有匹配 scan_glob 模式的文件，跳过 skip_dirs 中的目录。返回一个生成器，生成 Path 对象。
+    遍历顺序与 os.walk 相同，被跳过的目录不会进入；只有匹配的文件才会创建 Path 对象。
+    给出 visited_dirs 时，每个读取过的目录路径都会被追加到其中。
     """
-    for root, dirs, files in os.walk(parkive_root):
-        dirs[:] = [d for d in dirs if d not in skip_set]
-        root_path = Path(root)
-        for filename in files:
-            file_path = root_path / filename
-            rel = file_path.relative_to(parkive_root).as_posix()
-            rel_path = PurePosixPath(rel)
-            if any(rel_path.match(pattern) for pattern in normalized_globs):
-                yield file_path
+    normalized_globs = [pattern.strip().strip("'\"`") for pattern in scan_glob]     #去除空白和引号，避免用户配置中的格式问题导致匹配失败
+    matcher = PathMatcher(normalized_globs)
+    dir_filter = DirFilter(skip_dirs)
+
+    stack = [(str(parkive_root), "")]
+    while stack:
+        dir_path, rel_dir = stack.pop()
+        try:
+            with os.scandir(dir_path) as it:
+                entries = list(it)
+        except OSError:
+            # 与 os.walk 一致，忽略无法读取的目录
+            continue
+        if visited_dirs is not None:
+            visited_dirs.append(dir_path)
+        stats.count("files walked", len(entries))
+
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                rel_path = rel_dir + entry.name
+                if not entry.is_symlink() and not dir_filter.skip(entry.name, rel_path):
+                    subdirs.append((entry.path, rel_path + "/"))
+            elif matcher.match_name(entry.name) and matcher.match(rel_dir + entry.name):
+                yield Path(entry.path)
+        stack.extend(reversed(subdirs))
+
+
+def iter_changed_files(parkive_root: Path, scan_glob: list[str], skip_dirs: list[str], since: str | None = None):
+    """
+    迭代 git 报告的有变化的文件（未提交的修改和未跟踪的文件，指定 since 时还包括自该提交以来的修改），
+    并按照与 iter_managed_files 相同的 scan_glob 和 skip_dirs 规则过滤，只需遍历变化的文件而不是整个知识库。
+    """
+    from .git import list_changed_files
+
+    normalized_globs = [pattern.strip().strip("'\"`") for pattern in scan_glob]
+    matcher = PathMatcher(normalized_globs)
+    dir_filter = DirFilter(skip_dirs)
+    root = parkive_root.resolve()
+
+    for file_path in list_changed_files(parkive_root, since):
+        try:
+            rel_path = file_path.relative_to(root).as_posix()
+        except ValueError:
+            continue
+        dir_names = rel_path.split("/")[:-1]
+        if any(dir_filter.skip(name, "/".join(dir_names[: i + 1])) for i, name in enumerate(dir_names)):
+            continue
+        if matcher.match(rel_path):
+            yield parkive_root / rel_path
 
 
 def iter_specified_files(specified_files: list[str]):
@@ -36,3 +183,166 @@ def iter_specified_files(specified_files: list[str]):
         file_path = (cwd / rel_path).resolve()
         if file_path.is_file():
             yield file_path
+
+
+def parkive_state_dir(parkive_root: Path, name: str) -> Path:
+    """
+    返回 .parkive 下用于存放运行时数据（缓存、日志等）的子目录，不存在时创建。
+    目录中会写入一个忽略全部内容的 .gitignore，避免这些数据被 git sync 提交。
+    """
+    state_dir = parkive_root / ".parkive" / name
+    state_dir.mkdir(parents=True, exist_ok=True)
+    gitignore = state_dir / ".gitignore"
+    if not gitignore.exists():
+        gitignore.write_text("*\n", encoding="utf-8")
+    return state_dir
+
+
+def acquire_lock(path: Path, blocking: bool = True):
+    """对 path 加排他锁，返回持有锁的文件对象（关闭即释放），非阻塞模式下锁已被占用时返回 None。"""
+    f = open(path, "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        if blocking:
+            raise
+        return None
+    return f
+
+
+def resolve_jobs(jobs: int | None) -> int:
+    """将 --jobs 参数解析为实际的进程数，未指定或不大于 0 时使用 CPU 数量。"""
+    if jobs is None or jobs <= 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def _run_batch(func, batch: list, args: tuple) -> list:
+    return [func(item, *args) for item in batch]
+
+
+def _timed_call(func, item, args: tuple) -> tuple:
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func(item, *args)
+    size = item.stat().st_size if isinstance(item, Path) else 0
+    return result, time.perf_counter() - wall, time.process_time() - cpu, size
+
+
+def _run_batch_timed(func, batch: list, args: tuple) -> list:
+    return [_timed_call(func, item, args) for item in batch]
+
+
+def _record_timed(item, timed: tuple):
+    result, wall, cpu, size = timed
+    stats.record_file(item.get("path") if isinstance(item, dict) else item, wall, cpu)
+    stats.count("bytes read", size)
+    return result
+
+
+class FileMapper:
+    """
+    边提交边取回结果的 map_files：submit 逐个提交文件，ready 生成已经处理完的 (item, result)，finish 处理剩余的文件并生成其余结果，
+    结果都按提交顺序生成。先提交的文件处理完就可以取回，不必等到全部文件都提交之后。
+    jobs 不大于 1 时 submit 直接在当前进程中处理；否则攒够 PARALLEL_MIN_FILES 个文件后启动进程池，每凑够 batch_size 个文件提交一批，
+    提交的文件一直不足 PARALLEL_MIN_FILES 个时由 finish 在当前进程中处理。应在 with 语句中使用，退出时关闭进程池。
+    """
+
+    def __init__(self, func, jobs: int | None = None, args: tuple = (), batch_size: int = PARALLEL_MIN_FILES, workers: int | None = None):
+        self.func = func
+        self.args = args
+        self.jobs = resolve_jobs(jobs)
+        self.batch_size = batch_size
+        self.workers = self.jobs if workers is None else max(1, min(self.jobs, workers))
+        self._batch: list = []
+        self._done: deque = deque()
+        self._futures: deque = deque()
+        self._pool = None
+
+    def __enter__(self) -> "FileMapper":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def _call(self, item):
+        if stats.enabled:
+            return _record_timed(item, _timed_call(self.func, item, self.args))
+        return self.func(item, *self.args)
+
+    def _flush(self, final: bool = False) -> None:
+        while len(self._batch) >= self.batch_size or (final and self._batch):
+            if self._pool is None:
+                # 进程池只在需要并行时才导入，multiprocessing 的导入开销不计入串行命令的启动时间
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            batch, self._batch = self._batch[: self.batch_size], self._batch[self.batch_size :]
+            run_batch = _run_batch_timed if stats.enabled else _run_batch
+            self._futures.append((batch, self._pool.submit(run_batch, self.func, batch, self.args)))
+
+    def _collect(self, batch: list, future):
+        results = future.result()
+        if stats.enabled:
+            results = [_record_timed(item, timed) for item, timed in zip(batch, results)]
+        return zip(batch, results)
+
+    def submit(self, item) -> None:
+        if self.jobs <= 1:
+            self._done.append((item, self._call(item)))
+            return
+        self._batch.append(item)
+        if self._pool is not None or len(self._batch) >= PARALLEL_MIN_FILES:
+            self._flush()
+
+    def ready(self):
+        """不等待，生成已经处理完的结果。"""
+        while self._done:
+            yield self._done.popleft()
+        while self._futures and self._futures[0][1].done():
+            yield from self._collect(*self._futures.popleft())
+
+    def finish(self):
+        """处理剩余的文件，按顺序生成所有尚未取回的结果。"""
+        yield from self.ready()
+        if self._pool is None:
+            batch, self._batch = self._batch, []
+            for item in batch:
+                yield item, self._call(item)
+            return
+        self._flush(final=True)
+        while self._futures:
+            yield from self._collect(*self._futures.popleft())
+
+
+def map_files(func, files, jobs: int | None = None, *args):
+    """
+    对 files 中的每一项调用 func(item, *args)，按输入顺序生成 (item, result)。
+    jobs 大于 1 且文件足够多时，文件会被切分成若干批次交给进程池处理，func 必须是模块级函数。
+    启用性能统计时，每一项的耗时在工作进程中测量，随结果一起返回给主进程记录。
+    """
+    files = list(files)
+    jobs = resolve_jobs(jobs)
+    # 每个进程分到约 4 个批次，兼顾负载均衡和进程间通信的开销
+    batch_size = max(1, min(PARALLEL_MAX_BATCH, len(files) // (jobs * 4)))
+    with FileMapper(func, jobs, args, batch_size, workers=-(-len(files) // batch_size)) as mapper:
+        for item in files:
+            mapper.submit(item)
+            yield from mapper.ready()
+        yield from mapper.finish()
+
+
+@contextmanager
+def mapped_file(file_path: Path):
+    """以只读方式将文件映射到内存，产出可供字节模式正则和 hashlib 使用的 mmap 对象（空文件产出 b""）。"""
+    with file_path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
@@ -1,3 +1,9 @@
+from pathlib import Path
+
+import os
+import tomllib
+
+
 # Rich styles for CLI output
 error_style = "red bold"
 success_style = "green bold"
@@ -7,4 +13,68 @@ info_style = "dim cyan bold"
 
 # 默认配置
 DEFAULT_SCAN_GLOB = ["*.md", "**/*.md"]
-DEFAULT_SKIP_DIRS = [".git", ".parkive"]
\ No newline at end of file
+DEFAULT_SKIP_DIRS = [".git", ".parkive"]
+
+
+def user_config_dir() -> Path:
+    """
+    用户级（不属于任何知识库）的配置目录：优先使用环境变量 PARKIVE_CONFIG_DIR，
+    否则 Windows 上为 %APPDATA%\\parkive，其他系统为 $XDG_CONFIG_HOME/parkive（默认 ~/.config/parkive）。
+    """
+    override = os.getenv("PARKIVE_CONFIG_DIR")
+    if override:
+        return Path(override).expanduser()
+    if os.name == "nt" and os.getenv("APPDATA"):
+        return Path(os.environ["APPDATA"]) / "parkive"
+    return Path(os.getenv("XDG_CONFIG_HOME") or Path.home() / ".config") / "parkive"
+
+
+def find_parkive_root(start: Path | None = None) -> Path | None:
+    """
+    寻找包含 .parkive 目录的路径，从 start 开始向上查找，直到找到为止。如果没有找到，则返回 None。
+    """
+    current = (start or Path.cwd()).resolve()
+    for candidate in [current, *current.parents]:
+        if (candidate / ".parkive").is_dir():
+            return candidate
+    return None
+
+
+def read_user_config(parkive_root: Path) -> dict:
+    """
+    读取 .parkive/config.toml，返回 {"scope": {"scan_glob", "skip_dirs"}}；文件不存在或某一项格式不对时使用默认值。
+    文件无法读取或不是合法的 TOML 时抛出 OSError / tomllib.TOMLDecodeError，由调用方决定如何报告。
+    """
+    user_config: dict = {
+        "scope": {
+            "scan_glob": list(DEFAULT_SCAN_GLOB),
+            "skip_dirs": list(DEFAULT_SKIP_DIRS),
+        }
+    }
+    user_config_path = parkive_root / ".parkive" / "config.toml"
+    if not user_config_path.is_file():
+        return user_config
+    with user_config_path.open("rb") as f:
+        loaded = tomllib.load(f)
+    scan_glob = loaded.get("scope", {}).get("scan_glob", None)
+    skip_dirs = loaded.get("scope", {}).get("skip_dirs", None)
+    if isinstance(scan_glob, list) and all(isinstance(i, str) for i in scan_glob):
+        user_config["scope"]["scan_glob"] = scan_glob
+    if isinstance(skip_dirs, list) and all(isinstance(i, str) for i in skip_dirs):
+        user_config["scope"]["skip_dirs"] = skip_dirs
+    return user_config
+
+
+def read_sources(parkive_root: Path) -> dict[str, str]:
+    """
+    读取 .parkive/sources.toml 中的 {来源名: base_url}，文件不存在时返回空字典，忽略值不是字符串的项。
+    sources 不是表时抛出 ValueError，文件无法读取或解析时抛出 OSError / tomllib.TOMLDecodeError。
+    """
+    config_path = parkive_root / ".parkive" / "sources.toml"
+    if not config_path.is_file():
+        return {}
+    with config_path.open("rb") as f:
+        sources = tomllib.load(f).get("sources", {})
+    if not isinstance(sources, dict):
+        raise ValueError(f"Invalid format in {config_path}: 'sources' should be a table.")
+    return {k: v for k, v in sources.items() if isinstance(v, str)}
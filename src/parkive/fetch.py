@@ -0,0 +1,281 @@
+from pathlib import Path
+from urllib.parse import quote, urljoin, urlsplit
+from .common import parkive_state_dir
+from .stats import stats
+
+import os
+import json
+import time
+import hashlib
+import asyncio
+import logging
+import threading
+import http.client
+
+
+log = logging.getLogger(__name__)
+
+LINK_CACHE_VERSION = 1
+LINK_CACHE_FILENAME = "links.json"
+
+USER_AGENT = "parkive"
+MAX_REDIRECTS = 5
+# 部分服务器不支持 HEAD，对这些状态码改用只请求第一个字节的 GET 再试一次
+HEAD_FALLBACK_STATUSES = {400, 403, 405, 501}
+# 响应体超过这个大小时不再读完，直接关闭连接而不放回连接池
+MAX_DRAIN_BYTES = 64 * 1024
+DOWNLOAD_CHUNK_BYTES = 256 * 1024
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+# 保留 URL 中已有的转义序列和保留字符，只转义空格、非 ASCII 字符等 http.client 不接受的字符
+_SAFE_URL_CHARS = "/%:@!$&'()*+,;=?~#[]"
+
+
+def is_checkable(url: str) -> bool:
+    return url.startswith(("http://", "https://"))
+
+
+class ConnectionPool:
+    """
+    按 (scheme, host, port) 保存空闲的 keep-alive 连接，供多个线程复用。
+    连接只在请求完成、响应体已读完且服务器没有要求关闭时放回池中。
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._idle: dict[tuple[str, str, int | None], list[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[str, str, int | None]) -> http.client.HTTPConnection:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        scheme, host, port = key
+        conn_cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        stats.count("connections opened")
+        return conn_cls(host, port, timeout=self.timeout)
+
+    def put(self, key: tuple[str, str, int | None], conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+def _request(pool: ConnectionPool, method: str, url: str, headers: dict[str, str] | None = None, sink=None) -> tuple[int, str | None]:
+    """
+    发送一次请求并返回 (状态码, Location 头)。
+    状态码为 200 且给出 sink 时由 sink(response) 读取响应体，否则丢弃响应体。
+    """
+    parts = urlsplit(url)
+    if not parts.hostname:
+        raise ValueError("missing host")
+    key = (parts.scheme, parts.hostname, parts.port)
+    target = quote(parts.path or "/", safe=_SAFE_URL_CHARS)
+    if parts.query:
+        target += "?" + quote(parts.query, safe=_SAFE_URL_CHARS)
+    headers = {"User-Agent": USER_AGENT, **(headers or {})}
+
+    for attempt in range(2):
+        conn = pool.get(key)
+        reused = conn.sock is not None
+        try:
+            conn.request(method, target, headers=headers)
+            response = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            # 空闲连接可能已被服务器关闭，换一个新连接重试一次
+            if reused and attempt == 0:
+                continue
+            raise
+        except BaseException:
+            conn.close()
+            raise
+        try:
+            if sink is not None and response.status == 200:
+                sink(response)
+            else:
+                response.read(MAX_DRAIN_BYTES)
+        except BaseException:
+            conn.close()
+            raise
+        if response.isclosed() and not response.will_close:
+            pool.put(key, conn)
+        else:
+            conn.close()
+        return response.status, response.getheader("Location")
+    raise AssertionError("unreachable")
+
+
+def _error_result(e: BaseException) -> dict:
+    return {"ok": False, "status": None, "error": str(e) or type(e).__name__}
+
+
+def _status_result(status: int) -> dict:
+    ok = 200 <= status < 300
+    return {"ok": ok, "status": status, "error": None if ok else http.client.responses.get(status, "HTTP error")}
+
+
+def probe_url(pool: ConnectionPool, url: str) -> dict:
+    """
+    检查一个图片 URL 是否可以访问，跟随最多 MAX_REDIRECTS 次重定向。
+    返回 {"ok", "status", "error"}：status 是最终的 HTTP 状态码，网络错误时为 None。
+    """
+    method = "HEAD"
+    redirects = 0
+    while True:
+        try:
+            status, location = _request(pool, method, url, {"Range": "bytes=0-0"} if method == "GET" else None)
+        except (OSError, http.client.HTTPException, ValueError, UnicodeError) as e:
+            return _error_result(e)
+        if method == "HEAD" and status in HEAD_FALLBACK_STATUSES:
+            method = "GET"
+            continue
+        if status in REDIRECT_STATUSES and location:
+            redirects += 1
+            if redirects > MAX_REDIRECTS:
+                return {"ok": False, "status": status, "error": "too many redirects"}
+            url = urljoin(url, location)
+            continue
+        return _status_result(status)
+
+
+def download_url(pool: ConnectionPool, url: str, part_path: Path) -> dict:
+    """
+    下载 url 到 part_path，跟随最多 MAX_REDIRECTS 次重定向，边下载边计算 SHA-256。
+    返回 {"ok", "status", "error", "sha256", "size"}；失败时删除 part_path。
+    """
+    digest = hashlib.sha256()
+    size = 0
+
+    def sink(response) -> None:
+        nonlocal digest, size
+        digest, size = hashlib.sha256(), 0
+        with part_path.open("wb") as f:
+            while chunk := response.read(DOWNLOAD_CHUNK_BYTES):
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+
+    redirects = 0
+    while True:
+        try:
+            status, location = _request(pool, "GET", url, sink=sink)
+        except (OSError, http.client.HTTPException, ValueError, UnicodeError) as e:
+            part_path.unlink(missing_ok=True)
+            return _error_result(e)
+        if status in REDIRECT_STATUSES and location and redirects < MAX_REDIRECTS:
+            redirects += 1
+            url = urljoin(url, location)
+            continue
+        if status != 200:
+            part_path.unlink(missing_ok=True)
+            result = _status_result(status)
+            if result["ok"]:
+                result = {"ok": False, "status": status, "error": "unexpected status"}
+            return result
+        stats.count("bytes downloaded", size)
+        return {"ok": True, "status": status, "error": None, "sha256": digest.hexdigest(), "size": size}
+
+
+async def _run_all(func, urls: list[str], pool: ConnectionPool, concurrency: int, per_host: int, on_result) -> None:
+    from concurrent.futures import ThreadPoolExecutor
+
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="parkive-fetch")
+    host_limits: dict[str, asyncio.Semaphore] = {}
+
+    async def run(url: str) -> None:
+        host = urlsplit(url).netloc.lower()
+        limit = host_limits.get(host)
+        if limit is None:
+            limit = host_limits[host] = asyncio.Semaphore(per_host)
+        async with limit:
+            result = await loop.run_in_executor(executor, func, pool, url)
+        on_result(url, result)
+
+    try:
+        await asyncio.gather(*(run(url) for url in urls))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def fetch_all(func, urls: list[str], timeout: float = 10.0, concurrency: int = 32, per_host: int = 4, on_result=None) -> dict[str, dict]:
+    """
+    对每个 url 并发调用 func(pool, url)，返回 {url: 结果}。
+    http.client 是阻塞的，请求在最多 concurrency 个线程中执行，由 asyncio 调度并限制每个主机同时最多 per_host 个请求；
+    同一主机的请求复用 keep-alive 连接。on_result(url, result) 在每个 URL 完成时于调用线程中被调用。
+    """
+    results: dict[str, dict] = {}
+
+    def collect(url: str, result: dict) -> None:
+        results[url] = result
+        stats.count("urls fetched")
+        if on_result is not None:
+            on_result(url, result)
+
+    pool = ConnectionPool(timeout)
+    try:
+        with stats.phase("fetch"):
+            asyncio.run(_run_all(func, urls, pool, max(1, concurrency), max(1, per_host), collect))
+    finally:
+        pool.close()
+    return results
+
+
+def check_urls(urls: list[str], timeout: float = 10.0, concurrency: int = 32, per_host: int = 4, on_result=None) -> dict[str, dict]:
+    """并发检查 urls 能否访问，返回 {url: probe_url 的结果}。"""
+    return fetch_all(probe_url, urls, timeout, concurrency, per_host, on_result)
+
+
+class LinkCache:
+    """
+    保存在 .parkive/cache/links.json 中的链接检查结果，键为 URL，记录检查时间。
+    超过 ttl 秒的结果视为过期，需要重新检查。
+    """
+
+    def __init__(self, parkive_root: Path, ttl: float):
+        self.parkive_root = parkive_root
+        self.ttl = ttl
+        self.path = parkive_root / ".parkive" / "cache" / LINK_CACHE_FILENAME
+        self.entries = self._load()
+        self.dirty = False
+
+    def _load(self) -> dict[str, dict]:
+        if not self.path.is_file():
+            return {}
+        try:
+            loaded = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            log.debug(f"Ignoring unreadable link cache {self.path}: {e}")
+            return {}
+        if not isinstance(loaded, dict) or loaded.get("version") != LINK_CACHE_VERSION:
+            return {}
+        return loaded.get("urls", {})
+
+    def get(self, url: str, now: float) -> dict | None:
+        entry = self.entries.get(url)
+        if entry is None or now - entry["checked"] > self.ttl:
+            return None
+        return entry
+
+    def put(self, url: str, result: dict, now: float) -> None:
+        self.entries[url] = {**result, "checked": now}
+        self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        now = time.time()
+        # 顺便丢弃已经过期的结果，避免缓存无限增长
+        entries = {url: entry for url, entry in self.entries.items() if now - entry["checked"] <= self.ttl}
+        parkive_state_dir(self.parkive_root, "cache")
+        tmp_path = self.path.with_name(LINK_CACHE_FILENAME + ".tmp")
+        tmp_path.write_text(json.dumps({"version": LINK_CACHE_VERSION, "urls": entries}, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self.dirty = False
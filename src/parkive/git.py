@@ -2,8 +2,12 @@ from typing import Annotated
 from pathlib import Path
 from datetime import datetime
 from rich.console import Console
-from .config import success_style, error_style, info_style
+from .config import success_style, error_style, info_style, warning_style
+from .output import OutputFormat
+from .stats import stats
 
+import io
+import time
 import typer
 import subprocess
 
@@ -16,29 +20,141 @@ def _git_cmd_text(args: list[str]) -> str:
     return "git " + " ".join(args)
 
 
-def _run_git(args: list[str], cwd: Path) -> subprocess.CompletedProcess[str]:
+def _format_elapsed(seconds: float) -> str:
+    return f"{seconds * 1000:.0f} ms" if seconds < 1 else f"{seconds:.2f} s"
+
+
+def _run_git(args: list[str], cwd: Path, input: str | None = None) -> subprocess.CompletedProcess[str]:
     cmd_text = _git_cmd_text(args)
+    start = time.perf_counter()
     with console.status(
         f"[bold cyan]Running:[/] {cmd_text}",
         spinner="circle",
     ):
         try:
-            result = subprocess.run(
-                ["git", *args],
-                cwd=str(cwd),
-                check=True,
-                capture_output=True,
-                text=True,
-                encoding="utf-8",
-                errors="replace",
-            )
+            with stats.phase(f"git {args[0]}"):
+                result = subprocess.run(
+                    ["git", *args],
+                    cwd=str(cwd),
+                    input=input,
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                    encoding="utf-8",
+                    errors="replace",
+                )
         except subprocess.CalledProcessError:
-            console.print(f"[red]✗[/red] {cmd_text}")
+            console.print(f"[red]✗[/red] {cmd_text} [dim]({_format_elapsed(time.perf_counter() - start)})[/dim]")
             raise
-    console.print(f"[green]✓[/green] {cmd_text}")
+    console.print(f"[green]✓[/green] {cmd_text} [dim]({_format_elapsed(time.perf_counter() - start)})[/dim]")
     return result
 
 
+def _git_output(args: list[str], cwd: Path) -> str:
+    """静默运行 git 命令并返回标准输出，用于查询仓库状态。"""
+    with stats.phase(f"git {args[0]}"):
+        result = subprocess.run(
+            ["git", *args],
+            cwd=str(cwd),
+            check=True,
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            errors="surrogateescape",
+        )
+    return result.stdout
+
+
+def _parse_porcelain_z(output: str) -> list[str]:
+    """解析 git status --porcelain -z 的输出，返回工作区中变化的路径（重命名只保留新路径）。"""
+    paths = []
+    fields = iter(output.split("\0"))
+    for field in fields:
+        if len(field) < 4:
+            continue
+        paths.append(field[3:])
+        if field[0] in "RC":
+            # 重命名和复制记录后面紧跟原路径
+            next(fields, None)
+    return paths
+
+
+def _parse_porcelain_v2_z(output: str) -> tuple[str | None, bool, list[str]]:
+    """
+    解析 git status --porcelain=v2 --branch -z 的输出，返回 (HEAD 提交，仓库还没有提交时为 None, 是否有任何变化, 需要暂存的路径)。
+    需要暂存的只有工作区中有修改的路径和未跟踪的路径；已经完整暂存的修改（包括 git mv、git rm）不需要再次 add。
+    """
+    head = None
+    dirty = False
+    paths = []
+    fields = iter(output.split("\0"))
+    for field in fields:
+        if field.startswith("# branch.oid "):
+            oid = field.removeprefix("# branch.oid ")
+            head = None if oid == "(initial)" else oid
+        elif field.startswith(("1 ", "2 ", "u ", "? ")):
+            dirty = True
+            # 普通修改、重命名、冲突和未跟踪的记录在路径前分别有 8、9、10、1 个以空格分隔的字段
+            path = field.split(" ", {"1": 8, "2": 9, "u": 10, "?": 1}[field[0]])[-1]
+            if field[0] in "?u" or field[3] != ".":
+                paths.append(path)
+            if field[0] == "2":
+                # 重命名记录后面紧跟原路径，原路径的删除已经在暂存区中
+                next(fields, None)
+    return head, dirty, paths
+
+
+def _worktree_status(cwd: Path) -> tuple[str | None, bool, list[str]]:
+    """用一次 git status 同时取得 HEAD 提交和 cwd 下的变化，路径相对仓库根目录。"""
+    output = _run_git(["status", "--porcelain=v2", "--branch", "-z", "--", "."], cwd=cwd).stdout
+    return _parse_porcelain_v2_z(output)
+
+
+def _ref_matches(cwd: Path, ref: str, commit: str) -> bool:
+    """判断 ref（例如远程跟踪分支）是否指向 commit。只读取本地记录的引用，不访问网络。"""
+    try:
+        return _git_output(["rev-parse", "--verify", "--quiet", ref], cwd).strip() == commit
+    except subprocess.CalledProcessError:
+        return False
+
+
+def _is_empty_commit(cwd: Path, commit: str) -> bool:
+    """判断 commit 的树与其父提交相同，即没有带来任何修改。"""
+    try:
+        trees = _git_output(["rev-parse", f"{commit}^{{tree}}", f"{commit}~1^{{tree}}"], cwd).split()
+    except subprocess.CalledProcessError:
+        return False
+    return len(trees) == 2 and trees[0] == trees[1]
+
+
+def _stage_paths(paths: list[str], cwd: Path) -> None:
+    """只暂存有变化的路径，代替对整个目录树的 git add .；路径相对仓库根目录，按字面匹配。"""
+    _run_git(
+        ["add", "--all", "--pathspec-from-file=-", "--pathspec-file-nul"],
+        cwd=cwd,
+        input="\0".join(f":(top,literal){path}" for path in paths),
+    )
+
+
+def list_changed_files(cwd: Path, since: str | None = None) -> list[Path]:
+    """
+    返回 cwd 目录下相对 HEAD 有未提交修改的文件（包括未跟踪的文件）；指定 since 时还包括自该提交以来修改过的文件。
+    已删除的文件不会出现在结果中。git 命令失败时打印错误信息并退出。
+    """
+    try:
+        toplevel = Path(_git_output(["rev-parse", "--show-toplevel"], cwd).strip())
+        changed = _parse_porcelain_z(_git_output(["status", "--porcelain", "-z", "--untracked-files=all", "--", "."], cwd))
+        if since is not None:
+            diff_output = _git_output(["diff", "--name-only", "-z", since, "--", "."], cwd)
+            changed.extend(p for p in diff_output.split("\0") if p)
+    except subprocess.CalledProcessError as e:
+        console.print(e.stderr.strip() or str(e), style=error_style)
+        raise typer.Exit(code=1)
+
+    files = {toplevel / rel_path for rel_path in changed}
+    return sorted(file_path for file_path in files if file_path.is_file())
+
+
 def _rollback_to_head(cwd: Path, start_head: str) -> None:
     # Use --mixed to avoid discarding user files while restoring branch history.
     args = ["reset", "--mixed", start_head]
@@ -62,40 +178,115 @@ def _rollback_to_head(cwd: Path, start_head: str) -> None:
         console.print(f"[red]✗[/red] {cmd_text}")
 
 
+def _queue_push(parkive_root: Path, args: list[str], commit: str) -> None:
+    """将推送加入 .parkive 中的队列并启动后台工作进程，不等待推送完成。"""
+    from .push_queue import PushQueue
+
+    queue = PushQueue(parkive_root)
+    merged = queue.enqueue(args, commit)
+    queue.start_worker()
+    note = " (merged with a pending push)" if merged else ""
+    console.print(f"queued git push {' '.join(args)}{note}; see 'parkive git queue'.", style=info_style)
+
+
 @git_app.command("sync")
-def git_sync(ctx: typer.Context):
+def git_sync(ctx: typer.Context,
+             background: Annotated[bool, typer.Option("--background", "-b", help="Commit now but push from a background worker that retries with backoff; see 'parkive git queue'.")] = False,
+             all_vaults: Annotated[bool, typer.Option("--all-vaults", help="Synchronize every vault registered with 'parkive vaults add' instead of the current one, several vaults at a time.")] = False,
+             concurrency: Annotated[int | None, typer.Option("--concurrency", help="With --all-vaults, the maximum number of vaults synchronized at the same time.")] = None):
     """Synchronize the local repository with the remote."""
-    parkive_root = Path(ctx.obj["parkive_root"])
+    if all_vaults:
+        _sync_all_vaults(background, concurrency)
+        return
+    sync_repository(Path(ctx.obj["parkive_root"]), background)
+
 
+def _sync_in_vault(root: Path, background: bool) -> str:
+    # 在 --all-vaults 的工作进程中执行：输出写入缓冲区（不是终端，也就不显示进度动画），由主进程按知识库分组打印
+    buffer = io.StringIO()
+    console.file = buffer
+    console.soft_wrap = True
     try:
-        start_head = _run_git(["rev-parse", "HEAD"], cwd=parkive_root).stdout.strip()
+        sync_repository(root, background)
+    except typer.Exit:
+        raise RuntimeError(buffer.getvalue().strip()) from None
+    return buffer.getvalue()
+
+
+def _sync_all_vaults(background: bool, concurrency: int | None) -> None:
+    """git sync --all-vaults：各知识库的 git 命令同时运行，总耗时接近最慢的一个知识库。"""
+    from .registry import finish_vaults, map_vaults, print_vault_header, registered_vaults, vault_workers
+
+    vaults = registered_vaults()
+    start = time.perf_counter()
+    outcomes: dict[str, dict] = {}
+    for name, root, outcome in map_vaults(_sync_in_vault, vaults, vault_workers(vaults, concurrency), background):
+        outcomes[name] = outcome
+        print_vault_header(name, root, outcome)
+        if "result" in outcome:
+            console.print(outcome["result"], end="", markup=False, highlight=False)
+    finish_vaults(outcomes, start)
+
+
+def sync_repository(parkive_root: Path, background: bool = False) -> None:
+    """
+    git sync 的实现：提交修改（修改到上一次提交中）并强制推送到 origin/main，也供 parkive watch 在空闲后调用。
+    失败时打印错误并抛出 typer.Exit。
+    """
+    start = time.perf_counter()
+
+    try:
+        start_head, dirty, unstaged = _worktree_status(parkive_root)
     except subprocess.CalledProcessError as e:
         console.print(e.stderr.strip() or str(e), style=error_style)
         raise typer.Exit(code=1)
+    if start_head is None:
+        console.print("the repository has no commits yet.", style=error_style)
+        raise typer.Exit(code=1)
+
+    if not dirty and _ref_matches(parkive_root, "refs/remotes/origin/main", start_head):
+        console.print("nothing to sync: working tree is clean and origin/main is up to date.", style=info_style)
+        return
 
     try:
-        _run_git(["add", "."], cwd=parkive_root)
-        _run_git(["commit", "--amend", "--no-edit"], cwd=parkive_root)
-        _run_git(["push", "origin", "main", "--force"], cwd=parkive_root)
+        if unstaged:
+            _stage_paths(unstaged, parkive_root)
+        if dirty:
+            _run_git(["commit", "--amend", "--no-edit"], cwd=parkive_root)
+        if background:
+            _queue_push(parkive_root, ["origin", "main", "--force"], _git_output(["rev-parse", "HEAD"], parkive_root).strip())
+        else:
+            _run_git(["push", "origin", "main", "--force"], cwd=parkive_root)
     except subprocess.CalledProcessError as e:
         _rollback_to_head(parkive_root, start_head)
         console.print("sync failed and local branch has been rolled back.", style=error_style)
         console.print(e.stderr.strip() or str(e), style=error_style)
         raise typer.Exit(code=1)
 
-    console.print("sync finished.", style=success_style)
+    console.print(f"sync finished in {_format_elapsed(time.perf_counter() - start)}.", style=success_style)
 
 
 @git_app.command("snapshot")
-def git_snapshot(ctx: typer.Context, message: Annotated[str | None, typer.Option("--message", "-m", help="Message for the snapshot commit")] = None):
+def git_snapshot(ctx: typer.Context,
+                 message: Annotated[str | None, typer.Option("--message", "-m", help="Message for the snapshot commit")] = None,
+                 background: Annotated[bool, typer.Option("--background", "-b", help="Commit now but push from a background worker that retries with backoff; see 'parkive git queue'.")] = False):
     """Create a snapshot commit with the current state of the repository. This will create a new commit with the specified message (or a default message with the current date if not provided) and push it to the remote repository. The previous commit will be amended to keep the history clean."""
     parkive_root = Path(ctx.obj["parkive_root"])
+    start = time.perf_counter()
 
     try:
-        start_head = _run_git(["rev-parse", "HEAD"], cwd=parkive_root).stdout.strip()
+        start_head, dirty, unstaged = _worktree_status(parkive_root)
     except subprocess.CalledProcessError as e:
         console.print(e.stderr.strip() or str(e), style=error_style)
         raise typer.Exit(code=1)
+    if start_head is None:
+        console.print("the repository has no commits yet.", style=error_style)
+        raise typer.Exit(code=1)
+
+    # HEAD 是上一次快照之后的空 "latest" 提交、工作区干净且远程已是最新时，新的快照不会包含任何内容
+    if not dirty and _is_empty_commit(parkive_root, start_head) and _ref_matches(parkive_root, "@{push}", start_head):
+        console.print("nothing to snapshot: no changes since the last snapshot and the remote is up to date.", style=info_style)
+        return
 
     snapshot_message: str = message
     if message is None:
@@ -103,14 +294,117 @@ def git_snapshot(ctx: typer.Context, message: Annotated[str | None, typer.Option
         snapshot_message = f"snapshot:{current_date}"
 
     try:
-        _run_git(["add", "."], cwd=parkive_root)
+        if unstaged:
+            _stage_paths(unstaged, parkive_root)
         _run_git(["commit", "--amend", "--allow-empty", "-m", snapshot_message], cwd=parkive_root)
         _run_git(["commit", "--allow-empty", "-m", "latest"], cwd=parkive_root)
-        _run_git(["push", "-f"], cwd=parkive_root)
+        if background:
+            _queue_push(parkive_root, ["-f"], _git_output(["rev-parse", "HEAD"], parkive_root).strip())
+        else:
+            _run_git(["push", "-f"], cwd=parkive_root)
     except subprocess.CalledProcessError as e:
         _rollback_to_head(parkive_root, start_head)
         console.print("snapshot failed and local branch has been rolled back.", style=error_style)
         console.print(e.stderr.strip() or str(e), style=error_style)
         raise typer.Exit(code=1)
 
-    console.print("snapshot finished.", style=success_style)
+    console.print(f"snapshot finished in {_format_elapsed(time.perf_counter() - start)}.", style=success_style)
+
+
+@git_app.command("queue")
+def git_queue(ctx: typer.Context,
+              flush: Annotated[bool, typer.Option("--flush", help="Try every queued push once right now, ignoring the backoff.")] = False,
+              clear: Annotated[bool, typer.Option("--clear", help="Drop all queued pushes without pushing them.")] = False):
+    """Show, flush or clear the pushes queued by 'sync --background' and 'snapshot --background'."""
+    from .push_queue import PushQueue
+
+    parkive_root = Path(ctx.obj["parkive_root"])
+    queue = PushQueue(parkive_root)
+
+    if clear:
+        console.print(f"dropped {queue.clear()} queued pushes.", style=success_style)
+        return
+
+    if flush:
+        results = queue.flush()
+        if not results:
+            console.print("push queue is empty.", style=info_style)
+        for entry, ok, error in results:
+            cmd_text = _git_cmd_text(["push", *entry["args"]])
+            if ok:
+                console.print(f"[green]✓[/green] {cmd_text}")
+            else:
+                console.print(f"[red]✗[/red] {cmd_text}")
+                console.print(error, style=error_style)
+        if any(not ok for _, ok, _ in results):
+            raise typer.Exit(code=1)
+        return
+
+    entries = queue.entries()
+    if not entries:
+        console.print("push queue is empty.", style=info_style)
+        return
+    console.print(f"worker: {'running' if queue.worker_running() else 'not running'}", style=info_style)
+    now = time.time()
+    for entry in entries:
+        if entry["status"] == "failed":
+            state = f"failed after {entry['attempts']} attempts, run 'parkive git queue --flush' to retry"
+        elif entry["attempts"] == 0:
+            state = "pending"
+        else:
+            state = f"retry {entry['attempts']} in {_format_elapsed(max(0.0, entry['next_attempt'] - now))}"
+        console.print(f"{entry['created']}\t{entry['commit'][:10]}\tgit push {' '.join(entry['args'])}\t{state}", style=info_style)
+        if entry["last_error"]:
+            console.print(f"  {entry['last_error'].splitlines()[-1]}", style=warning_style)
+
+
+@git_app.command("history")
+def git_history(ctx: typer.Context,
+                rev: Annotated[str, typer.Argument(help="Revision whose first-parent history is walked.")] = "HEAD",
+                all_commits: Annotated[bool, typer.Option("--all-commits", help="Include every commit, not only those whose subject starts with 'snapshot:'.")] = False,
+                since: Annotated[str | None, typer.Option("--since", help="Only include commits more recent than the given date, e.g. '1 year ago' or 2024-01-01.")] = None,
+                no_cache: Annotated[bool, typer.Option("--no-cache", help="Parse every blob without reading or updating the blob cache in .parkive.")] = False,
+                output_format: Annotated[OutputFormat, typer.Option("--format", help="Output format. 'ndjson' and 'tsv' stream one unstyled record per commit to stdout for use in scripts.")] = OutputFormat.table):
+    """Show managed file, word and image source counts for each snapshot commit without checking anything out."""
+    from .history import BlobCache, CatFile, HistoryWalker, list_history_commits
+    from .output import RecordWriter
+    from .source import load_sources
+
+    parkive_root = Path(ctx.obj["parkive_root"])
+    user_config = ctx.obj["user_config"]
+    sources = load_sources(parkive_root)
+
+    try:
+        commits = list_history_commits(parkive_root, rev, all_commits, since)
+    except subprocess.CalledProcessError as e:
+        console.print(e.stderr.strip() or str(e), style=error_style)
+        raise typer.Exit(code=1)
+    if not commits:
+        console.print("no snapshot commits found; use --all-commits to include every commit.", style=warning_style)
+        return
+
+    source_names = sorted(sources)
+    columns = ["date", "commit", "files", "words", *source_names, "unknown"]
+    out = RecordWriter(output_format, columns)
+    if output_format is OutputFormat.table:
+        console.print("\t".join(columns), style=success_style)
+
+    blob_cache = BlobCache(parkive_root, enabled=not no_cache)
+    cat_file = CatFile(parkive_root)
+    try:
+        walker = HistoryWalker(cat_file, blob_cache, user_config["scope"]["scan_glob"], user_config["scope"]["skip_dirs"], sources)
+        for commit in commits:
+            totals = walker.tree_totals(commit["tree"])
+            with stats.phase("output"):
+                out.row({
+                    "date": commit["date"],
+                    "commit": commit["commit"][:12],
+                    "files": totals["files"],
+                    "words": totals["words"],
+                    **{name: totals["sources"].get(name, 0) for name in source_names},
+                    "unknown": totals["unknown"],
+                })
+        out.close({"commits": len(commits), "blobs": len(blob_cache.entries)})
+    finally:
+        cat_file.close()
+        blob_cache.save()
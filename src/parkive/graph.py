@@ -0,0 +1,95 @@
+from pathlib import Path
+from urllib.parse import unquote
+from .stats import stats
+
+import posixpath
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def resolve_link(link: str, note: str) -> str | None:
+    """
+    把 note（相对知识库根目录的 posix 路径）中的链接目标解析为相对根目录的规范化 posix 路径，规则与 images.local_image_path 相同：
+    相对路径相对于笔记所在目录，以 / 开头的路径相对于根目录，忽略查询参数和锚点。
+    指向根目录之外的结果以 ../ 开头；Windows 盘符路径原样返回。只有锚点或查询参数时返回 None。
+    """
+    path = link.split("#", 1)[0].split("?", 1)[0]
+    if not path:
+        return None
+    if len(path) > 1 and path[1] == ":":
+        return path
+    if path.startswith("/"):
+        return posixpath.normpath(path.lstrip("/") or ".")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(note), path))
+
+
+class LinkGraph:
+    """
+    笔记之间的链接关系，由扫描索引的记录 [(file_path, record)] 建立：record["links"] 保存了每个文件中指向本地文件的链接，
+    随索引增量更新并保存在 .parkive/cache/index.json 中，因此建立图不需要重新读取任何文件。
+
+    链接目标先在受管文件集合中查找，找不到时再检查文件系统（例如指向 PDF 等附件的链接）；
+    原样的路径找不到时再尝试解码百分号转义（例如 my%20note.md）。
+    """
+
+    def __init__(self, parkive_root: Path, records):
+        self.parkive_root = parkive_root
+        self.notes: set[str] = set()
+        self.links: dict[str, list[str]] = {}
+        self.errors: list[tuple[str, str]] = []
+        with stats.phase("graph"):
+            for file_path, record in records:
+                note = file_path.relative_to(parkive_root).as_posix()
+                self.notes.add(note)
+                if "error" in record:
+                    self.errors.append((note, record["error"]))
+                elif record["links"]:
+                    self.links[note] = record["links"]
+        self._exists: dict[str, bool] = {}
+        stats.count("notes", len(self.notes))
+        stats.count("note links", sum(len(links) for links in self.links.values()))
+
+    def _exists_on_disk(self, target: str) -> bool:
+        exists = self._exists.get(target)
+        if exists is None:
+            stats.count("link targets checked")
+            exists = self._exists[target] = (self.parkive_root / target).exists()
+        return exists
+
+    def target(self, link: str, note: str) -> tuple[str | None, bool]:
+        """返回 (链接目标的相对路径, 目标是否存在)；链接没有路径部分时返回 (None, True)。"""
+        target = resolve_link(link, note)
+        if target is None or target in self.notes:
+            return target, True
+        decoded = unquote(link)
+        if decoded != link:
+            # 解码后可能只剩锚点或查询参数（例如 %23frag、%3Fq），此时只按原样的路径查找
+            decoded_target = resolve_link(decoded, note)
+            if decoded_target is not None and (decoded_target in self.notes or self._exists_on_disk(decoded_target)):
+                return decoded_target, True
+        return target, self._exists_on_disk(target)
+
+    def backlinks(self, note: str) -> list[tuple[str, str]]:
+        """按路径顺序返回链接到 note 的 [(来源笔记, 链接原文)]，笔记链接到自身的链接不计入。"""
+        found = []
+        with stats.phase("resolve"):
+            for source, links in self.links.items():
+                if source == note:
+                    continue
+                for link in links:
+                    if self.target(link, source)[0] == note:
+                        found.append((source, link))
+        return sorted(found)
+
+    def broken(self) -> list[tuple[str, str, str]]:
+        """按路径顺序返回所有目标不存在的链接 [(来源笔记, 链接原文, 解析出的目标路径)]。"""
+        found = []
+        with stats.phase("resolve"):
+            for source, links in self.links.items():
+                for link in links:
+                    target, exists = self.target(link, source)
+                    if not exists:
+                        found.append((source, link, target))
+        return sorted(found)
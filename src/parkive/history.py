@@ -0,0 +1,191 @@
+from pathlib import Path
+from .common import DirFilter, PathMatcher, parkive_state_dir
+from .scan import SourceMatcher, count_mixed_words, iter_image_urls
+from .stats import stats
+
+import os
+import json
+import logging
+import subprocess
+
+
+log = logging.getLogger(__name__)
+
+# 版本 3 起使用与扫描索引版本 4 相同的解析规则
+BLOB_CACHE_VERSION = 3
+BLOB_CACHE_FILENAME = "blobs.json"
+
+TREE_MODE = b"40000"
+# 符号链接（120000）和子模块（160000）不是普通文件，不参与统计
+FILE_MODES = {b"100644", b"100755"}
+
+
+class CatFile:
+    """
+    长驻的 git cat-file --batch 进程。每次按对象名写入一行请求，读取 "<oid> <type> <size>" 头和对象内容，
+    读取任意多个对象都只需要启动一次 git。
+    """
+
+    def __init__(self, cwd: Path):
+        self.proc = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            cwd=str(cwd),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def read(self, oid: str) -> tuple[str, bytes]:
+        self.proc.stdin.write(oid.encode("ascii") + b"\n")
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline().split()
+        if len(header) != 3:
+            raise KeyError(f"git object {oid} is missing")
+        size = int(header[2])
+        data = self.proc.stdout.read(size)
+        self.proc.stdout.read(1)
+        stats.count("bytes read", size)
+        return header[1].decode("ascii"), data
+
+    def close(self) -> None:
+        self.proc.stdin.close()
+        self.proc.wait()
+        self.proc.stdout.close()
+
+
+def parse_tree(data: bytes):
+    """解析 tree 对象的二进制内容，生成 (mode, name, oid)。"""
+    pos = 0
+    end = len(data)
+    while pos < end:
+        space = data.index(b" ", pos)
+        nul = data.index(b"\0", space)
+        yield data[pos:space], data[space + 1 : nul], data[nul + 1 : nul + 21].hex()
+        pos = nul + 21
+
+
+def scan_blob(data: bytes) -> dict:
+    """与 index.scan_file 相同的解析结果（图片 URL 和字数），输入为 blob 的内容。"""
+    try:
+        content = data.decode("utf-8")
+    except UnicodeDecodeError as e:
+        return {"urls": [], "words": 0, "error": f"not valid UTF-8 ({e.reason} at byte {e.start})"}
+    return {"urls": list(iter_image_urls(content)), "words": count_mixed_words(content)}
+
+
+class BlobCache:
+    """
+    保存在 .parkive/cache/blobs.json 中的 blob 解析结果，以 blob 的 SHA 为键。
+    blob 的内容由 SHA 唯一确定，缓存的结果永远不会过期。
+    """
+
+    def __init__(self, parkive_root: Path, enabled: bool = True):
+        self.parkive_root = parkive_root
+        self.enabled = enabled
+        self.path = parkive_root / ".parkive" / "cache" / BLOB_CACHE_FILENAME
+        self.entries: dict[str, dict] = self._load() if enabled else {}
+        self.dirty = False
+
+    def _load(self) -> dict[str, dict]:
+        if not self.path.is_file():
+            return {}
+        try:
+            loaded = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            log.debug(f"Ignoring unreadable blob cache {self.path}: {e}")
+            return {}
+        if not isinstance(loaded, dict) or loaded.get("version") != BLOB_CACHE_VERSION:
+            return {}
+        return loaded.get("blobs", {})
+
+    def save(self) -> None:
+        if not self.enabled or not self.dirty:
+            return
+        parkive_state_dir(self.parkive_root, "cache")
+        tmp_path = self.path.with_name(BLOB_CACHE_FILENAME + ".tmp")
+        tmp_path.write_text(json.dumps({"version": BLOB_CACHE_VERSION, "blobs": self.entries}, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+class HistoryWalker:
+    """
+    不检出任何提交，通过 CatFile 读取提交的 tree，统计其中受管文件的数量、字数和各来源的图片数量。
+
+    子树的统计结果以 (tree SHA, 目录路径) 为键缓存，文件的解析结果以 blob SHA 为键缓存：
+    相邻快照之间没有变化的目录直接复用结果，总开销与不同的 tree 和 blob 数量成正比，而不是提交数 × 文件数。
+    """
+
+    def __init__(self, cat_file: CatFile, blob_cache: BlobCache, scan_glob: list[str], skip_dirs: list[str], sources: dict[str, str]):
+        self.cat_file = cat_file
+        self.blob_cache = blob_cache
+        self.matcher = PathMatcher([pattern.strip().strip("'\"`") for pattern in scan_glob])
+        self.dir_filter = DirFilter(skip_dirs)
+        self.source_names = sorted(sources)
+        self.source_matcher = SourceMatcher(sources)
+        self._trees: dict[tuple[str, str], dict] = {}
+
+    def _blob_totals(self, oid: str) -> dict:
+        record = self.blob_cache.entries.get(oid)
+        if record is None:
+            stats.count("blobs parsed")
+            with stats.phase("parse"):
+                _, data = self.cat_file.read(oid)
+                record = scan_blob(data)
+            self.blob_cache.entries[oid] = record
+            self.blob_cache.dirty = True
+        else:
+            stats.count("blob cache hits")
+        totals = {"files": 1, "words": record["words"], "sources": {}, "unknown": 0}
+        for url in record["urls"]:
+            name = self.source_matcher.match(url)
+            if name is None:
+                totals["unknown"] += 1
+            else:
+                totals["sources"][name] = totals["sources"].get(name, 0) + 1
+        return totals
+
+    def tree_totals(self, oid: str, rel_dir: str = "") -> dict:
+        """统计 tree 中所有受管文件，返回 {"files", "words", "sources": {来源名: 数量}, "unknown"}。"""
+        cached = self._trees.get((oid, rel_dir))
+        if cached is not None:
+            stats.count("tree cache hits")
+            return cached
+        stats.count("trees read")
+        _, data = self.cat_file.read(oid)
+        totals = {"files": 0, "words": 0, "sources": {}, "unknown": 0}
+        for mode, raw_name, child in parse_tree(data):
+            name = os.fsdecode(raw_name)
+            rel_path = rel_dir + name
+            if mode == TREE_MODE:
+                if self.dir_filter.skip(name, rel_path):
+                    continue
+                child_totals = self.tree_totals(child, rel_path + "/")
+            elif mode in FILE_MODES and self.matcher.match_name(name) and self.matcher.match(rel_path):
+                child_totals = self._blob_totals(child)
+            else:
+                continue
+            totals["files"] += child_totals["files"]
+            totals["words"] += child_totals["words"]
+            totals["unknown"] += child_totals["unknown"]
+            for source_name, count in child_totals["sources"].items():
+                totals["sources"][source_name] = totals["sources"].get(source_name, 0) + count
+        self._trees[(oid, rel_dir)] = totals
+        return totals
+
+
+def list_history_commits(cwd: Path, rev: str, all_commits: bool, since: str | None) -> list[dict]:
+    """按时间顺序（从旧到新）列出 rev 第一父提交链上的快照提交，all_commits 为 True 时列出全部提交。"""
+    args = ["git", "log", "--first-parent", "--reverse", "-z", "--format=%H%x1f%T%x1f%cs%x1f%s"]
+    if since is not None:
+        args.append(f"--since={since}")
+    args += [rev, "--"]
+    with stats.phase("git log"):
+        result = subprocess.run(args, cwd=str(cwd), check=True, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    commits = []
+    for record in result.stdout.split("\0"):
+        if not record.strip():
+            continue
+        commit, tree, date, subject = record.strip("\n").split("\x1f", 3)
+        if all_commits or subject.startswith("snapshot:"):
+            commits.append({"commit": commit, "tree": tree, "date": date, "subject": subject})
+    return commits
@@ -0,0 +1,201 @@
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+from .common import iter_managed_files, map_files, parkive_state_dir
+from .index import RACY_WINDOW_NS
+from .stats import stats
+
+import os
+import json
+import time
+import hashlib
+import logging
+
+
+log = logging.getLogger(__name__)
+
+HASH_CACHE_VERSION = 1
+HASH_CACHE_FILENAME = "image-hashes.json"
+
+IMAGE_EXTENSIONS = ["png", "jpg", "jpeg", "gif", "webp", "svg", "bmp", "ico", "avif", "tif", "tiff", "heic"]
+# 扩展名不区分大小写：把每个字母写成 [xX]，交给 iter_managed_files 的 glob 匹配
+IMAGE_GLOBS = ["*." + "".join(f"[{c.lower()}{c.upper()}]" for c in ext) for ext in IMAGE_EXTENSIONS]
+
+
+def local_image_path(url: str, note_path: Path, parkive_root: Path) -> Path | None:
+    """
+    把笔记中的本地图片路径解析为规范化的文件路径：相对路径相对于笔记所在目录，以 / 开头的路径相对于知识库根目录。
+    忽略查询参数和锚点；原样的路径不存在时再尝试解码百分号转义（例如 a%20b.png）。
+    带 scheme 的 URL（http:、data: 等）和 // 开头的 URL 不是本地路径，返回 None。
+    """
+    url = url.strip().removeprefix("<").removesuffix(">")
+    if not url or url.startswith("//"):
+        return None
+    scheme = urlparse(url).scheme
+    # 单个字母的 scheme 是 Windows 盘符
+    if len(scheme) > 1:
+        return None
+    path = url.split("#", 1)[0].split("?", 1)[0]
+    if not path:
+        return None
+
+    def resolve(p: str) -> Path:
+        if scheme:
+            return Path(os.path.normpath(p))
+        if p.startswith("/"):
+            return Path(os.path.normpath(parkive_root / p.lstrip("/")))
+        return Path(os.path.normpath(note_path.parent / p))
+
+    resolved = resolve(path)
+    decoded = unquote(path)
+    if decoded != path and not resolved.exists():
+        decoded_path = resolve(decoded)
+        if decoded_path.exists():
+            return decoded_path
+    return resolved
+
+
+def hash_file(file_path: Path) -> str | None:
+    try:
+        with file_path.open("rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+    except OSError as e:
+        log.debug(f"Cannot hash {file_path}: {e}")
+        return None
+
+
+class HashCache:
+    """
+    保存在 .parkive/cache/image-hashes.json 中的图片 SHA-256 缓存，以相对路径为键，mtime/size 未变时直接复用。
+    与扫描索引相同，mtime 距今不足 RACY_WINDOW_NS 的文件不写入缓存。
+    """
+
+    def __init__(self, parkive_root: Path, enabled: bool = True):
+        self.parkive_root = parkive_root
+        self.enabled = enabled
+        self.path = parkive_root / ".parkive" / "cache" / HASH_CACHE_FILENAME
+        self.entries: dict[str, dict] = self._load() if enabled else {}
+        self.dirty = False
+
+    def _load(self) -> dict[str, dict]:
+        if not self.path.is_file():
+            return {}
+        try:
+            loaded = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            log.debug(f"Ignoring unreadable hash cache {self.path}: {e}")
+            return {}
+        if not isinstance(loaded, dict) or loaded.get("version") != HASH_CACHE_VERSION:
+            return {}
+        return loaded.get("files", {})
+
+    def hash_files(self, files: list[tuple[Path, os.stat_result]], jobs: int | None = None) -> dict[Path, str]:
+        """返回 {file_path: sha256}；缓存未命中的文件交给 map_files 并行计算，无法读取的文件不出现在结果中。"""
+        hashes: dict[Path, str] = {}
+        misses: list[tuple[Path, str, os.stat_result]] = []
+        for file_path, st in files:
+            key = file_path.relative_to(self.parkive_root).as_posix()
+            entry = self.entries.get(key)
+            if entry is not None and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+                hashes[file_path] = entry["sha256"]
+            else:
+                misses.append((file_path, key, st))
+        stats.count("hash cache hits", len(hashes))
+        stats.count("hash cache misses", len(misses))
+
+        with stats.phase("hash"):
+            computed = dict(map_files(hash_file, [file_path for file_path, _, _ in misses], jobs))
+        now = time.time_ns()
+        for file_path, key, st in misses:
+            digest = computed[file_path]
+            if digest is None:
+                continue
+            hashes[file_path] = digest
+            if self.enabled and now - st.st_mtime_ns > RACY_WINDOW_NS:
+                self.entries[key] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": digest}
+                self.dirty = True
+        return hashes
+
+    def prune(self, keep: set[str]) -> None:
+        stale = [key for key in self.entries if key not in keep]
+        for key in stale:
+            del self.entries[key]
+        if stale:
+            self.dirty = True
+
+    def save(self) -> None:
+        if not self.enabled or not self.dirty:
+            return
+        parkive_state_dir(self.parkive_root, "cache")
+        tmp_path = self.path.with_name(HASH_CACHE_FILENAME + ".tmp")
+        tmp_path.write_text(json.dumps({"version": HASH_CACHE_VERSION, "files": self.entries}, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+def build_image_graph(parkive_root: Path, note_records, skip_dirs: list[str], cache: HashCache, jobs: int | None = None) -> dict:
+    """
+    根据笔记的扫描记录 [(note_path, record)] 和知识库中的图片文件建立引用关系，返回：
+     - missing：[(笔记相对路径, url)]，引用的本地文件不存在
+     - orphans：[(图片相对路径, 大小)]，没有任何笔记引用的图片文件
+     - duplicates：[[图片相对路径, ...]]，内容完全相同的图片，每组中被引用的文件在前，其次按路径排序
+     - referenced：被引用且存在的不同文件数，local_refs：本地图片引用数
+
+    只有大小与其他图片相同的文件才可能重复，因此只对这些文件计算哈希。
+    """
+    referenced: set[Path] = set()
+    missing: list[tuple[str, str]] = []
+    local_refs = 0
+    with stats.phase("resolve"):
+        for note_path, record in note_records:
+            if "error" in record:
+                continue
+            for url in record["urls"]:
+                target = local_image_path(url, note_path, parkive_root)
+                if target is None:
+                    continue
+                local_refs += 1
+                if target in referenced:
+                    continue
+                if target.is_file():
+                    referenced.add(target)
+                else:
+                    missing.append((note_path.relative_to(parkive_root).as_posix(), url))
+
+    with stats.phase("walk images"):
+        images: list[tuple[Path, os.stat_result]] = []
+        for file_path in iter_managed_files(parkive_root, IMAGE_GLOBS, skip_dirs):
+            try:
+                images.append((file_path, file_path.stat()))
+            except OSError:
+                continue
+    stats.count("image files", len(images))
+
+    orphans = [
+        (file_path.relative_to(parkive_root).as_posix(), st.st_size)
+        for file_path, st in images
+        if Path(os.path.normpath(file_path)) not in referenced
+    ]
+
+    by_size: dict[int, list[tuple[Path, os.stat_result]]] = {}
+    for file_path, st in images:
+        if st.st_size > 0:
+            by_size.setdefault(st.st_size, []).append((file_path, st))
+    candidates = [item for group in by_size.values() if len(group) > 1 for item in group]
+    hashes = cache.hash_files(candidates, jobs)
+    cache.prune({file_path.relative_to(parkive_root).as_posix() for file_path, _ in images})
+
+    by_hash: dict[str, list[tuple[bool, str]]] = {}
+    for file_path, digest in hashes.items():
+        is_orphan = Path(os.path.normpath(file_path)) not in referenced
+        by_hash.setdefault(digest, []).append((is_orphan, file_path.relative_to(parkive_root).as_posix()))
+    # 被引用的文件排在每组前面，作为保留的副本
+    duplicates = sorted([path for _, path in sorted(group)] for group in by_hash.values() if len(group) > 1)
+
+    return {
+        "missing": missing,
+        "orphans": orphans,
+        "duplicates": duplicates,
+        "referenced": len(referenced),
+        "local_refs": local_refs,
+        "images": len(images),
+    }
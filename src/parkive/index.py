@@ -0,0 +1,232 @@
+from pathlib import Path
+from collections import deque
+from .common import LARGE_FILE_BYTES, FileMapper, acquire_lock, mapped_file, parkive_state_dir
+from .scan import count_mixed_words, iter_image_urls, iter_local_links, validate_utf8
+from .stats import stats
+
+import os
+import json
+import time
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+# 版本 2 起记录中包含指向本地文件的链接（links）；
+# 版本 4 起超大文件与其他文件的解析结果相同（空白、单词边界和忽略大小写都按 Unicode 判断），并且同样检查是否是合法的 UTF-8；
+# 版本 3 的记录按 ASCII 规则解析，不能沿用
+INDEX_VERSION = 4
+INDEX_FILENAME = "index.json"
+# mtime 距今小于该窗口的文件不写入索引：同一时间片内的再次修改无法通过 mtime/size 区分。
+RACY_WINDOW_NS = 2_000_000_000
+# parkive watch 运行时在 .parkive/cache 中持有的锁和记录的监视范围
+WATCH_LOCK_FILENAME = "watch.lock"
+WATCH_STATE_FILENAME = "watch.json"
+
+
+def scan_file(file_path: Path) -> dict:
+    """
+    读取并解析单个文件，返回索引记录中保存的解析结果。超大文件通过 mmap 按字节扫描，逐块检查编码后只解码匹配到的 URL。
+    文件不是合法的 UTF-8 时不抛出异常，而是在记录的 "error" 中说明原因，由调用方报告。
+    """
+    try:
+        if file_path.stat().st_size >= LARGE_FILE_BYTES:
+            with mapped_file(file_path) as buf:
+                validate_utf8(buf)
+                return {
+                    "urls": [url.decode("utf-8") for url in iter_image_urls(buf)],
+                    "links": [link.decode("utf-8") for link in iter_local_links(buf)],
+                    "words": count_mixed_words(buf),
+                }
+        content = file_path.read_text(encoding="utf-8")
+    except UnicodeDecodeError as e:
+        return {"urls": [], "links": [], "words": 0, "error": f"not valid UTF-8 ({e.reason} at byte {e.start})"}
+    return {
+        "urls": list(iter_image_urls(content)),
+        "links": list(iter_local_links(content)),
+        "words": count_mixed_words(content),
+    }
+
+
+class ScanIndex:
+    """
+    保存在 .parkive/cache/index.json 中的增量扫描索引。
+
+    以文件相对 parkive_root 的路径为键，记录 mtime/size 以及解析结果（图片 URL 列表、本地链接列表和字数）。
+    只有新增或修改过的文件会被重新解析；enabled 为 False 时每次都重新解析且不读写索引文件，
+    rebuild 为 True 时丢弃已有索引从头建立。
+    """
+
+    def __init__(self, parkive_root: Path, enabled: bool = True, rebuild: bool = False):
+        self.parkive_root = parkive_root
+        self._root_prefix = os.path.join(str(parkive_root), "")
+        self.enabled = enabled
+        self.entries: dict[str, dict] = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        # parkive watch 会收到每一次修改的通知，运行期间将其置为 0，同一时间片内的修改也能写入索引
+        self.racy_window_ns = RACY_WINDOW_NS
+        if enabled and not rebuild:
+            with stats.phase("index load"):
+                self.entries = self._load()
+        elif enabled:
+            self.dirty = True
+
+    @property
+    def path(self) -> Path:
+        return self.parkive_root / ".parkive" / "cache" / INDEX_FILENAME
+
+    def _load(self) -> dict[str, dict]:
+        if not self.path.is_file():
+            return {}
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                loaded = json.load(f)
+        except (OSError, ValueError) as e:
+            log.debug(f"Ignoring unreadable scan index {self.path}: {e}")
+            return {}
+        if not isinstance(loaded, dict) or loaded.get("version") != INDEX_VERSION:
+            log.debug(f"Ignoring scan index {self.path} with unknown version")
+            return {}
+        entries = loaded.get("files", {})
+        return entries if isinstance(entries, dict) else {}
+
+    def key(self, file_path: Path) -> str | None:
+        """索引键为相对 parkive_root 的 posix 路径；根目录之外的文件不建立索引。"""
+        # 受管文件都由 parkive_root 拼接而来，直接截取字符串，比 Path.relative_to 快一个数量级
+        path = str(file_path)
+        if path.startswith(self._root_prefix):
+            key = path[len(self._root_prefix) :]
+            return key if os.sep == "/" else key.replace(os.sep, "/")
+        try:
+            return file_path.relative_to(self.parkive_root).as_posix()
+        except ValueError:
+            return None
+
+    def _fresh_entry(self, key: str | None, st: os.stat_result) -> dict | None:
+        if key is None:
+            return None
+        entry = self.entries.get(key)
+        if entry is not None and entry.get("mtime_ns") == st.st_mtime_ns and entry.get("size") == st.st_size:
+            return entry
+        return None
+
+    def _store(self, key: str | None, st: os.stat_result, record: dict) -> None:
+        if key is None:
+            return
+        if time.time_ns() - st.st_mtime_ns > self.racy_window_ns:
+            self.entries[key] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, **record}
+        else:
+            self.entries.pop(key, None)
+        self.dirty = True
+
+    def scan(self, files, prune: bool = False, jobs: int | None = 1):
+        """
+        边遍历 files 边生成 (file_path, record)：命中索引的文件立即生成，需要重新解析的文件交给 FileMapper，
+        解析完成后生成（jobs 大于 1 时在进程池中并行解析），因此 jobs 大于 1 时生成的顺序与 files 不一定相同。
+        prune 为 True 表示 files 是完整的受管文件列表，迭代结束后会从索引中删除未出现的（已删除或不再匹配的）文件。
+        """
+        seen: set[str] = set()
+        # 已提交解析的文件的 (key, stat)，FileMapper 按提交顺序返回结果
+        submitted: deque[tuple[str | None, os.stat_result | None]] = deque()
+        files = iter(files)
+        with FileMapper(scan_file, jobs) as mapper:
+            while True:
+                with stats.phase("walk"):
+                    file_path = next(files, None)
+                    if file_path is None:
+                        break
+                    key = self.key(file_path) if self.enabled else None
+                    st = file_path.stat() if key is not None else None
+                    entry = self._fresh_entry(key, st) if st is not None else None
+                if key is not None:
+                    seen.add(key)
+                if entry is not None:
+                    self.hits += 1
+                    stats.count("index hits")
+                    stats.count("urls seen", len(entry["urls"]))
+                    yield file_path, entry
+                    continue
+                self.misses += 1
+                stats.count("index misses")
+                submitted.append((key, st))
+                with stats.phase("parse"):
+                    mapper.submit(file_path)
+                    parsed = list(mapper.ready())
+                yield from self._store_parsed(parsed, submitted)
+
+            results = mapper.finish()
+            while True:
+                with stats.phase("parse"):
+                    item = next(results, None)
+                if item is None:
+                    break
+                yield from self._store_parsed([item], submitted)
+
+        if prune and self.enabled:
+            stale = [key for key in self.entries if key not in seen]
+            for key in stale:
+                del self.entries[key]
+            if stale:
+                self.dirty = True
+                log.debug(f"Dropped {len(stale)} stale entries from scan index")
+
+    def _store_parsed(self, parsed: list[tuple[Path, dict]], submitted: deque):
+        for file_path, record in parsed:
+            key, st = submitted.popleft()
+            if st is not None:
+                self._store(key, st, record)
+            stats.count("urls seen", len(record["urls"]))
+            yield file_path, record
+
+    def drop_racy(self) -> None:
+        """删除 mtime 仍在 RACY_WINDOW_NS 窗口内的条目，用于 parkive watch 退出前恢复普通索引的保证。"""
+        now = time.time_ns()
+        racy = [key for key, entry in self.entries.items() if now - entry["mtime_ns"] <= RACY_WINDOW_NS]
+        for key in racy:
+            del self.entries[key]
+        if racy:
+            self.dirty = True
+
+    def watched_records(self, scan_glob: list[str], skip_dirs: list[str]) -> list[tuple[Path, dict]] | None:
+        """
+        如果 parkive watch 正在以相同的 scan_glob 和 skip_dirs 监视知识库，索引中就是全部受管文件的最新结果，
+        直接返回其中的 (file_path, record)，不需要遍历和 stat；否则返回 None，由调用方正常扫描。
+        """
+        if not self.enabled or not self.entries:
+            return None
+        state_path = self.path.with_name(WATCH_STATE_FILENAME)
+        lock_path = self.path.with_name(WATCH_LOCK_FILENAME)
+        if not state_path.is_file() or not lock_path.is_file():
+            return None
+        lock = acquire_lock(lock_path, blocking=False)
+        if lock is not None:
+            # 没有进程持有锁，说明 watch 已经退出，记录的状态不再可信
+            lock.close()
+            return None
+        try:
+            state = json.loads(state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if state.get("scan_glob") != scan_glob or state.get("skip_dirs") != skip_dirs:
+            return None
+        return self.stored_records()
+
+    def stored_records(self) -> list[tuple[Path, dict]]:
+        """不遍历知识库，直接返回索引中保存的 (file_path, record)；没有 parkive watch 运行时结果可能落后于磁盘上的文件。"""
+        self.hits += len(self.entries)
+        stats.count("index hits", len(self.entries))
+        return [(self.parkive_root / key, entry) for key, entry in self.entries.items()]
+
+    def save(self) -> None:
+        if not self.enabled or not self.dirty:
+            return
+        parkive_state_dir(self.parkive_root, "cache")
+        tmp_path = self.path.with_name(INDEX_FILENAME + ".tmp")
+        with stats.phase("index save"), tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "files": self.entries}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+        log.debug(f"Scan index saved to {self.path} ({self.hits} hits, {self.misses} misses)")
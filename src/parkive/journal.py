@@ -0,0 +1,283 @@
+from pathlib import Path
+from datetime import datetime
+from .common import LARGE_FILE_BYTES, map_files, mapped_file, parkive_state_dir
+from .scan import PrefixRewriter, rewrite_images_in_text, source_prefix_filter, validate_utf8, write_replaced_images
+from .stats import stats
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+JOURNAL_VERSION = 2
+# 每批暂存的文件数：每批只 fsync 一次涉及的目录并追加一次日志
+APPLY_BATCH_SIZE = 128
+TEMP_SUFFIX = ".parkive-tmp"
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _fsync_dirs(dirs) -> None:
+    """
+    逐个 fsync 目录，使其中新建和重命名的文件项落盘。文件内容由写入方在关闭前自行 fsync，
+    因此只影响这几个目录，而不是像 os.sync 那样刷写整个系统。Windows 上无法打开目录，直接跳过。
+    """
+    if os.name == "nt":
+        return
+    for dir_path in dirs:
+        fd = os.open(dir_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _copy_file_synced(src: Path, dst: Path) -> None:
+    """复制文件内容并在关闭前 fsync 目标文件。"""
+    with src.open("rb") as fin, dst.open("wb") as fout:
+        shutil.copyfileobj(fin, fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+
+
+def _rewrite_file(file_path: Path, mapping: dict[str, str], write, prefilter: bool = False) -> tuple[str | None, dict[str, int]]:
+    """
+    按 {源前缀: 目标前缀} 映射计算文件替换后的内容并按片段交给 write，返回 (原内容哈希, {源前缀: 替换数量})。
+    超大文件通过 mmap 流式处理，内存占用与文件大小无关；与普通文件相同，不是合法的 UTF-8 时抛出 UnicodeDecodeError。
+    prefilter 为 True 时先在原始字节中查找各个源前缀，一个都没有出现的文件不可能被替换，直接返回 (None, {})，
+    不解码、不计算哈希也不调用 write。
+    """
+    rewriter = PrefixRewriter(mapping)
+    literal_filter = source_prefix_filter(tuple(mapping)) if prefilter else None
+    if file_path.stat().st_size >= LARGE_FILE_BYTES:
+        with mapped_file(file_path) as buf:
+            if literal_filter is not None and not literal_filter.search(buf):
+                stats.count("files prefiltered")
+                return None, {}
+            validate_utf8(buf)
+            before = content_hash(buf)
+            counts = write_replaced_images(buf, rewriter, write)
+        return before, counts
+    original = file_path.read_bytes()
+    if literal_filter is not None and not literal_filter.search(original):
+        stats.count("files prefiltered")
+        return None, {}
+    converted, counts = rewrite_images_in_text(original.decode("utf-8"), rewriter)
+    write(converted.encode("utf-8"))
+    return content_hash(original), counts
+
+
+def plan_file(file_path: Path, mapping: dict[str, str]) -> dict | None:
+    """
+    计算单个文件的替换计划，返回 {"count": 替换总数, "counts": {源前缀: 替换数量}, "before": 原内容哈希, "after": 新内容哈希}，
+    没有需要替换的 URL 时返回 None，文件包含源前缀但不是合法的 UTF-8 时返回 {"error": 原因}。
+    只读取文件，不写入。作为 map_files 的工作函数运行在子进程中。
+    """
+    hasher = hashlib.sha256()
+    try:
+        before, counts = _rewrite_file(file_path, mapping, hasher.update, prefilter=True)
+    except UnicodeDecodeError as e:
+        return {"error": f"not valid UTF-8 ({e.reason} at byte {e.start})"}
+    if not counts:
+        return None
+    return {"count": sum(counts.values()), "counts": counts, "before": before, "after": hasher.hexdigest()}
+
+
+def stage_file(entry: dict, parkive_root: Path, backup_dir: Path, mapping: dict[str, str]) -> str:
+    """
+    为计划中的一个文件写入备份和替换后的临时文件，返回状态：
+     - "staged"：备份和临时文件（带有原文件的权限位）已写入并 fsync，等待重命名
+     - "done"：文件内容已经是替换后的结果
+     - "conflict"：文件在计划之后被修改过，跳过
+    作为 map_files 的工作函数运行在子进程中。
+    """
+    file_path = parkive_root / entry["path"]
+    tmp_path = file_path.with_name(file_path.name + TEMP_SUFFIX)
+    hasher = hashlib.sha256()
+    try:
+        with tmp_path.open("wb") as out:
+            def write(chunk) -> None:
+                out.write(chunk)
+                hasher.update(chunk)
+            before, _ = _rewrite_file(file_path, mapping, write)
+            out.flush()
+            os.fsync(out.fileno())
+    except (FileNotFoundError, UnicodeDecodeError):
+        tmp_path.unlink(missing_ok=True)
+        return "conflict"
+
+    if before == entry["after"]:
+        tmp_path.unlink()
+        return "done"
+    if before != entry["before"] or hasher.hexdigest() != entry["after"]:
+        tmp_path.unlink()
+        return "conflict"
+    shutil.copymode(file_path, tmp_path)
+    _copy_file_synced(file_path, backup_dir / entry["before"])
+    return "staged"
+
+
+def restore_file(entry: dict, parkive_root: Path, backup_dir: Path) -> str:
+    """
+    将已改写的文件恢复为备份中的原内容，返回 "restored"、"unchanged"（文件仍是原内容）或 "conflict"。
+    恢复的文件保留当前的权限位，所在目录由调用方统一 fsync。
+    """
+    file_path = parkive_root / entry["path"]
+    file_path.with_name(file_path.name + TEMP_SUFFIX).unlink(missing_ok=True)
+    try:
+        digest = content_hash(file_path.read_bytes())
+    except FileNotFoundError:
+        return "conflict"
+    if digest == entry["before"]:
+        return "unchanged"
+    backup_path = backup_dir / entry["before"]
+    if digest != entry["after"] or not backup_path.is_file():
+        return "conflict"
+    tmp_path = file_path.with_name(file_path.name + TEMP_SUFFIX)
+    _copy_file_synced(backup_path, tmp_path)
+    shutil.copymode(file_path, tmp_path)
+    os.replace(tmp_path, file_path)
+    return "restored"
+
+
+def plan_mapping(plan: dict) -> dict[str, str]:
+    """从计划中取出 {源前缀: 目标前缀} 映射。"""
+    return {m["source_prefix"]: m["target_prefix"] for m in plan["mappings"]}
+
+
+class ChangeJournal:
+    """
+    source change 的日志，保存在 .parkive/journal 下：
+     - plan.json：替换计划，包括各组来源与目标，以及每个文件的替换数量与改写前后的内容哈希
+     - done.log：已经完成改写的计划序号，每批追加一次
+     - backup/：改写前的原文件，以原内容哈希命名，用于回滚
+    改写通过临时文件加重命名完成，任意时刻中断后都可以根据日志继续或回滚，而无需重新扫描知识库。
+    """
+
+    def __init__(self, parkive_root: Path):
+        self.parkive_root = parkive_root
+        self.dir = parkive_root / ".parkive" / "journal"
+        self.plan_path = self.dir / "plan.json"
+        self.done_path = self.dir / "done.log"
+        self.backup_dir = self.dir / "backup"
+
+    def exists(self) -> bool:
+        return self.plan_path.is_file()
+
+    def create(self, header: dict, entries: list[dict]) -> None:
+        parkive_state_dir(self.parkive_root, "journal")
+        self.backup_dir.mkdir(exist_ok=True)
+        self.done_path.unlink(missing_ok=True)
+        plan = {
+            "version": JOURNAL_VERSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            **header,
+            "entries": entries,
+        }
+        tmp_path = self.plan_path.with_name("plan.json.tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            f.write(json.dumps(plan, ensure_ascii=False))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.plan_path)
+        _fsync_dirs([self.dir])
+
+    def load(self) -> dict:
+        plan = json.loads(self.plan_path.read_text(encoding="utf-8"))
+        if plan.get("version") != JOURNAL_VERSION:
+            raise ValueError(f"unsupported journal version in {self.plan_path}")
+        return plan
+
+    def done_indices(self) -> set[int]:
+        if not self.done_path.is_file():
+            return set()
+        # 最后一行可能在写入时被中断，忽略无法解析的行
+        return {int(line) for line in self.done_path.read_text(encoding="utf-8").split() if line.isdigit()}
+
+    def _mark_done(self, indices: list[int]) -> None:
+        if not indices:
+            return
+        with self.done_path.open("a", encoding="utf-8") as f:
+            f.write("".join(f"{i}\n" for i in indices))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _commit_batch(self, staged: list[tuple[int, dict]], finished: list[int]) -> None:
+        if staged:
+            temp_paths = [self.parkive_root / (entry["path"] + TEMP_SUFFIX) for _, entry in staged]
+            # 临时文件和备份的内容已经在工作进程中 fsync，重命名之前只需让备份目录中的新文件项落盘
+            _fsync_dirs([self.backup_dir])
+            for tmp_path, (i, entry) in zip(temp_paths, staged):
+                os.replace(tmp_path, self.parkive_root / entry["path"])
+                finished.append(i)
+            _fsync_dirs({tmp_path.parent for tmp_path in temp_paths})
+            stats.count("files written", len(staged))
+        self._mark_done(finished)
+
+    def apply(self, jobs: int | None = None) -> tuple[list[dict], list[dict]]:
+        """
+        执行（或继续执行）计划中尚未完成的改写，返回 (完成的条目, 冲突的条目)。
+        工作进程写入备份和临时文件，主进程每凑满一批就统一刷盘、重命名，最后追加一次 done.log。
+        """
+        plan = self.load()
+        entries = plan["entries"]
+        done = self.done_indices()
+        pending = [i for i in range(len(entries)) if i not in done]
+        applied = [entries[i] for i in sorted(done)]
+        conflicts = []
+
+        staged: list[tuple[int, dict]] = []
+        finished: list[int] = []
+        results = map_files(
+            stage_file,
+            [entries[i] for i in pending],
+            jobs,
+            self.parkive_root,
+            self.backup_dir,
+            plan_mapping(plan),
+        )
+        for i, (entry, status) in zip(pending, results):
+            if status == "conflict":
+                conflicts.append(entry)
+                log.debug(f"Skipping {entry['path']}: content changed since the plan was made")
+                continue
+            applied.append(entry)
+            if status == "staged":
+                staged.append((i, entry))
+            else:
+                finished.append(i)
+            if len(staged) + len(finished) >= APPLY_BATCH_SIZE:
+                with stats.phase("commit"):
+                    self._commit_batch(staged, finished)
+                staged, finished = [], []
+        with stats.phase("commit"):
+            self._commit_batch(staged, finished)
+
+        return applied, conflicts
+
+    def rollback(self) -> tuple[int, list[dict]]:
+        """将已改写的文件恢复为原内容，返回 (恢复的文件数, 冲突的条目)。"""
+        plan = self.load()
+        restored = 0
+        restored_dirs = set()
+        conflicts = []
+        for entry in plan["entries"]:
+            status = restore_file(entry, self.parkive_root, self.backup_dir)
+            if status == "restored":
+                restored += 1
+                restored_dirs.add((self.parkive_root / entry["path"]).parent)
+                stats.count("files written")
+            elif status == "conflict":
+                conflicts.append(entry)
+        _fsync_dirs(restored_dirs)
+        return restored, conflicts
+
+    def discard(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
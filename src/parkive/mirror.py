@@ -0,0 +1,156 @@
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+from .fetch import download_url, fetch_all
+from .stats import stats
+
+import os
+import json
+import logging
+
+
+log = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+MANIFEST_FILENAME = ".parkive-mirror.json"
+# 每完成这么多个下载保存一次清单，中断后最多重新下载这么多个文件
+MANIFEST_SAVE_EVERY = 64
+
+
+def mirror_path(url: str, base_url: str) -> str | None:
+    """
+    返回 url 在镜像目录中的相对路径：去掉来源前缀后的路径部分（解码百分号转义），查询参数和锚点被忽略。
+    路径为空或包含 .、.. 等无法安全映射到目录内的部分时返回 None。
+    """
+    path = unquote(urlsplit(url).path)
+    base_path = urlsplit(base_url).path.rstrip("/")
+    if base_path and path.startswith(base_path + "/"):
+        path = path[len(base_path):]
+    parts = [part for part in path.split("/") if part]
+    if not parts or any(part in (".", "..") or "\\" in part or "\0" in part for part in parts):
+        return None
+    return "/".join(parts)
+
+
+class MirrorManifest:
+    """
+    镜像目录下的 .parkive-mirror.json，记录已经下载的 URL 及其相对路径、SHA-256 和大小。
+    再次运行时跳过清单中已有且文件大小一致的 URL；内容相同的文件通过硬链接共享同一份数据。
+    """
+
+    def __init__(self, dest_dir: Path):
+        self.dest_dir = dest_dir
+        self.path = dest_dir / MANIFEST_FILENAME
+        self.entries: dict[str, dict] = self._load()
+        self.by_hash: dict[str, str] = {entry["sha256"]: entry["path"] for entry in self.entries.values()}
+
+    def _load(self) -> dict[str, dict]:
+        if not self.path.is_file():
+            return {}
+        loaded = json.loads(self.path.read_text(encoding="utf-8"))
+        if loaded.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"unsupported mirror manifest version in {self.path}")
+        return loaded["urls"]
+
+    def is_done(self, url: str, rel_path: str) -> bool:
+        entry = self.entries.get(url)
+        if entry is None or entry["path"] != rel_path:
+            return False
+        try:
+            return (self.dest_dir / rel_path).stat().st_size == entry["size"]
+        except OSError:
+            return False
+
+    def add(self, url: str, rel_path: str, sha256: str, size: int) -> None:
+        self.entries[url] = {"path": rel_path, "sha256": sha256, "size": size}
+        self.by_hash.setdefault(sha256, rel_path)
+
+    def save(self) -> None:
+        tmp_path = self.path.with_name(MANIFEST_FILENAME + ".tmp")
+        tmp_path.write_text(json.dumps({"version": MANIFEST_VERSION, "urls": self.entries}, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+
+def _store(manifest: MirrorManifest, rel_path: str, part_path: Path, sha256: str) -> bool:
+    """把下载好的 part_path 放到 rel_path；已有内容相同的文件时改为硬链接到该文件。返回是否去重。"""
+    target = manifest.dest_dir / rel_path
+    existing = manifest.by_hash.get(sha256)
+    if existing is not None and existing != rel_path and (manifest.dest_dir / existing).is_file():
+        tmp_link = target.with_name(target.name + ".link")
+        try:
+            tmp_link.unlink(missing_ok=True)
+            os.link(manifest.dest_dir / existing, tmp_link)
+        except OSError as e:
+            # 文件系统不支持硬链接时保留独立的副本
+            log.debug(f"Cannot hardlink {existing} to {rel_path}: {e}")
+        else:
+            os.replace(tmp_link, target)
+            part_path.unlink()
+            return True
+    os.replace(part_path, target)
+    return False
+
+
+def mirror_urls(urls: list[str], base_url: str, dest_dir: Path, timeout: float = 30.0, concurrency: int = 8, on_result=None) -> dict:
+    """
+    把 urls 下载到 dest_dir 中与 URL 路径对应的位置，返回各类数量以及失败、冲突和无法映射的 URL。
+    on_result(url, result) 在每个下载完成时被调用。
+    """
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    manifest = MirrorManifest(dest_dir)
+    summary = {"total": len(urls), "skipped": 0, "downloaded": 0, "deduplicated": 0, "bytes": 0,
+               "failed": [], "conflicts": [], "invalid": []}
+
+    plan: dict[str, str] = {}
+    owners: dict[str, str] = {}
+    for url in urls:
+        rel_path = mirror_path(url, base_url)
+        if rel_path is None:
+            summary["invalid"].append(url)
+            continue
+        owner = owners.setdefault(rel_path, url)
+        if owner != url:
+            # 只有查询参数不同的 URL 会映射到同一个文件，只下载第一个
+            summary["conflicts"].append((url, owner))
+            continue
+        plan[url] = rel_path
+    pending = [url for url, rel_path in plan.items() if not manifest.is_done(url, rel_path)]
+    summary["skipped"] = len(plan) - len(pending)
+    stats.count("mirror urls skipped", summary["skipped"])
+
+    def fetch(pool, url: str) -> dict:
+        target = dest_dir / plan[url]
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            return {"ok": False, "status": None, "error": str(e)}
+        return download_url(pool, url, target.with_name(target.name + ".part"))
+
+    def store(url: str, result: dict) -> None:
+        if result["ok"]:
+            rel_path = plan[url]
+            part_path = dest_dir / (rel_path + ".part")
+            try:
+                deduplicated = _store(manifest, rel_path, part_path, result["sha256"])
+            except OSError as e:
+                part_path.unlink(missing_ok=True)
+                result = {"ok": False, "status": result["status"], "error": str(e)}
+        if result["ok"]:
+            if deduplicated:
+                summary["deduplicated"] += 1
+            manifest.add(url, rel_path, result["sha256"], result["size"])
+            summary["downloaded"] += 1
+            summary["bytes"] += result["size"]
+            if summary["downloaded"] % MANIFEST_SAVE_EVERY == 0:
+                manifest.save()
+        else:
+            summary["failed"].append((url, result))
+        if on_result is not None:
+            on_result(url, result)
+
+    try:
+        if pending:
+            # 所有 URL 都属于同一个来源，并发数即是对该主机的并发数
+            fetch_all(fetch, pending, timeout, concurrency, concurrency, store)
+    finally:
+        manifest.save()
+    return summary
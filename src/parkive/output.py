@@ -0,0 +1,96 @@
+from enum import Enum
+from rich.console import Console
+from . import config
+
+import os
+import sys
+import json
+
+
+console = Console()
+err_console = Console(stderr=True)
+
+# 机器可读格式每积累这么多行写一次标准输出
+FLUSH_LINES = 512
+# tsv 字段中的反斜杠、制表符和换行符转义为 \\、\t、\n、\r，保证每行的字段数与表头相同
+TSV_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def tsv_line(values) -> str:
+    return "\t".join(str(value).translate(TSV_ESCAPES) for value in values)
+
+
+class OutputFormat(str, Enum):
+    table = "table"
+    ndjson = "ndjson"
+    tsv = "tsv"
+
+
+class RecordWriter:
+    """
+    逐文件输出命令结果。
+
+     - table：与之前相同，通过 Rich 逐行打印带样式的 "路径\\t数值"
+     - ndjson：每个文件一行 JSON 对象，最后一行是 {"total": {...}}，无法处理的文件输出 {"path", "error"}
+     - tsv：带表头的制表符分隔表格，每个文件一行，字段中的反斜杠、制表符和换行符被转义；无法处理的文件作为警告输出到标准错误
+
+    机器可读格式不经过 Rich，结果在扫描过程中分批写入标准输出，可以直接通过管道交给其他工具。
+    quiet 为 True 时不输出逐文件的行，只输出汇总（tsv 输出一行汇总表格）。
+    """
+
+    def __init__(self, fmt: OutputFormat, columns: list[str], quiet: bool = False):
+        self.format = fmt
+        self.columns = columns
+        self.quiet = quiet
+        self._lines: list[str] = []
+        self._broken = False
+        if fmt is OutputFormat.tsv and not quiet:
+            self._write(tsv_line(columns))
+
+    def _write(self, line: str) -> None:
+        self._lines.append(line)
+        if len(self._lines) >= FLUSH_LINES:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._lines or self._broken:
+            self._lines.clear()
+            return
+        try:
+            sys.stdout.write("\n".join(self._lines) + "\n")
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # 下游（例如 head）提前关闭了管道：丢弃剩余输出，但命令本身继续执行完（例如保存索引）
+            self._broken = True
+            try:
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            except (OSError, ValueError):
+                pass
+        self._lines.clear()
+
+    def row(self, record: dict) -> None:
+        if self.quiet:
+            return
+        if self.format is OutputFormat.table:
+            # 路径和片段中的方括号是原文，不能当作 Rich 标记解析
+            console.print("\t".join(str(record[c]) for c in self.columns), style=config.info_style, markup=False)
+        elif self.format is OutputFormat.ndjson:
+            self._write(json.dumps(record, ensure_ascii=False))
+        else:
+            self._write(tsv_line(record[c] for c in self.columns))
+
+    def error(self, path: str, message: str) -> None:
+        if self.format is OutputFormat.ndjson:
+            self._write(json.dumps({"path": path, "error": message}, ensure_ascii=False))
+            return
+        target = console if self.format is OutputFormat.table else err_console
+        target.print(f"skipped {path}: {message}", style=config.warning_style, markup=False)
+
+    def close(self, totals: dict) -> None:
+        """输出机器可读格式的汇总并写出缓冲区；table 格式的汇总由命令自行打印。"""
+        if self.format is OutputFormat.ndjson:
+            self._write(json.dumps({"total": totals}, ensure_ascii=False))
+        elif self.format is OutputFormat.tsv and self.quiet:
+            self._write(tsv_line(totals))
+            self._write(tsv_line(totals.values()))
+        self.flush()
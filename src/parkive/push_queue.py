@@ -0,0 +1,193 @@
+from pathlib import Path
+from contextlib import contextmanager
+from datetime import datetime
+from .common import acquire_lock, parkive_state_dir
+
+import os
+import sys
+import json
+import time
+import uuid
+import subprocess
+
+
+QUEUE_VERSION = 1
+# 推送失败后按指数退避重试：5s、10s、20s……最长间隔 10 分钟，连续失败 MAX_ATTEMPTS 次后不再自动重试
+BACKOFF_BASE_S = 5
+BACKOFF_MAX_S = 600
+MAX_ATTEMPTS = 8
+
+
+def backoff_delay(attempts: int) -> float:
+    return min(BACKOFF_BASE_S * 2 ** (attempts - 1), BACKOFF_MAX_S)
+
+
+class PushQueue:
+    """
+    保存在 .parkive/queue 下的待推送队列：
+     - queue.json：待推送的条目，每条记录 git push 的参数、入队时的 HEAD、尝试次数和下次重试时间
+     - queue.lock：读写 queue.json 时持有的锁
+     - worker.lock：后台工作进程在运行期间持有的锁，保证同一时间只有一个工作进程
+     - worker.log：后台工作进程的推送记录
+
+    推送参数相同的条目会合并为一条：推送的是分支的当前状态，只需要推送最新的一次。
+    """
+
+    def __init__(self, parkive_root: Path):
+        self.parkive_root = parkive_root
+        self.dir = parkive_root / ".parkive" / "queue"
+        self.path = self.dir / "queue.json"
+        self.lock_path = self.dir / "queue.lock"
+        self.worker_lock_path = self.dir / "worker.lock"
+        self.log_path = self.dir / "worker.log"
+
+    def _load(self) -> list[dict]:
+        if not self.path.is_file():
+            return []
+        loaded = json.loads(self.path.read_text(encoding="utf-8"))
+        if loaded.get("version") != QUEUE_VERSION:
+            raise ValueError(f"unsupported push queue version in {self.path}")
+        return loaded["entries"]
+
+    def _save(self, entries: list[dict]) -> None:
+        tmp_path = self.path.with_name("queue.json.tmp")
+        tmp_path.write_text(json.dumps({"version": QUEUE_VERSION, "entries": entries}, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    @contextmanager
+    def _transaction(self):
+        """在队列锁内读取条目，退出时写回对条目列表的修改。"""
+        parkive_state_dir(self.parkive_root, "queue")
+        lock = acquire_lock(self.lock_path)
+        try:
+            entries = self._load()
+            yield entries
+            self._save(entries)
+        finally:
+            lock.close()
+
+    def entries(self) -> list[dict]:
+        if not self.path.is_file():
+            return []
+        lock = acquire_lock(self.lock_path)
+        try:
+            return self._load()
+        finally:
+            lock.close()
+
+    def enqueue(self, args: list[str], commit: str) -> bool:
+        """加入一次 git push，返回是否与已有的条目合并。"""
+        with self._transaction() as entries:
+            merged = [e for e in entries if e["args"] == args]
+            entries[:] = [e for e in entries if e["args"] != args]
+            entries.append({
+                "id": uuid.uuid4().hex,
+                "args": args,
+                "commit": commit,
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt": 0.0,
+                "last_error": None,
+            })
+        return bool(merged)
+
+    def clear(self) -> int:
+        with self._transaction() as entries:
+            removed = len(entries)
+            entries.clear()
+        return removed
+
+    def worker_running(self) -> bool:
+        if not self.worker_lock_path.exists():
+            return False
+        lock = acquire_lock(self.worker_lock_path, blocking=False)
+        if lock is None:
+            return True
+        lock.close()
+        return False
+
+    def _log(self, message: str) -> None:
+        with self.log_path.open("a", encoding="utf-8") as f:
+            f.write(f"{datetime.now().isoformat(timespec='seconds')} {message}\n")
+
+    def attempt(self, entry: dict) -> tuple[bool, str | None]:
+        """执行一次推送并更新条目：成功时移出队列，失败时记录错误并安排下次重试。"""
+        result = subprocess.run(
+            ["git", "push", *entry["args"]],
+            cwd=str(self.parkive_root),
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+        )
+        ok = result.returncode == 0
+        error = None if ok else (result.stderr.strip() or f"git push exited with {result.returncode}")
+        self._log(f"git push {' '.join(entry['args'])}: " + ("ok" if ok else "failed: " + " ".join(error.split())))
+
+        with self._transaction() as entries:
+            # 推送期间同一参数的条目可能已被新的提交替换（id 不同），此时保留新条目
+            current = next((e for e in entries if e["id"] == entry["id"]), None)
+            if current is not None:
+                if ok:
+                    entries.remove(current)
+                else:
+                    current["attempts"] += 1
+                    current["last_error"] = error
+                    current["next_attempt"] = time.time() + backoff_delay(current["attempts"])
+                    if current["attempts"] >= MAX_ATTEMPTS:
+                        current["status"] = "failed"
+        return ok, error
+
+    def flush(self) -> list[tuple[dict, bool, str | None]]:
+        """立即尝试推送所有条目（包括已放弃重试的条目）各一次，忽略退避时间。"""
+        results = []
+        for entry in self.entries():
+            ok, error = self.attempt(entry)
+            results.append((entry, ok, error))
+        return results
+
+    def run_worker(self) -> None:
+        """后台工作进程的主循环：按退避时间依次推送到期的条目，队列中没有待推送的条目时退出。"""
+        parkive_state_dir(self.parkive_root, "queue")
+        worker_lock = acquire_lock(self.worker_lock_path, blocking=False)
+        if worker_lock is None:
+            return
+        try:
+            while True:
+                with self._transaction() as entries:
+                    pending = [e for e in entries if e["status"] == "pending"]
+                    if not pending:
+                        # 在持有队列锁时释放工作进程锁：之后入队的条目一定能由新启动的工作进程处理
+                        worker_lock.close()
+                        return
+                    now = time.time()
+                    due = [e for e in pending if e["next_attempt"] <= now]
+                    wait = min(e["next_attempt"] for e in pending) - now
+                for entry in due:
+                    self.attempt(entry)
+                if not due:
+                    time.sleep(max(wait, 0.1))
+        finally:
+            worker_lock.close()
+
+    def start_worker(self) -> None:
+        """启动一个与当前终端分离的后台工作进程；已有工作进程在运行时，新进程会立即退出。"""
+        kwargs = {}
+        if os.name == "nt":
+            kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs["start_new_session"] = True
+        subprocess.Popen(
+            [sys.executable, "-m", "parkive.push_queue", str(self.parkive_root)],
+            cwd=str(self.parkive_root),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            **kwargs,
+        )
+
+
+if __name__ == "__main__":
+    PushQueue(Path(sys.argv[1])).run_worker()
@@ -0,0 +1,188 @@
+from pathlib import Path
+from typing import Annotated
+from rich.console import Console
+from . import config
+from .stats import stats
+
+import os
+import time
+import typer
+import tomllib
+import logging
+
+
+console = Console()
+log = logging.getLogger(__name__)
+vaults_app = typer.Typer(no_args_is_help=True)
+
+REGISTRY_FILENAME = "vaults.toml"
+# --all-vaults 默认最多同时处理的知识库数量。git sync 等操作的耗时主要在等待网络，因此不按 CPU 数量限制
+DEFAULT_VAULT_CONCURRENCY = 8
+
+
+def registry_path() -> Path:
+    return config.user_config_dir() / REGISTRY_FILENAME
+
+
+def read_registry() -> dict[str, Path]:
+    """
+    读取用户配置目录中的 vaults.toml，返回 {名称: 知识库根目录}，文件不存在时返回空字典，忽略值不是字符串的项。
+    vaults 不是表时抛出 ValueError，文件无法读取或解析时抛出 OSError / tomllib.TOMLDecodeError。
+    """
+    path = registry_path()
+    if not path.is_file():
+        return {}
+    with path.open("rb") as f:
+        vaults = tomllib.load(f).get("vaults", {})
+    if not isinstance(vaults, dict):
+        raise ValueError(f"Invalid format in {path}: 'vaults' should be a table.")
+    return {name: Path(root) for name, root in vaults.items() if isinstance(root, str)}
+
+
+def save_registry(vaults: dict[str, Path]) -> None:
+    """通过临时文件加重命名写入 vaults.toml，按名称排序。"""
+    import tomli_w
+
+    path = registry_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(REGISTRY_FILENAME + ".tmp")
+    with tmp_path.open("wb") as f:
+        tomli_w.dump({"vaults": {name: str(root) for name, root in sorted(vaults.items())}}, f)
+    os.replace(tmp_path, path)
+
+
+def load_registry() -> dict[str, Path]:
+    try:
+        return read_registry()
+    except Exception as e:
+        console.print(f"Failed to load the vault registry from {registry_path()}: {e}", style=config.error_style)
+        raise typer.Exit(code=1)
+
+
+def registered_vaults() -> dict[str, Path]:
+    """--all-vaults 使用的知识库，注册表为空时打印错误并退出。"""
+    vaults = load_registry()
+    if not vaults:
+        console.print("No vaults registered. Use 'parkive vaults add' to register one.", style=config.error_style)
+        raise typer.Exit(code=1)
+    return vaults
+
+
+def vault_workers(vaults: dict[str, Path], concurrency: int | None) -> int:
+    if concurrency is None or concurrency <= 0:
+        concurrency = DEFAULT_VAULT_CONCURRENCY
+    return max(1, min(len(vaults), concurrency))
+
+
+def vault_jobs(jobs: int | None, workers: int) -> int:
+    """每个知识库内部解析文件的进程数：未指定 --jobs 时由同时运行的知识库平分 CPU，避免进程数成倍超过 CPU 数量。"""
+    if jobs is None or jobs <= 0:
+        return max(1, (os.cpu_count() or 1) // workers)
+    return jobs
+
+
+def _run_in_vault(func, root: Path, args: tuple) -> dict:
+    # 在工作进程中执行，任何异常都只记为这个知识库的失败
+    start = time.perf_counter()
+    try:
+        # Vault 会从给定目录向上查找 .parkive，这里要求注册的目录本身就是知识库，避免误用上层目录中的知识库
+        if not (root / ".parkive").is_dir():
+            raise FileNotFoundError(f"{root} is not a parkive vault (no .parkive directory).")
+        outcome = {"result": func(root, *args)}
+    except typer.Exit:
+        outcome = {"error": "the command failed, see the messages above."}
+    except Exception as e:
+        outcome = {"error": str(e) or type(e).__name__}
+    outcome["elapsed"] = time.perf_counter() - start
+    return outcome
+
+
+def map_vaults(func, vaults: dict[str, Path], workers: int, *args):
+    """
+    在最多 workers 个进程中并行地对每个知识库调用 func(root, *args)，按完成顺序生成 (名称, 根目录, 结果)：
+    成功时结果为 {"result", "elapsed"}，失败（包括工作进程异常退出）时为 {"error", "elapsed"}，一个知识库失败不影响其他知识库。
+    每个知识库在独立的进程中运行，CPU 密集的解析和等待网络的 git 操作都可以同时进行；
+    func 必须是模块级函数，参数和返回值必须能够在进程间传递。
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    stats.count("vaults", len(vaults))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_run_in_vault, func, root, args): (name, root) for name, root in vaults.items()}
+        completed = as_completed(futures)
+        while True:
+            # 只把等待工作进程的时间计入 vaults 阶段，调用方处理结果的时间计入各自的阶段
+            with stats.phase("vaults"):
+                future = next(completed, None)
+            if future is None:
+                break
+            name, root = futures[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                outcome = {"error": str(e) or type(e).__name__, "elapsed": 0.0}
+            yield name, root, outcome
+
+
+def print_vault_header(name: str, root: Path, outcome: dict) -> None:
+    console.print(f"\n[{name}] {root} ({outcome['elapsed']:.2f} s)", style=config.success_style if "error" not in outcome else config.error_style, markup=False)
+    if "error" in outcome:
+        console.print(outcome["error"], style=config.error_style, markup=False, highlight=False)
+
+
+def finish_vaults(outcomes: dict[str, dict], start: float) -> None:
+    """打印 --all-vaults 的汇总行，有知识库失败时以状态 1 退出。"""
+    failed = sorted(name for name, outcome in outcomes.items() if "error" in outcome)
+    summary = f"{len(outcomes)} vaults finished in {time.perf_counter() - start:.2f} s"
+    if failed:
+        console.print(f"{summary}, {len(failed)} failed: {', '.join(failed)}.", style=config.error_style)
+        raise typer.Exit(code=1)
+    console.print(f"{summary}.", style=config.success_style)
+
+
+@vaults_app.command("add")
+def vaults_add(path: Annotated[str | None, typer.Argument(help="Any directory inside the vault. Defaults to the current working directory.")] = None,
+               name: Annotated[str | None, typer.Option("--name", "-n", help="Name of the vault in the registry. Defaults to the name of its root directory.")] = None):
+    """Register a vault so that commands run with --all-vaults include it."""
+    root = config.find_parkive_root(None if path is None else Path(path).expanduser())
+    if root is None:
+        console.print(f"Cannot find .parkive directory from {path or Path.cwd()} upward.", style=config.error_style)
+        raise typer.Exit(code=1)
+    name = name or root.name
+    vaults = load_registry()
+    if name in vaults and vaults[name] != root:
+        console.print(f"vault '{name}' is already registered at {vaults[name]}.", style=config.error_style)
+        raise typer.Exit(code=1)
+    for other, other_root in vaults.items():
+        if other != name and other_root == root:
+            console.print(f"{root} is already registered as '{other}'.", style=config.error_style)
+            raise typer.Exit(code=1)
+    vaults[name] = root
+    save_registry(vaults)
+    console.print(f"registered vault '{name}' at {root}", style=config.success_style)
+
+
+@vaults_app.command("remove")
+def vaults_remove(name: Annotated[str, typer.Argument(help="Name of the vault to remove from the registry. The vault itself is not touched.")]):
+    """Remove a vault from the registry."""
+    vaults = load_registry()
+    if name not in vaults:
+        console.print(f"vault '{name}' not found.", style=config.error_style)
+        raise typer.Exit(code=1)
+    del vaults[name]
+    save_registry(vaults)
+    console.print(f"removed vault '{name}'", style=config.success_style)
+
+
+@vaults_app.command("list")
+def vaults_list():
+    """List the registered vaults."""
+    vaults = load_registry()
+    if not vaults:
+        console.print(f"No vaults registered in {registry_path()}.", style=config.warning_style)
+        return
+    for name, root in sorted(vaults.items()):
+        if (root / ".parkive").is_dir():
+            console.print(f"{name}\t{root}", style=config.info_style)
+        else:
+            console.print(f"{name}\t{root}\t(missing)", style=config.warning_style)
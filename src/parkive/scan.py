@@ -0,0 +1,473 @@
+from urllib.parse import urlparse
+from functools import lru_cache
+
+import re
+import codecs
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+MD_IMAGE_RE = re.compile(
+    r"!\[(?P<alt>[^\]]*)\]\((?P<url>[^)\s]+)(?P<tail>\s+\"[^\"]*\")?\)"
+)
+HTML_IMAGE_RE = re.compile(
+    r"(?P<prefix><img\b[^>]*\bsrc\s*=\s*[\"'])(?P<url>[^\"']+)(?P<suffix>[\"'])",
+    flags=re.IGNORECASE,
+)
+
+# 单次扫描使用的组合正则：两个分支分别与 MD_IMAGE_RE / HTML_IMAGE_RE 等价。
+# 两种标签的首字符不同（! 与 <），同一位置至多有一个分支能匹配。
+IMAGE_RE = re.compile(
+    r"!\[[^\]]*\]\((?P<md_url>[^)\s]+)(?:\s+\"[^\"]*\")?\)"
+    r"|(?i:<img\b[^>]*\bsrc\s*=\s*[\"'])(?P<html_url>[^\"']+)[\"']"
+)
+# 两种标签的起始符号，用于检查一种标签的匹配片段内部是否嵌套了另一种标签
+MD_START_RE = re.compile(r"!\[")
+HTML_START_RE = re.compile(r"<img", flags=re.IGNORECASE)
+
+# 不以 ! 开头的 Markdown 链接（即不是图片）。链接文本中允许嵌套一层方括号，例如 [![badge](a.png)](note.md)；
+# 目标可以用尖括号括起来以包含空格，例如 [a](<my note.md>)
+MD_LINK_RE = re.compile(
+    r"(?<!!)\[[^\[\]]*(?:\[[^\]]*\][^\[\]]*)*\]\((?:<(?P<angle_url>[^<>\n]+)>|(?P<url>[^)\s]+))(?:\s+\"[^\"]*\")?\)"
+)
+# 两个以上字母的 scheme（http:、mailto: 等）表示外部链接；单个字母的是 Windows 盘符
+URL_SCHEME_RE = re.compile(r"[A-Za-z][A-Za-z0-9+.-]+:")
+
+EN_WORD_RE = re.compile(r"[A-Za-z0-9]+(?:['_-][A-Za-z0-9]+)*")
+CJK_CHAR_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+# 字节模式的正则，用于通过 mmap 直接扫描超大文件而不解码整个文件，匹配结果必须与 str 版本相同。
+# 字节模式中 \s、\b 和 IGNORECASE 只按 ASCII 判断，因此字节模式的正则由模板展开，把它们替换为对应 Unicode 字符的 UTF-8 编码：
+#  - {s} 是 str 模式中 \s 匹配的任意一个空白字符，{url} 是 [^)\s] 匹配的一个字符
+#  - {i}、{S} 是忽略大小写时与 i、s 匹配的字符（还包括 İ、ı 和 ſ），m、g、r、c 没有 ASCII 之外的对应字符
+#  - {wb_after} / {wb_before} 对应 img 之后和 src 之前的 \b，需要 Unicode 的 \w 字符集，见 _html_image_bres
+SPACE_B = (
+    r"(?:[\t\n\x0b\x0c\r\x1c-\x20]"
+    r"|\xc2[\x85\xa0]"                          # U+0085, U+00A0
+    r"|\xe1\x9a\x80"                            # U+1680
+    r"|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]"         # U+2000 - U+200A, U+2028, U+2029, U+202F
+    r"|\xe2\x81\x9f"                            # U+205F
+    r"|\xe3\x80\x80)"                           # U+3000
+)
+URL_CHAR_B = rf"(?:(?!{SPACE_B})[^)])"
+I_CHAR_B = r"(?:[Ii]|\xc4[\xb0\xb1])"            # I, i, U+0130, U+0131
+S_CHAR_B = r"(?:[Ss]|\xc5\xbf)"                  # S, s, U+017F
+
+MD_IMAGE_PATTERN_B = r"!\[(?P<alt>[^\]]*)\]\((?P<url>{url}+)(?P<tail>{s}+\"[^\"]*\")?\)"
+HTML_IMAGE_PATTERN_B = r"(?P<prefix><{i}[Mm][Gg]{wb_after}[^>]*{wb_before}{S}[Rr][Cc]{s}*={s}*[\"'])(?P<url>[^\"']+)(?P<suffix>[\"'])"
+IMAGE_PATTERN_B = (
+    r"!\[[^\]]*\]\((?P<md_url>{url}+)(?:{s}+\"[^\"]*\")?\)"
+    r"|<{i}[Mm][Gg]{wb_after}[^>]*{wb_before}{S}[Rr][Cc]{s}*={s}*[\"'](?P<html_url>[^\"']+)[\"']"
+)
+MD_LINK_PATTERN_B = r"(?<!!)\[[^\[\]]*(?:\[[^\]]*\][^\[\]]*)*\]\((?:<(?P<angle_url>[^<>\n]+)>|(?P<url>{url}+))(?:{s}+\"[^\"]*\")?\)"
+
+
+def _bytes_pattern(template: str, **extra: str) -> bytes:
+    values = {"s": SPACE_B, "url": URL_CHAR_B, "i": I_CHAR_B, "S": S_CHAR_B, **extra}
+    return re.sub(r"\{(\w+)\}", lambda m: values[m.group(1)], template).encode()
+
+
+def _utf8_sequences(lo: int, hi: int):
+    """把同一编码长度内的码位范围 [lo, hi] 拆分为若干组逐字节的范围 [(首字节范围), (第二字节范围), ...]。"""
+    size = len(chr(lo).encode("utf-8"))
+    for i in range(1, size):
+        mask = (1 << (6 * i)) - 1
+        if lo & ~mask != hi & ~mask:
+            if lo & mask:
+                yield from _utf8_sequences(lo, lo | mask)
+                yield from _utf8_sequences((lo | mask) + 1, hi)
+                return
+            if hi & mask != mask:
+                yield from _utf8_sequences(lo, (hi & ~mask) - 1)
+                yield from _utf8_sequences(hi & ~mask, hi)
+                return
+    yield list(zip(chr(lo).encode("utf-8"), chr(hi).encode("utf-8")))
+
+
+def _non_ascii_word_patterns() -> dict[int, str]:
+    """返回 {编码长度: 匹配该长度的非 ASCII 单词字符（str 模式中 \\w 匹配的字符）的 UTF-8 编码的模式}。"""
+    ranges: list[list[int]] = []
+    for code in range(0x80, 0x110000):
+        if chr(code).isalnum():
+            if ranges and ranges[-1][1] == code - 1:
+                ranges[-1][1] = code
+            else:
+                ranges.append([code, code])
+    alternatives: dict[int, list[str]] = {}
+    for lo, hi in ranges:
+        for limit_lo, limit_hi in [(0x80, 0x7FF), (0x800, 0xFFFF), (0x10000, 0x10FFFF)]:
+            if max(lo, limit_lo) > min(hi, limit_hi):
+                continue
+            for sequence in _utf8_sequences(max(lo, limit_lo), min(hi, limit_hi)):
+                alternatives.setdefault(len(sequence), []).append(
+                    "".join(f"\\x{a:02x}" if a == b else f"[\\x{a:02x}-\\x{b:02x}]" for a, b in sequence)
+                )
+    return {size: "|".join(items) for size, items in alternatives.items()}
+
+
+@lru_cache(maxsize=None)
+def _html_image_bres() -> tuple[re.Pattern, re.Pattern]:
+    """
+    返回字节模式的 (HTML_IMAGE_BRE, IMAGE_BRE)。单词边界需要逐个列出 Unicode 的单词字符，生成和编译需要零点几秒，
+    因此只在第一次扫描超大文件时生成。后行断言要求固定宽度，src 之前的字符按编码长度分别检查。
+    """
+    words = _non_ascii_word_patterns()
+    wb_after = "(?![A-Za-z0-9_]|" + "|".join(words.values()) + ")"
+    wb_before = f"(?={S_CHAR_B})(?<![A-Za-z0-9_])" + "".join(f"(?<!{pattern})" for pattern in words.values())
+    return (
+        re.compile(_bytes_pattern(HTML_IMAGE_PATTERN_B, wb_after=wb_after, wb_before=wb_before)),
+        re.compile(_bytes_pattern(IMAGE_PATTERN_B, wb_after=wb_after, wb_before=wb_before)),
+    )
+
+
+MD_IMAGE_BRE = re.compile(_bytes_pattern(MD_IMAGE_PATTERN_B))
+MD_START_BRE = re.compile(rb"!\[")
+HTML_START_BRE = re.compile(_bytes_pattern(r"<{i}[Mm][Gg]"))
+MD_LINK_BRE = re.compile(_bytes_pattern(MD_LINK_PATTERN_B))
+URL_SCHEME_BRE = re.compile(URL_SCHEME_RE.pattern.encode())
+EN_WORD_BRE = re.compile(EN_WORD_RE.pattern.encode())
+# CJK_CHAR_RE 中各字符范围的 UTF-8 编码
+CJK_CHAR_BRE = re.compile(
+    rb"\xe3[\x90-\xbf][\x80-\xbf]"             # U+3400 - U+3FFF
+    rb"|\xe4[\x80-\xb6\xb8-\xbf][\x80-\xbf]"    # U+4000 - U+4DBF, U+4E00 - U+4FFF
+    rb"|[\xe5-\xe9][\x80-\xbf][\x80-\xbf]"       # U+5000 - U+9FFF
+    rb"|\xef[\xa4-\xab][\x80-\xbf]"             # U+F900 - U+FAFF
+)
+
+
+# 逐块检查超大文件是否是合法 UTF-8 时每块的字节数
+UTF8_CHECK_CHUNK = 1024 * 1024
+
+
+def validate_utf8(buf) -> None:
+    """
+    逐块检查 buf（bytes 或 mmap）是否是合法的 UTF-8，内存占用与大小无关。
+    不合法时抛出 UnicodeDecodeError，start / end 为出错字节在整个 buf 中的位置，与 bytes.decode 报告的位置相同。
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with memoryview(buf) as view:
+        size = len(view)
+        for offset in range(0, size, UTF8_CHECK_CHUNK):
+            with view[offset:offset + UTF8_CHECK_CHUNK] as chunk:
+                try:
+                    decoder.decode(chunk, final=offset + len(chunk) >= size)
+                except UnicodeDecodeError as e:
+                    # e.object 由上一块末尾未解码完的字节和本块拼接而成
+                    start = offset - (len(e.object) - len(chunk)) + e.start
+                    end = start + (e.end - e.start)
+                    raise UnicodeDecodeError("utf-8", bytes(view[start:end]), start, end, e.reason) from None
+
+
+def may_contain_images(content: str | bytes) -> bool:
+    """
+    快速判断 content 中是否可能有图片标签：必须出现 "![" 或（不区分大小写的）"<img"，否则 IMAGE_RE 不可能匹配。
+    大多数情况下只需一两次 find；"<img" 使用与 IMAGE_RE 相同的忽略大小写规则，因此 "<İmg"、"<ımg" 同样会被识别，
+    bytes 的 HTML_START_BRE 也列出了这两个字符的 UTF-8 编码。
+    """
+    if isinstance(content, str):
+        md_start, tag_start, html_start_re = "![", "<", HTML_START_RE
+    else:
+        md_start, tag_start, html_start_re = b"![", b"<", HTML_START_BRE
+    if content.find(md_start) >= 0:
+        return True
+    return content.find(tag_start) >= 0 and html_start_re.search(content) is not None
+
+
+class LiteralFilter:
+    """
+    判断 UTF-8 内容（bytes 或 mmap）中是否出现任意一个字面量，用于在解码和正则匹配之前排除不可能命中的文件。
+    字面量不多时逐个 find，每次都是 memchr 速度的扫描；较多时合并为一个正则交替，只扫描一遍。
+    """
+
+    MAX_FIND_LITERALS = 3
+
+    def __init__(self, literals):
+        self.literals = sorted({literal.encode("utf-8") for literal in literals}, key=len, reverse=True)
+        self._regex = None
+        if len(self.literals) > self.MAX_FIND_LITERALS:
+            self._regex = re.compile(b"|".join(re.escape(literal) for literal in self.literals))
+
+    def search(self, content) -> bool:
+        if self._regex is not None:
+            return self._regex.search(content) is not None
+        return any(content.find(literal) >= 0 for literal in self.literals)
+
+
+@lru_cache(maxsize=16)
+def source_prefix_filter(prefixes: tuple[str, ...]) -> LiteralFilter:
+    """按来源前缀构造的 LiteralFilter：URL 能匹配某个前缀时，该前缀一定原样出现在文件内容中。"""
+    return LiteralFilter(prefixes)
+
+
+def prefix_match(url: str, prefix: str) -> bool:
+    """检查 url 是否以 prefix 开头，并且后面要么结束，要么是 / ? # 之一。"""
+    if not url.startswith(prefix):
+        return False
+    if len(url) == len(prefix):
+        return True
+    return url[len(prefix)] in ["/", "?", "#"]
+
+
+def convert_url_prefix(url: str, source_prefix: str, target_prefix: str) -> str:
+    if not prefix_match(url, source_prefix):
+        return url
+    return target_prefix + url[len(source_prefix) :]
+
+
+def find_image_spans(content: str | bytes) -> list[tuple[str, int, int]] | None:
+    """
+    单次从左到右扫描 content 中的 Markdown 和 HTML 图片标签，按出现顺序返回 (kind, start, end) 列表，
+    kind 为 "md" 或 "html"，start/end 为 URL 在 content 中的位置。content 也可以是 bytes 或 mmap，此时使用字节模式的正则。
+
+    结果与分别用 MD_IMAGE_RE 和 HTML_IMAGE_RE 扫描两遍相同。两种标签互相嵌套时（例如 alt 文本中包含 <img>），
+    单次扫描无法得到相同的结果，此时返回 None，调用方应退回到分两遍扫描。
+    """
+    if isinstance(content, str):
+        image_re, md_start_re, html_start_re = IMAGE_RE, MD_START_RE, HTML_START_RE
+    else:
+        image_re, md_start_re, html_start_re = _html_image_bres()[1], MD_START_BRE, HTML_START_BRE
+    spans = []
+    for match in image_re.finditer(content):
+        start, end = match.span()
+        if match.group("md_url") is not None:
+            kind, nested_re, lookahead = "md", html_start_re, 3
+        else:
+            kind, nested_re, lookahead = "html", md_start_re, 1
+        # 多看 len(起始符号) - 1 个字符，以发现跨越匹配结尾的起始符号
+        nested = nested_re.search(content, start + 1, end + lookahead)
+        if nested is not None and nested.start() < end:
+            return None
+        spans.append((kind, *match.span(f"{kind}_url")))
+    return spans
+
+
+class PrefixRewriter:
+    """
+    按 {源前缀: 目标前缀} 映射改写 URL，用于在一次遍历中同时完成多组来源切换。
+    多个源前缀都能匹配同一个 URL 时取最长的一个，边界规则与 prefix_match 相同。
+    """
+
+    def __init__(self, mapping: dict[str, str]):
+        self.mapping = mapping
+        self._matcher = SourceMatcher({prefix: prefix for prefix in mapping})
+
+    def convert(self, url: str) -> tuple[str, str | None]:
+        """返回 (改写后的 URL, 命中的源前缀)，URL 没有变化时命中的源前缀为 None。"""
+        source_prefix = self._matcher.match(url)
+        if source_prefix is None:
+            return url, None
+        converted_url = self.mapping[source_prefix] + url[len(source_prefix) :]
+        if converted_url == url:
+            return url, None
+        return converted_url, source_prefix
+
+
+def _replace_images_two_pass(content: str, rewriter: PrefixRewriter) -> tuple[str, dict[str, int]]:
+    replaced_counts: dict[str, int] = {}
+
+    def md_repl(match: re.Match) -> str:
+        original_url = match.group("url")
+        converted_url, source_prefix = rewriter.convert(original_url)
+        if source_prefix is None:
+            return match.group(0)
+        replaced_counts[source_prefix] = replaced_counts.get(source_prefix, 0) + 1
+        log.debug(f"Replacing URL in markdown: {original_url} => {converted_url}")
+        tail = match.group("tail") or ""
+        return f"![{match.group('alt')}]({converted_url}{tail})"
+
+    content = MD_IMAGE_RE.sub(md_repl, content)
+
+    def html_repl(match: re.Match) -> str:
+        original_url = match.group("url")
+        converted_url, source_prefix = rewriter.convert(original_url)
+        if source_prefix is None:
+            return match.group(0)
+        replaced_counts[source_prefix] = replaced_counts.get(source_prefix, 0) + 1
+        log.debug(f"Replacing URL in HTML: {original_url} => {converted_url}")
+        return f"{match.group('prefix')}{converted_url}{match.group('suffix')}"
+
+    content = HTML_IMAGE_RE.sub(html_repl, content)
+    return content, replaced_counts
+
+
+def rewrite_images_in_text(content: str, rewriter: PrefixRewriter) -> tuple[str, dict[str, int]]:
+    """按 rewriter 改写 content 中的图片 URL，返回 (新内容, {源前缀: 替换数量})。"""
+    spans = find_image_spans(content)
+    if spans is None:
+        return _replace_images_two_pass(content, rewriter)
+
+    # 只拼接发生变化的 URL 片段，没有替换时直接返回原字符串
+    replaced_counts: dict[str, int] = {}
+    pieces = []
+    last = 0
+    for kind, start, end in spans:
+        original_url = content[start:end]
+        converted_url, source_prefix = rewriter.convert(original_url)
+        if source_prefix is None:
+            continue
+        replaced_counts[source_prefix] = replaced_counts.get(source_prefix, 0) + 1
+        log.debug(f"Replacing URL in {kind}: {original_url} => {converted_url}")
+        pieces.append(content[last:start])
+        pieces.append(converted_url)
+        last = end
+
+    if not pieces:
+        return content, replaced_counts
+    pieces.append(content[last:])
+    return "".join(pieces), replaced_counts
+
+
+def replace_images_in_text(content: str, source_prefix: str, target_prefix: str) -> tuple[str, int]:
+    content, replaced_counts = rewrite_images_in_text(content, PrefixRewriter({source_prefix: target_prefix}))
+    return content, sum(replaced_counts.values())
+
+
+def write_replaced_images(content, rewriter: PrefixRewriter, write) -> dict[str, int]:
+    """
+    字节模式的 rewrite_images_in_text：content 为 bytes 或 mmap，替换后的内容按片段依次交给 write，
+    不在内存中构造完整的结果。只有匹配到的 URL 会被解码，返回 {源前缀: 替换数量}。
+    两种标签互相嵌套时退回到 str 模式处理整个文件（很少见）。
+    """
+    spans = find_image_spans(content)
+    if spans is None:
+        converted, replaced_counts = _replace_images_two_pass(bytes(content).decode("utf-8"), rewriter)
+        write(converted.encode("utf-8"))
+        return replaced_counts
+
+    replaced_counts: dict[str, int] = {}
+    last = 0
+    with memoryview(content) as view:
+        for kind, start, end in spans:
+            original_url = bytes(view[start:end]).decode("utf-8")
+            converted_url, source_prefix = rewriter.convert(original_url)
+            if source_prefix is None:
+                continue
+            replaced_counts[source_prefix] = replaced_counts.get(source_prefix, 0) + 1
+            log.debug(f"Replacing URL in {kind}: {original_url} => {converted_url}")
+            write(view[last:start])
+            write(converted_url.encode("utf-8"))
+            last = end
+        write(view[last:])
+    return replaced_counts
+
+
+def count_source_urls(content: str, base_url: str) -> int:
+    if base_url not in content:
+        return 0
+    return sum(1 for url in iter_image_urls(content) if prefix_match(url, base_url))
+
+
+def iter_image_urls(content: str | bytes):
+    """生成 content 中的图片 URL；content 为 bytes 或 mmap 时生成 bytes。"""
+    if not may_contain_images(content):
+        return
+    spans = find_image_spans(content)
+    if spans is None:
+        md_image_re, html_image_re = (MD_IMAGE_RE, HTML_IMAGE_RE) if isinstance(content, str) else (MD_IMAGE_BRE, _html_image_bres()[0])
+        for match in md_image_re.finditer(content):
+            yield match.group("url")
+        for match in html_image_re.finditer(content):
+            yield match.group("url")
+        return
+    for _, start, end in spans:
+        yield content[start:end]
+
+
+def iter_local_links(content: str | bytes):
+    """
+    生成 content 中指向本地文件的 Markdown 链接目标（不含图片），忽略带 scheme 的外部链接、// 开头的链接和
+    只有锚点的链接（#heading）。content 为 bytes 或 mmap 时生成 bytes。
+    """
+    if isinstance(content, str):
+        link_re, skip_prefixes, scheme_re = MD_LINK_RE, ("#", "//"), URL_SCHEME_RE
+    else:
+        link_re, skip_prefixes, scheme_re = MD_LINK_BRE, (b"#", b"//"), URL_SCHEME_BRE
+    for match in link_re.finditer(content):
+        url = match.group("url") or match.group("angle_url")
+        if url.startswith(skip_prefixes) or scheme_re.match(url):
+            continue
+        yield url
+
+
+def detect_source_name(url: str, sources: dict[str, str]) -> str | None:
+    matched_name = None
+    matched_prefix_len = -1
+    for name, prefix in sources.items():
+        if prefix_match(url, prefix) and len(prefix) > matched_prefix_len:
+            matched_name = name
+            matched_prefix_len = len(prefix)
+    return matched_name
+
+
+class SourceMatcher:
+    """
+    根据 load_sources 的结果预先编译的最长前缀匹配器，结果与 detect_source_name 相同。
+
+    前缀按长度分组，匹配时从最长的长度开始，对 url 的对应前缀做一次哈希查找，并检查 prefix_match 的 / ? # 边界规则。
+    每个 URL 的开销只与不同前缀长度的数量有关，而与来源数量无关。
+    """
+
+    def __init__(self, sources: dict[str, str]):
+        self.sources = sources
+        self._names_by_prefix: dict[str, str] = {}
+        for name, prefix in sources.items():
+            # 多个来源使用相同前缀时，与 detect_source_name 一样取第一个
+            self._names_by_prefix.setdefault(prefix, name)
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._names_by_prefix}, reverse=True)
+
+    def match(self, url: str) -> str | None:
+        url_len = len(url)
+        for prefix_len in self._prefix_lengths:
+            if prefix_len > url_len:
+                continue
+            if prefix_len < url_len and url[prefix_len] not in "/?#":
+                continue
+            name = self._names_by_prefix.get(url[:prefix_len])
+            if name is not None:
+                return name
+        return None
+
+
+_NETLOC_RE = re.compile(r"[^/?#]*")
+
+
+def _parse_source_kind(url: str) -> str:
+    parsed = urlparse(url)
+    if parsed.scheme and parsed.netloc:
+        return f"{parsed.scheme}://{parsed.netloc}"
+    return "(relative-or-invalid-url)"
+
+
+_cached_source_kind = lru_cache(maxsize=4096)(_parse_source_kind)
+
+
+def unknown_source_kind(url: str) -> str:
+    """
+    返回未知来源 URL 的 scheme://netloc。只有 url 中 netloc 及之前的部分会影响结果，
+    因此以这一部分为键缓存 urlparse 的结果，同一主机的 URL 只解析一次。
+    """
+    if "\t" in url or "\r" in url or "\n" in url:
+        # urlparse 会先删除这些字符，无法只根据原始字符串截取 netloc
+        return _parse_source_kind(url)
+    sep = url.find("//")
+    if sep < 0:
+        return "(relative-or-invalid-url)"
+    head = url[: _NETLOC_RE.match(url, sep + 2).end()]
+    return _cached_source_kind(head)
+
+
+def count_mixed_words(content: str | bytes) -> int:
+    """Count words for mixed Chinese/English text.
+    - English/alnum chunks count as 1 word each.
+    - Each CJK ideograph counts as 1 word.
+    content may also be UTF-8 bytes or an mmap; matches are then counted one by one to keep memory constant.
+    """
+    if isinstance(content, str):
+        en_count = len(EN_WORD_RE.findall(content))
+        cjk_count = len(CJK_CHAR_RE.findall(content))
+    else:
+        en_count = sum(1 for _ in EN_WORD_BRE.finditer(content))
+        cjk_count = sum(1 for _ in CJK_CHAR_BRE.finditer(content))
+    return en_count + cjk_count
@@ -0,0 +1,398 @@
+from array import array
+from collections import Counter
+from itertools import chain
+from pathlib import Path
+from .common import acquire_lock, map_files, parkive_state_dir
+from .index import RACY_WINDOW_NS
+from .scan import CJK_CHAR_RE, EN_WORD_RE
+from .stats import stats
+
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import time
+import struct
+import logging
+
+
+log = logging.getLogger(__name__)
+
+SEARCH_VERSION = 1
+MANIFEST_FILENAME = "manifest.json"
+LOCK_FILENAME = "search.lock"
+SEGMENT_MAGIC = b"PKSI"
+# 段文件头：魔数、版本、词项数；之后是 (词项数 + 1) 个 (词项偏移, 倒排偏移, 文档频率) 三元组，最后一个是哨兵
+SEGMENT_HEADER = struct.Struct("<4sII")
+TABLE_WIDTH = 3
+# 段数超过该值时，合并第一个（最大的）段之后的所有段
+MAX_SEGMENTS = 8
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+CJK_RUN_RE = re.compile(f"(?:{CJK_CHAR_RE.pattern})+")
+
+
+def count_terms(text: str) -> Counter:
+    """
+    把文本切分为索引词项并计数：英文和数字按 EN_WORD_RE 切分并转为小写；连续的 CJK 字符切分为相邻两字的二元组，
+    每段 CJK 文本的最后一个字额外作为单字词项。这样任意一个汉字都会出现在某个词项的开头，单字查询可以按前缀查找。
+    """
+    counts = Counter(EN_WORD_RE.findall(text.lower()))
+    runs = CJK_RUN_RE.findall(text)
+    # 相邻两字拼接和计数都在 C 代码中完成，比逐个切片快得多
+    counts.update(chain.from_iterable(map(str.__add__, run, run[1:]) for run in runs))
+    counts.update(run[-1] for run in runs)
+    return counts
+
+
+def query_terms(query: str) -> list[tuple[str, bool]]:
+    """
+    把查询切分为 [(词项, 是否前缀匹配)]。多字的 CJK 片段只使用二元组（不含结尾的单字词项），
+    单个汉字按前缀匹配所有以它开头的词项。
+    """
+    terms = [(word, False) for word in EN_WORD_RE.findall(query.lower())]
+    for match in CJK_RUN_RE.finditer(query):
+        run = match.group()
+        if len(run) == 1:
+            terms.append((run, True))
+        else:
+            terms.extend((run[i : i + 2], False) for i in range(len(run) - 1))
+    return list(dict.fromkeys(terms))
+
+
+def index_file(file_path: Path) -> dict:
+    """读取并切分单个文件，返回 {"terms": {词项: 出现次数}, "length": 词项总数}。"""
+    try:
+        text = file_path.read_text(encoding="utf-8")
+    except (OSError, UnicodeDecodeError) as e:
+        return {"terms": {}, "length": 0, "error": str(e)}
+    terms = count_terms(text)
+    return {"terms": dict(terms), "length": terms.total()}
+
+
+def _append_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_postings(buf, df: int) -> list[tuple[int, int]]:
+    """解码 df 个 (文档 id 差值, 词频) varint 对，返回 [(文档 id, 词频)]。"""
+    postings = []
+    pos = doc = 0
+    for _ in range(df):
+        value = shift = 0
+        while True:
+            byte = buf[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        doc += value
+        tf = shift = 0
+        while True:
+            byte = buf[pos]
+            pos += 1
+            tf |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        postings.append((doc, tf))
+    return postings
+
+
+def write_segment(path: Path, postings: dict[str, list[tuple[int, int]]]) -> None:
+    """
+    写出一个段文件。词项按 UTF-8 字节序排列（与 str 的码位顺序相同），便于在 mmap 上二分查找；
+    每个词项的倒排表是按文档 id 递增的 (id 差值, 词频) varint 序列。
+    """
+    terms = sorted(postings)
+    table = array("I")
+    term_blob = bytearray()
+    post_blob = bytearray()
+    for term in terms:
+        entries = postings[term]
+        table.extend((len(term_blob), len(post_blob), len(entries)))
+        term_blob += term.encode("utf-8")
+        prev = 0
+        for doc, tf in entries:
+            _append_varint(post_blob, doc - prev)
+            _append_varint(post_blob, tf)
+            prev = doc
+    table.extend((len(term_blob), len(post_blob), 0))
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as f:
+        f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEARCH_VERSION, len(terms)))
+        f.write(table.tobytes())
+        f.write(term_blob)
+        f.write(post_blob)
+    os.replace(tmp_path, path)
+
+
+class Segment:
+    """只读的段文件，通过 mmap 访问，查询时只读取用到的词项表条目和倒排表。"""
+
+    def __init__(self, path: Path):
+        with path.open("rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = SEGMENT_HEADER.unpack_from(self.mm, 0)
+        if magic != SEGMENT_MAGIC or version != SEARCH_VERSION:
+            raise ValueError(f"invalid search segment {path}")
+        table_end = SEGMENT_HEADER.size + (self.count + 1) * TABLE_WIDTH * 4
+        self._view = memoryview(self.mm)
+        self.table = self._view[SEGMENT_HEADER.size : table_end].cast("I")
+        self.term_base = table_end
+        self.post_base = table_end + self.table[self.count * TABLE_WIDTH]
+
+    def close(self) -> None:
+        self.table.release()
+        self._view.release()
+        self.mm.close()
+
+    def term(self, i: int) -> bytes:
+        start = self.table[i * TABLE_WIDTH]
+        end = self.table[(i + 1) * TABLE_WIDTH]
+        return self.mm[self.term_base + start : self.term_base + end]
+
+    def lower_bound(self, key: bytes) -> int:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, term: str, prefix: bool = False) -> range:
+        """返回词项 term（prefix 为 True 时为所有以 term 开头的词项）在词项表中的下标范围。"""
+        key = term.encode("utf-8")
+        lo = self.lower_bound(key)
+        if not prefix:
+            return range(lo, lo + 1) if lo < self.count and self.term(lo) == key else range(0)
+        hi = lo
+        while hi < self.count and self.term(hi).startswith(key):
+            hi += 1
+        return range(lo, hi)
+
+    def postings(self, i: int) -> list[tuple[int, int]]:
+        start = self.table[i * TABLE_WIDTH + 1]
+        end = self.table[(i + 1) * TABLE_WIDTH + 1]
+        stats.count("postings bytes read", end - start)
+        return _decode_postings(self.mm[self.post_base + start : self.post_base + end], self.table[i * TABLE_WIDTH + 2])
+
+    def items(self):
+        """按词项顺序生成 (词项, 倒排表)，用于合并段。"""
+        for i in range(self.count):
+            yield self.term(i).decode("utf-8"), self.postings(i)
+
+
+class SearchIndex:
+    """
+    保存在 .parkive/cache/search 下的倒排索引：
+
+     - manifest.json：每个已索引文件的 [文档 id, mtime_ns, size, 词项数]，以及各段覆盖的文档 id 区间
+     - seg-N.bin：段文件，见 write_segment
+
+    文档 id 单调递增，文件被修改后会获得新的 id，旧 id 不再出现在 manifest 中即视为删除。
+    每次更新只为新增和修改过的文件写一个新段，段数过多或删除的文档过多时再合并，已有的段文件从不修改。
+    """
+
+    def __init__(self, parkive_root: Path, rebuild: bool = False):
+        self.parkive_root = parkive_root
+        self.dir = parkive_root / ".parkive" / "cache" / "search"
+        self.rebuild = rebuild
+        self.manifest = self._load()
+        if rebuild:
+            # 保留 next_doc，新段不会与仍在被其他进程读取的旧段同名
+            self.manifest = {**self._empty_manifest(), "next_doc": self.manifest["next_doc"]}
+        self._segments: dict[str, Segment] = {}
+
+    @staticmethod
+    def _empty_manifest() -> dict:
+        return {"version": SEARCH_VERSION, "byteorder": sys.byteorder, "next_doc": 0, "docs": {}, "segments": []}
+
+    def _load(self) -> dict:
+        path = self.dir / MANIFEST_FILENAME
+        if not path.is_file():
+            return self._empty_manifest()
+        try:
+            manifest = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            log.debug(f"Ignoring unreadable search manifest {path}: {e}")
+            return self._empty_manifest()
+        # 段文件按本机字节序写入词项表
+        if manifest.get("version") != SEARCH_VERSION or manifest.get("byteorder") != sys.byteorder:
+            return self._empty_manifest()
+        return manifest
+
+    def _save(self) -> None:
+        path = self.dir / MANIFEST_FILENAME
+        tmp_path = path.with_name(MANIFEST_FILENAME + ".tmp")
+        tmp_path.write_text(json.dumps(self.manifest, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp_path, path)
+        # 删除不再被引用的段文件；正在被其他进程映射的文件在关闭前仍然可读
+        names = {segment["name"] for segment in self.manifest["segments"]}
+        for seg_path in self.dir.glob("seg-*.bin"):
+            if seg_path.name not in names:
+                seg_path.unlink(missing_ok=True)
+
+    def segment(self, name: str) -> Segment:
+        segment = self._segments.get(name)
+        if segment is None:
+            segment = self._segments[name] = Segment(self.dir / name)
+        return segment
+
+    def close(self) -> None:
+        for segment in self._segments.values():
+            segment.close()
+        self._segments.clear()
+
+    def update(self, files, jobs: int | None = None) -> tuple[int, int]:
+        """
+        使索引与 files（完整的受管文件列表）一致，返回 (重新索引的文件数, 删除的文件数)。
+        mtime 距今不足 RACY_WINDOW_NS 的文件仍会被索引，但不记录 mtime，下次更新时会重新索引。
+        """
+        parkive_state_dir(self.parkive_root, "cache")
+        self.dir.mkdir(exist_ok=True)
+        lock = acquire_lock(self.dir / LOCK_FILENAME)
+        try:
+            if not self.rebuild:
+                # 等待锁期间其他进程可能已经更新了索引
+                self.manifest = self._load()
+            self.rebuild = False
+            docs: dict[str, list] = self.manifest["docs"]
+            seen: set[str] = set()
+            changed: list[tuple[Path, str, os.stat_result]] = []
+            with stats.phase("walk"):
+                for file_path in files:
+                    key = file_path.relative_to(self.parkive_root).as_posix()
+                    seen.add(key)
+                    st = file_path.stat()
+                    entry = docs.get(key)
+                    if entry is None or entry[1] != st.st_mtime_ns or entry[2] != st.st_size:
+                        changed.append((file_path, key, st))
+            removed = [key for key in docs if key not in seen]
+            for key in removed:
+                del docs[key]
+            stats.count("search index hits", len(seen) - len(changed))
+            stats.count("search index misses", len(changed))
+            if not changed and not removed:
+                return 0, 0
+
+            with stats.phase("tokenize"):
+                parsed = dict(map_files(index_file, [file_path for file_path, _, _ in changed], jobs))
+            postings: dict[str, list[tuple[int, int]]] = {}
+            first = next_doc = self.manifest["next_doc"]
+            now = time.time_ns()
+            for file_path, key, st in changed:
+                result = parsed[file_path]
+                if "error" in result:
+                    log.debug(f"Not indexing {file_path}: {result['error']}")
+                    docs.pop(key, None)
+                    continue
+                doc = next_doc
+                next_doc += 1
+                for term, tf in result["terms"].items():
+                    postings.setdefault(term, []).append((doc, tf))
+                mtime_ns = st.st_mtime_ns if now - st.st_mtime_ns > RACY_WINDOW_NS else None
+                docs[key] = [doc, mtime_ns, st.st_size, result["length"]]
+
+            with stats.phase("write segments"):
+                if postings:
+                    name = f"seg-{first}.bin"
+                    write_segment(self.dir / name, postings)
+                    self.manifest["segments"].append({"name": name, "first": first, "last": next_doc - 1})
+                self.manifest["next_doc"] = next_doc
+                self._compact()
+            self._save()
+            return len(changed), len(removed)
+        finally:
+            lock.close()
+
+    def _compact(self) -> None:
+        segments = self.manifest["segments"]
+        live = {entry[0] for entry in self.manifest["docs"].values()}
+        # 第一个段中的文档有一半以上已被删除或修改时合并全部段，否则只在段数过多时合并后面的小段
+        base = segments[0] if segments else None
+        base_live = sum(1 for doc in live if base is not None and base["first"] <= doc <= base["last"])
+        if base is not None and base_live * 2 < base["last"] - base["first"] + 1:
+            self._merge(segments, live)
+        elif len(segments) > MAX_SEGMENTS:
+            self._merge(segments[1:], live)
+
+    def _merge(self, group: list[dict], live: set[int]) -> None:
+        """把 group 中相邻的段合并为一个，丢弃已删除文档的倒排。"""
+        stats.count("search segments merged", len(group))
+        postings: dict[str, list[tuple[int, int]]] = {}
+        for info in group:
+            for term, entries in self.segment(info["name"]).items():
+                entries = [entry for entry in entries if entry[0] in live]
+                if entries:
+                    postings.setdefault(term, []).extend(entries)
+        segments = self.manifest["segments"]
+        start = segments.index(group[0])
+        merged = {"name": f"seg-{group[0]['first']}-{group[-1]['last']}.bin", "first": group[0]["first"], "last": group[-1]["last"]}
+        write_segment(self.dir / merged["name"], postings)
+        segments[start : start + len(group)] = [merged]
+        self.close()
+
+    def search(self, query: str, match_any: bool = False) -> list[tuple[str, float]]:
+        """按 BM25 得分从高到低返回 [(相对路径, 得分)]；默认要求文档包含查询中的所有词项。"""
+        terms = query_terms(query)
+        docs = self.manifest["docs"]
+        if not terms or not docs:
+            return []
+        doc_info = {entry[0]: (key, entry[3]) for key, entry in docs.items()}
+        total_docs = len(doc_info)
+        avg_length = sum(length for _, length in doc_info.values()) / total_docs or 1.0
+
+        scores: dict[int, float] = {}
+        matched: dict[int, int] = {}
+        with stats.phase("query"):
+            for term, prefix in terms:
+                term_postings: dict[int, int] = {}
+                for info in self.manifest["segments"]:
+                    segment = self.segment(info["name"])
+                    for i in segment.find(term, prefix):
+                        for doc, tf in segment.postings(i):
+                            if doc in doc_info:
+                                term_postings[doc] = term_postings.get(doc, 0) + tf
+                if not term_postings and not match_any:
+                    return []
+                df = len(term_postings)
+                idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+                for doc, tf in term_postings.items():
+                    length = doc_info[doc][1]
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length))
+                    matched[doc] = matched.get(doc, 0) + 1
+        results = [
+            (doc_info[doc][0], score)
+            for doc, score in scores.items()
+            if match_any or matched[doc] == len(terms)
+        ]
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results
+
+
+def find_snippet(text: str, query: str) -> tuple[int, str] | None:
+    """
+    返回 text 中第一行包含查询内容的 (行号, 行文本)。CJK 片段必须原样出现（二元组只能保证每两个相邻的字都出现过），
+    英文词不区分大小写；找不到任何 CJK 片段时返回 None，表示这是二元组造成的误匹配。
+    """
+    runs = CJK_RUN_RE.findall(query)
+    if any(run not in text for run in runs):
+        return None
+    words = EN_WORD_RE.findall(query.lower())
+    for lineno, line in enumerate(text.splitlines(), 1):
+        lowered = line.lower()
+        if any(run in line for run in runs) or any(word in lowered for word in words):
+            return lineno, line.strip()
+    return 0, ""
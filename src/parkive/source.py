@@ -3,12 +3,12 @@ from pathlib import Path
 from urllib.parse import urlparse
 from rich.console import Console
 from . import config
-from .common import iter_files_to_process
+from .output import OutputFormat, RecordWriter
+from .stats import stats
 
-import re
+import time
 import typer
 import tomllib
-import tomli_w
 import logging
 
 
@@ -17,30 +17,13 @@ log = logging.getLogger(__name__)
 source_app = typer.Typer(no_args_is_help=True)
 
 
-MD_IMAGE_RE = re.compile(
-    r"!\[(?P<alt>[^\]]*)\]\((?P<url>[^)\s]+)(?P<tail>\s+\"[^\"]*\")?\)"
-)
-HTML_IMAGE_RE = re.compile(
-    r"(?P<prefix><img\b[^>]*\bsrc\s*=\s*[\"'])(?P<url>[^\"']+)(?P<suffix>[\"'])",
-    flags=re.IGNORECASE,
-)
-
-
 def load_sources(parkive_root: Path) -> dict:
     config_path = parkive_root / ".parkive" / "sources.toml"
-    if not config_path.is_file():
-        return {}
     try:
-        with config_path.open("rb") as f:
-            loaded = tomllib.load(f)
-            sources = loaded.get("sources", {})
-            if not isinstance(sources, dict):
-                console.print(
-                    f"Invalid format in {config_path}: 'sources' should be a table.",
-                    style="red bold",
-                )
-                return {}
-            return {k: v for k, v in sources.items() if isinstance(v, str)}
+        return config.read_sources(parkive_root)
+    except ValueError as e:
+        console.print(str(e), style="red bold")
+        return {}
     except Exception as e:
         console.print(
             f"Failed to load sources from {config_path}: {e}",
@@ -51,7 +34,9 @@ def load_sources(parkive_root: Path) -> dict:
 
 @source_app.callback()
 def bootstrap(ctx: typer.Context):
-    ctx.obj["sources"] = load_sources(Path(ctx.obj["parkive_root"]))
+    # --all-vaults 时没有当前知识库，每个知识库在处理时读取各自的来源
+    parkive_root = ctx.obj["parkive_root"]
+    ctx.obj["sources"] = {} if parkive_root is None else load_sources(Path(parkive_root))
     log.debug(f"Sources loaded: {ctx.obj['sources']}")
     
 
@@ -69,92 +54,14 @@ def save_sources(parkive_root: Path, sources: dict) -> None:
     """
     将 sources 字典保存到 parkive_root/.parkive/sources.toml 文件中。
     """
+    import tomli_w
+
     path = parkive_root / ".parkive" / "sources.toml"
     path.parent.mkdir(parents=True, exist_ok=True)
     with path.open("wb") as f:
         tomli_w.dump({"sources": sources}, f)
 
 
-def prefix_match(url: str, prefix: str) -> bool:
-    """检查 url 是否以 prefix 开头，并且后面要么结束，要么是 / ? # 之一。"""
-    if not url.startswith(prefix):
-        return False
-    if len(url) == len(prefix):
-        return True
-    return url[len(prefix)] in ["/", "?", "#"]
-
-
-def convert_url_prefix(url: str, source_prefix: str, target_prefix: str) -> str:
-    if not prefix_match(url, source_prefix):
-        return url
-    return target_prefix + url[len(source_prefix) :]
-
-
-def replace_images_in_text(content: str, source_prefix: str, target_prefix: str) -> tuple[str, int]:
-    replaced_count = 0
-
-    def md_repl(match: re.Match) -> str:
-        nonlocal replaced_count
-        original_url = match.group("url")
-        converted_url = convert_url_prefix(original_url, source_prefix, target_prefix)
-        if converted_url == original_url:
-            return match.group(0)
-        replaced_count += 1
-        log.debug(f"Replacing URL in markdown: {original_url} => {converted_url}")
-        tail = match.group("tail") or ""
-        return f"![{match.group('alt')}]({converted_url}{tail})"
-
-    content = MD_IMAGE_RE.sub(md_repl, content)
-
-    def html_repl(match: re.Match) -> str:
-        nonlocal replaced_count
-        original_url = match.group("url")
-        converted_url = convert_url_prefix(original_url, source_prefix, target_prefix)
-        if converted_url == original_url:
-            return match.group(0)
-        replaced_count += 1
-        log.debug(f"Replacing URL in HTML: {original_url} => {converted_url}")
-        return f"{match.group('prefix')}{converted_url}{match.group('suffix')}"
-
-    content = HTML_IMAGE_RE.sub(html_repl, content)
-    return content, replaced_count
-
-
-def count_source_urls(content: str, base_url: str) -> int:
-    count = 0
-    for match in MD_IMAGE_RE.finditer(content):
-        if prefix_match(match.group("url"), base_url):
-            count += 1
-    for match in HTML_IMAGE_RE.finditer(content):
-        if prefix_match(match.group("url"), base_url):
-            count += 1
-    return count
-
-
-def iter_image_urls(content: str):
-    for match in MD_IMAGE_RE.finditer(content):
-        yield match.group("url")
-    for match in HTML_IMAGE_RE.finditer(content):
-        yield match.group("url")
-
-
-def detect_source_name(url: str, sources: dict[str, str]) -> str | None:
-    matched_name = None
-    matched_prefix_len = -1
-    for name, prefix in sources.items():
-        if prefix_match(url, prefix) and len(prefix) > matched_prefix_len:
-            matched_name = name
-            matched_prefix_len = len(prefix)
-    return matched_name
-
-
-def unknown_source_kind(url: str) -> str:
-    parsed = urlparse(url)
-    if parsed.scheme and parsed.netloc:
-        return f"{parsed.scheme}://{parsed.netloc}"
-    return "(relative-or-invalid-url)"
-
-
 def require_source(sources: dict, name: str) -> str:
     if name not in sources:
         console.print(f"source '{name}' not found.", style=config.error_style)
@@ -202,69 +109,235 @@ def source_remove(name: Annotated[str, typer.Argument(help="Name of the source t
     console.print(f"removed source '{name}' ({removed_url})", style=config.success_style)
 
 
+def _report_conflicts(conflicts: list[dict]) -> None:
+    for entry in conflicts:
+        console.print(f"skipped {entry['path']}: file was modified after the change was planned.", style=config.warning_style)
+
+
+def parse_mappings(pairs: list[str], mapping_file: Path | None) -> list[tuple[str, str]]:
+    """
+    解析 source change 的来源映射，返回 [(源来源名, 目标来源名)]，由 Vault.resolve_mappings 检查来源是否存在。
+    pairs 可以是传统的两个参数 SRC TGT，也可以是若干个 SRC:TGT；mapping_file 为 TOML 文件，其中 [mappings] 表的每一项为 SRC = "TGT"。
+    """
+    if len(pairs) == 2 and not any(":" in pair for pair in pairs):
+        raw = [(pairs[0], pairs[1])]
+    else:
+        raw = []
+        for pair in pairs:
+            src, sep, tgt = pair.partition(":")
+            if not sep or not src or not tgt:
+                console.print(f"Invalid mapping '{pair}': expected SRC:TGT.", style=config.error_style)
+                raise typer.Exit(code=1)
+            raw.append((src, tgt))
+
+    if mapping_file is not None:
+        try:
+            with mapping_file.open("rb") as f:
+                loaded = tomllib.load(f).get("mappings", {})
+        except Exception as e:
+            console.print(f"Failed to load mappings from {mapping_file}: {e}", style=config.error_style)
+            raise typer.Exit(code=1)
+        if not isinstance(loaded, dict) or not all(isinstance(v, str) for v in loaded.values()):
+            console.print(f"Invalid format in {mapping_file}: 'mappings' should be a table of strings.", style=config.error_style)
+            raise typer.Exit(code=1)
+        raw.extend(loaded.items())
+
+    if not raw:
+        console.print("No source mapping given.", style=config.error_style)
+        raise typer.Exit(code=1)
+    return raw
+
+
+def _print_change_summary(mappings: list[dict], entries: list[dict], dry_run: bool = False) -> None:
+    """按映射分别打印替换的 URL 数量和文件数量，多组映射时再打印总数。"""
+    for mapping in mappings:
+        counts = [e["counts"].get(mapping["source_prefix"], 0) for e in entries]
+        urls = sum(counts)
+        files = sum(1 for c in counts if c > 0)
+        if dry_run:
+            message = f"would change source '{mapping['source']}' => '{mapping['target']}', replacing {urls} urls in {files} files."
+        else:
+            message = f"changed source '{mapping['source']}' => '{mapping['target']}', replaced {urls} urls in {files} files."
+        console.print(message, style=config.success_style)
+    if len(mappings) > 1:
+        verb = "would replace" if dry_run else "replaced"
+        console.print(f"total: {verb} {sum(e['count'] for e in entries)} urls in {len(entries)} files.", style=config.success_style)
+
+
 @source_app.command("change")
-def source_convert(src: Annotated[str, typer.Argument(help="Source name to change from")],
-                   tgt: Annotated[str, typer.Argument(help="Target source name to change to")],
-                   ctx: typer.Context,
+def source_convert(ctx: typer.Context,
+                   pairs: Annotated[list[str] | None, typer.Argument(help="Either 'SRC TGT', or one or more 'SRC:TGT' mappings applied together in a single pass.", show_default=False)] = None,
+                   mapping_file: Annotated[Path | None, typer.Option("--mapping-file", "-m", help="TOML file whose 'mappings' table maps source names to target names, e.g. old = \"new\".")] = None,
                    files: Annotated[list[str] | None, typer.Option("--file", "-f", help="Only convert the specified files instead of all managed files. It will override the scan_glob configuration. Can be specified multiple times.")] = None,
-                   glob: Annotated[list[str] | None, typer.Option("--glob", "-g", help="Override the scan_glob configuration with the specified glob patterns. Can be specified multiple times.")] = None):
-    """Change source prefix from src to tgt in all managed files."""
-    parkive_root = Path(ctx.obj["parkive_root"])
-    user_config = ctx.obj["user_config"]
-    source_prefix = require_source(ctx.obj["sources"], src)
-    target_prefix = require_source(ctx.obj["sources"], tgt)
+                   glob: Annotated[list[str] | None, typer.Option("--glob", "-g", help="Override the scan_glob configuration with the specified glob patterns. Can be specified multiple times.")] = None,
+                   jobs: Annotated[int | None, typer.Option("--jobs", "-j", help="Number of worker processes used to parse files. Defaults to the CPU count; small file sets are always processed serially.")] = None,
+                   changed: Annotated[bool, typer.Option("--changed", help="Only process files that git reports as modified or untracked in the working tree.")] = False,
+                   since: Annotated[str | None, typer.Option("--since", help="Only process files changed since the given git revision, plus uncommitted changes.")] = None,
+                   dry_run: Annotated[bool, typer.Option("--dry-run", help="Print the replacement plan (file and number of urls) without modifying any file.")] = False,
+                   all_vaults: Annotated[bool, typer.Option("--all-vaults", help="Apply the change to every vault registered with 'parkive vaults add' instead of the current one, several vaults at a time.")] = False,
+                   concurrency: Annotated[int | None, typer.Option("--concurrency", help="With --all-vaults, the maximum number of vaults processed at the same time.")] = None):
+    """
+    Change source prefix from src to tgt in all managed files.
+
+    Several mappings (a:x b:y ...) are applied in one pass over each file; when more than one source prefix matches a URL, the longest one wins.
 
-    changed_files = 0
-    replaced_urls = 0
+    A plan is built first and recorded in a journal under .parkive, then files are rewritten atomically (temporary file + rename). If the run is interrupted, use `parkive source resume` or `parkive source rollback`.
+    """
+    from .vault import Vault
+
+    if all_vaults:
+        if files is not None:
+            console.print("--file cannot be combined with --all-vaults.", style=config.error_style)
+            raise typer.Exit(code=1)
+        _change_all_vaults(parse_mappings(pairs or [], mapping_file), glob, jobs, changed, since, dry_run, concurrency)
+        return
 
+    vault = Vault(ctx.obj["parkive_root"], ctx.obj["user_config"], ctx.obj["sources"])
     if glob is not None:
         log.debug(f"Overriding scan_glob with: {glob}")
+    try:
+        result = vault.change(
+            parse_mappings(pairs or [], mapping_file),
+            files=vault.select(files, glob, changed, since),
+            jobs=jobs,
+            dry_run=dry_run,
+        )
+    except ValueError as e:
+        console.print(str(e), style=config.error_style)
+        raise typer.Exit(code=1)
+    for path, error in result["errors"]:
+        console.print(f"skipped {path}: {error}", style=config.warning_style)
+
+    if dry_run:
+        with stats.phase("output"):
+            for entry in result["entries"]:
+                console.print(f"{entry['path']}\t{entry['count']}", style=config.info_style)
+            _print_change_summary(result["mappings"], result["entries"], dry_run=True)
+        return
+
+    _report_conflicts(result["conflicts"])
+    _print_change_summary(result["mappings"], result["entries"])
+
 
-    for file_path in iter_files_to_process(
-        parkive_root=parkive_root,
-        scan_glob=user_config["scope"]["scan_glob"] if glob is None else glob,
-        skip_dirs=user_config["scope"]["skip_dirs"],
-        specified_files=files,
-    ):
-        original = file_path.read_text(encoding="utf-8")
-        converted, count = replace_images_in_text(original, source_prefix, target_prefix)
-        if count > 0:
-            file_path.write_text(converted, encoding="utf-8")
-            changed_files += 1
-            replaced_urls += count
-
-    console.print(
-        f"changed source '{src}' => '{tgt}', replaced {replaced_urls} urls in {changed_files} files.",
-        style=config.success_style,
-    )
+def _change_in_vault(root: Path, pairs: list[tuple[str, str]], glob: list[str] | None, jobs: int, changed: bool, since: str | None, dry_run: bool) -> dict:
+    from .vault import Vault
+
+    vault = Vault(root)
+    return vault.change(pairs, files=vault.select(None, glob, changed, since), jobs=jobs, dry_run=dry_run)
+
+
+def _change_all_vaults(pairs: list[tuple[str, str]], glob: list[str] | None, jobs: int | None, changed: bool, since: str | None, dry_run: bool,
+                       concurrency: int | None) -> None:
+    """
+    source change --all-vaults：每个知识库按各自 sources.toml 中的同名来源替换，来源不存在或有未完成的 source change 的知识库记为失败。
+    """
+    from .registry import finish_vaults, map_vaults, print_vault_header, registered_vaults, vault_jobs, vault_workers
+
+    vaults = registered_vaults()
+    workers = vault_workers(vaults, concurrency)
+    start = time.perf_counter()
+    outcomes: dict[str, dict] = {}
+    urls = changed_files = 0
+    for name, root, outcome in map_vaults(_change_in_vault, vaults, workers, pairs, glob, vault_jobs(jobs, workers), changed, since, dry_run):
+        outcomes[name] = outcome
+        with stats.phase("output"):
+            print_vault_header(name, root, outcome)
+            if "error" in outcome:
+                continue
+            result = outcome["result"]
+            for path, error in result["errors"]:
+                console.print(f"skipped {root / path}: {error}", style=config.warning_style)
+            if dry_run:
+                for entry in result["entries"]:
+                    console.print(f"{entry['path']}\t{entry['count']}", style=config.info_style)
+            else:
+                _report_conflicts(result["conflicts"])
+            _print_change_summary(result["mappings"], result["entries"], dry_run=dry_run)
+            urls += sum(entry["count"] for entry in result["entries"])
+            changed_files += len(result["entries"])
+
+    verb = "would replace" if dry_run else "replaced"
+    console.print(f"\nall vaults: {verb} {urls} urls in {changed_files} files.", style=config.success_style)
+    finish_vaults(outcomes, start)
+
+
+def _require_journal(parkive_root: Path):
+    from .journal import ChangeJournal
+
+    journal = ChangeJournal(parkive_root)
+    if not journal.exists():
+        console.print("No interrupted source change found.", style=config.warning_style)
+        raise typer.Exit(code=1)
+    return journal
+
+
+@source_app.command("resume")
+def source_resume(ctx: typer.Context,
+                  jobs: Annotated[int | None, typer.Option("--jobs", "-j", help="Number of worker processes used to parse files. Defaults to the CPU count; small file sets are always processed serially.")] = None):
+    """Resume an interrupted `source change` from its journal in .parkive, without rescanning the vault."""
+    journal = _require_journal(Path(ctx.obj["parkive_root"]))
+    plan = journal.load()
+    applied, conflicts = journal.apply(jobs)
+    _report_conflicts(conflicts)
+    journal.discard()
+    _print_change_summary(plan["mappings"], applied)
+
+
+@source_app.command("rollback")
+def source_rollback(ctx: typer.Context):
+    """Restore the files rewritten by an interrupted `source change` from the backups in its journal."""
+    journal = _require_journal(Path(ctx.obj["parkive_root"]))
+    plan = journal.load()
+    restored, conflicts = journal.rollback()
+    for entry in conflicts:
+        console.print(f"cannot restore {entry['path']}: file was modified after it was rewritten.", style=config.warning_style)
+    if conflicts:
+        console.print("The journal is kept so the remaining files can be checked.", style=config.warning_style)
+        raise typer.Exit(code=1)
+    journal.discard()
+
+    changes = ", ".join(f"'{m['source']}' => '{m['target']}'" for m in plan["mappings"])
+    console.print(f"rolled back source change {changes}, restored {restored} files.", style=config.success_style)
 
 
 @source_app.command("inspect")
 def source_inspect(name: Annotated[str, typer.Argument(help="Name of the source to inspect")], 
                    ctx: typer.Context,
-                   files: Annotated[list[str] | None, typer.Option("--file", "-f", help="Only inspect the specified files instead of all managed files. It will override the scan_glob configuration. Can be specified multiple times.")] = None):
+                   files: Annotated[list[str] | None, typer.Option("--file", "-f", help="Only inspect the specified files instead of all managed files. It will override the scan_glob configuration. Can be specified multiple times.")] = None,
+                   no_index: Annotated[bool, typer.Option("--no-index", help="Parse every file without reading or updating the scan index in .parkive.")] = False,
+                   rebuild_index: Annotated[bool, typer.Option("--rebuild-index", help="Discard the scan index in .parkive and rebuild it from scratch.")] = False,
+                   jobs: Annotated[int | None, typer.Option("--jobs", "-j", help="Number of worker processes used to parse files. Defaults to the CPU count; small file sets are always processed serially.")] = None,
+                   changed: Annotated[bool, typer.Option("--changed", help="Only process files that git reports as modified or untracked in the working tree.")] = False,
+                   since: Annotated[str | None, typer.Option("--since", help="Only process files changed since the given git revision, plus uncommitted changes.")] = None,
+                   output_format: Annotated[OutputFormat, typer.Option("--format", help="Output format. 'ndjson' and 'tsv' stream one unstyled record per file to stdout for use in scripts.")] = OutputFormat.table,
+                   quiet: Annotated[bool, typer.Option("--quiet", "-q", help="Only print the total, not one line per file.")] = False):
     """Inspect how many images are using the source with given name."""
-    user_config = ctx.obj["user_config"]
-    parkive_root = Path(ctx.obj["parkive_root"])
+    from .vault import Vault
+
     base_url = require_source(ctx.obj["sources"], name)
+    vault = Vault(ctx.obj["parkive_root"], ctx.obj["user_config"], ctx.obj["sources"], use_index=not no_index, rebuild_index=rebuild_index)
 
-    console.print(f"name: {name}", style=config.success_style)
-    console.print(f"base_url: {base_url}\n", style=config.success_style)
-
-    matched_cnt = 0
-    for file_path in iter_files_to_process(
-        parkive_root=parkive_root,
-        scan_glob=user_config["scope"]["scan_glob"],
-        skip_dirs=user_config["scope"]["skip_dirs"],
-        specified_files=files
-    ):
-        content = file_path.read_text(encoding="utf-8")
-        matched_cnt_this_file = count_source_urls(content, base_url)
-        matched_cnt += matched_cnt_this_file
-        console.print(f"{file_path.relative_to(parkive_root).as_posix()}\t{matched_cnt_this_file}", style=config.info_style)
+    if output_format is OutputFormat.table:
+        console.print(f"name: {name}", style=config.success_style)
+        console.print(f"base_url: {base_url}\n", style=config.success_style)
 
-    
-    console.print(f"\nTotal: {matched_cnt}", style=config.success_style)
+    out = RecordWriter(output_format, ["path", "count"], quiet=quiet)
+
+    def on_file(path: str, count: int) -> None:
+        with stats.phase("output"):
+            out.row({"path": path, "count": count})
+
+    def on_error(path: str, error: str) -> None:
+        with stats.phase("output"):
+            out.error(path, error)
+
+    # 逐文件的结果在扫描过程中输出，机器可读格式可以边扫描边交给下游
+    result = vault.inspect(name, files=vault.select(files, None, changed, since), jobs=jobs, on_file=on_file, on_error=on_error)
+    with stats.phase("output"):
+        out.close({"name": name, "base_url": base_url, "count": result["total"]})
+
+    if output_format is OutputFormat.table:
+        console.print(f"\nTotal: {result['total']}", style=config.success_style)
 
 
 @source_app.command("list")
@@ -284,37 +357,44 @@ def source_status(
     ctx: typer.Context,
     files: Annotated[list[str] | None, typer.Option("--file", "-f", help="Only inspect the specified files instead of all managed files. It will override the scan_glob configuration. Can be specified multiple times.")] = None,
     glob: Annotated[list[str] | None, typer.Option("--glob", "-g", help="Override the scan_glob configuration with the specified glob patterns. Can be specified multiple times.")] = None,
+    no_index: Annotated[bool, typer.Option("--no-index", help="Parse every file without reading or updating the scan index in .parkive.")] = False,
+    rebuild_index: Annotated[bool, typer.Option("--rebuild-index", help="Discard the scan index in .parkive and rebuild it from scratch.")] = False,
+    jobs: Annotated[int | None, typer.Option("--jobs", "-j", help="Number of worker processes used to parse files. Defaults to the CPU count; small file sets are always processed serially.")] = None,
+    changed: Annotated[bool, typer.Option("--changed", help="Only process files that git reports as modified or untracked in the working tree.")] = False,
+    since: Annotated[str | None, typer.Option("--since", help="Only process files changed since the given git revision, plus uncommitted changes.")] = None,
+    all_vaults: Annotated[bool, typer.Option("--all-vaults", help="Show the sources of every vault registered with 'parkive vaults add' and their totals, several vaults at a time.")] = False,
+    concurrency: Annotated[int | None, typer.Option("--concurrency", help="With --all-vaults, the maximum number of vaults processed at the same time.")] = None,
 ):
     """Show image URL source kinds and their counts in managed files."""
-    user_config = ctx.obj["user_config"]
-    parkive_root = Path(ctx.obj["parkive_root"])
-    sources: dict[str, str] = ctx.obj["sources"]
+    from .vault import Vault
 
-    known_counts = {name: 0 for name in sources}
-    unknown_counts: dict[str, int] = {}
-
-    for file_path in iter_files_to_process(
-        parkive_root=parkive_root,
-        scan_glob=user_config["scope"]["scan_glob"] if glob is None else glob,
-        skip_dirs=user_config["scope"]["skip_dirs"],
-        specified_files=files,
-    ):
-        content = file_path.read_text(encoding="utf-8")
-        for url in iter_image_urls(content):
-            source_name = detect_source_name(url, sources)
-            if source_name is not None:
-                known_counts[source_name] += 1
-            else:
-                kind = unknown_source_kind(url)
-                unknown_counts[kind] = unknown_counts.get(kind, 0) + 1
-                log.debug(f"Detected unknown source URL: {url} (kind: {kind}) in file {file_path}")
+    if all_vaults:
+        if files is not None:
+            console.print("--file cannot be combined with --all-vaults.", style=config.error_style)
+            raise typer.Exit(code=1)
+        _status_all_vaults(glob, no_index, rebuild_index, jobs, changed, since, concurrency)
+        return
+
+    vault = Vault(ctx.obj["parkive_root"], ctx.obj["user_config"], ctx.obj["sources"], use_index=not no_index, rebuild_index=rebuild_index)
+    def on_error(path: str, error: str) -> None:
+        console.print(f"skipped {vault.root / path}: {error}", style=config.warning_style)
 
+    result = vault.status(files=vault.select(files, glob, changed, since), jobs=jobs, on_error=on_error)
+    with stats.phase("output"):
+        _print_status(result["known"], result["unknown"], ctx.obj["sources"])
+
+
+def _print_status(known_counts: dict[str, int], unknown_counts: dict[str, int], sources: dict[str, str] | None = None) -> None:
+    """打印 source status 的结果；sources 为 None 时（多个知识库的汇总）不打印来源的 base_url。"""
     console.print("Known sources:", style=config.success_style)
     if not known_counts:
         console.print("(none)", style=config.warning_style)
     else:
         for name, count in sorted(known_counts.items(), key=lambda item: (-item[1], item[0])):
-            console.print(f"{name}\t{sources[name]}\t{count}", style=config.info_style)
+            if sources is None:
+                console.print(f"{name}\t{count}", style=config.info_style)
+            else:
+                console.print(f"{name}\t{sources[name]}\t{count}", style=config.info_style)
 
     console.print("\nUnknown sources:", style=config.warning_style)
     if not unknown_counts:
@@ -322,3 +402,221 @@ def source_status(
     else:
         for kind, count in sorted(unknown_counts.items(), key=lambda item: (-item[1], item[0])):
             console.print(f"{kind}\t{count}", style=config.info_style)
+
+
+def _status_in_vault(root: Path, glob: list[str] | None, use_index: bool, rebuild_index: bool, jobs: int, changed: bool, since: str | None) -> dict:
+    from .vault import Vault
+
+    vault = Vault(root, use_index=use_index, rebuild_index=rebuild_index)
+    return {**vault.status(files=vault.select(None, glob, changed, since), jobs=jobs), "sources": vault.sources}
+
+
+def _status_all_vaults(glob: list[str] | None, no_index: bool, rebuild_index: bool, jobs: int | None, changed: bool, since: str | None,
+                       concurrency: int | None) -> None:
+    """source status --all-vaults：逐个打印完成的知识库，最后按来源名和 URL 类型汇总所有知识库。"""
+    from .registry import finish_vaults, map_vaults, print_vault_header, registered_vaults, vault_jobs, vault_workers
+
+    vaults = registered_vaults()
+    workers = vault_workers(vaults, concurrency)
+    start = time.perf_counter()
+    outcomes: dict[str, dict] = {}
+    known_totals: dict[str, int] = {}
+    unknown_totals: dict[str, int] = {}
+    for name, root, outcome in map_vaults(_status_in_vault, vaults, workers, glob, not no_index, rebuild_index, vault_jobs(jobs, workers), changed, since):
+        outcomes[name] = outcome
+        with stats.phase("output"):
+            print_vault_header(name, root, outcome)
+            if "error" in outcome:
+                continue
+            result = outcome["result"]
+            for path, error in result["errors"]:
+                console.print(f"skipped {root / path}: {error}", style=config.warning_style)
+            _print_status(result["known"], result["unknown"], result["sources"])
+            for source_name, count in result["known"].items():
+                known_totals[source_name] = known_totals.get(source_name, 0) + count
+            for kind, count in result["unknown"].items():
+                unknown_totals[kind] = unknown_totals.get(kind, 0) + count
+
+    console.print("\nAll vaults:", style=config.success_style)
+    _print_status(known_totals, unknown_totals)
+    finish_vaults(outcomes, start)
+
+
+def collect_image_urls(parkive_root: Path, user_config: dict, files: list[str] | None, no_index: bool, jobs: int | None,
+                       predicate=None) -> tuple[dict[str, list[str]], int]:
+    """
+    收集受管文件中的 http(s) 图片 URL（predicate 不为 None 时只保留 predicate(url) 为真的 URL），
+    返回 ({URL: 引用它的文件}, 跳过的非 http 链接数)。URL 和文件都保持首次出现的顺序。
+    """
+    from .fetch import is_checkable
+    from .index import ScanIndex
+    from .common import iter_files_to_process
+
+    url_files: dict[str, list[str]] = {}
+    index = ScanIndex(parkive_root, enabled=not no_index)
+    full_scan = files is None
+    records = index.watched_records(user_config["scope"]["scan_glob"], user_config["scope"]["skip_dirs"]) if full_scan else None
+    if records is None:
+        records = index.scan(
+            iter_files_to_process(
+                parkive_root=parkive_root,
+                scan_glob=user_config["scope"]["scan_glob"],
+                skip_dirs=user_config["scope"]["skip_dirs"],
+                specified_files=files,
+            ),
+            prune=full_scan,
+            jobs=jobs,
+        )
+    skipped = 0
+    with stats.phase("collect"):
+        for file_path, record in records:
+            if "error" in record:
+                console.print(f"skipped {file_path}: {record['error']}", style=config.warning_style)
+                continue
+            display_path = file_path.relative_to(parkive_root).as_posix()
+            for url in record["urls"]:
+                if not is_checkable(url):
+                    skipped += 1
+                    continue
+                if predicate is not None and not predicate(url):
+                    continue
+                referrers = url_files.setdefault(url, [])
+                if not referrers or referrers[-1] != display_path:
+                    referrers.append(display_path)
+    index.save()
+    return url_files, skipped
+
+
+@source_app.command("check")
+def source_check(
+    ctx: typer.Context,
+    name: Annotated[str | None, typer.Argument(help="Only check images using the source with this name. Checks all http(s) image URLs if omitted.")] = None,
+    files: Annotated[list[str] | None, typer.Option("--file", "-f", help="Only check images in the specified files instead of all managed files. It will override the scan_glob configuration. Can be specified multiple times.")] = None,
+    timeout: Annotated[float, typer.Option("--timeout", help="Connect and read timeout in seconds for each request.")] = 10.0,
+    concurrency: Annotated[int, typer.Option("--concurrency", "-c", help="Maximum number of requests in flight.")] = 32,
+    per_host: Annotated[int, typer.Option("--per-host", help="Maximum number of concurrent requests to the same host.")] = 4,
+    ttl: Annotated[float, typer.Option("--ttl", help="Seconds for which a cached result in .parkive is reused instead of probing the URL again.")] = 86400.0,
+    refresh: Annotated[bool, typer.Option("--refresh", help="Ignore cached results and probe every URL again.")] = False,
+    no_index: Annotated[bool, typer.Option("--no-index", help="Parse every file without reading or updating the scan index in .parkive.")] = False,
+    jobs: Annotated[int | None, typer.Option("--jobs", "-j", help="Number of worker processes used to parse files. Defaults to the CPU count; small file sets are always processed serially.")] = None,
+):
+    """Check that image URLs in managed files are reachable and report broken links."""
+    from .fetch import LinkCache, check_urls
+    from .scan import SourceMatcher, unknown_source_kind
+
+    user_config = ctx.obj["user_config"]
+    parkive_root = Path(ctx.obj["parkive_root"])
+    sources: dict[str, str] = ctx.obj["sources"]
+    source_matcher = SourceMatcher(sources)
+    if name is not None:
+        require_source(sources, name)
+
+    predicate = None if name is None else (lambda url: source_matcher.match(url) == name)
+    url_files, skipped = collect_image_urls(parkive_root, user_config, files, no_index, jobs, predicate)
+
+    cache = LinkCache(parkive_root, ttl)
+    now = time.time()
+    results: dict[str, dict] = {}
+    to_probe = []
+    for url in url_files:
+        cached = None if refresh else cache.get(url, now)
+        if cached is None:
+            to_probe.append(url)
+        else:
+            results[url] = cached
+    stats.count("url cache hits", len(results))
+
+    if to_probe:
+        console.print(f"probing {len(to_probe)} urls ({len(results)} cached)...", style=config.info_style)
+        try:
+            for url, result in check_urls(to_probe, timeout=timeout, concurrency=concurrency, per_host=per_host).items():
+                results[url] = result
+                cache.put(url, result, now)
+        finally:
+            cache.save()
+
+    # 按来源、文件分组输出无法访问的链接
+    broken: dict[str, dict[str, list[str]]] = {}
+    for url, referrers in url_files.items():
+        result = results[url]
+        if result["ok"]:
+            continue
+        source_name = source_matcher.match(url)
+        group = f"{source_name} ({sources[source_name]})" if source_name is not None else unknown_source_kind(url)
+        reason = f"{result['status']} {result['error']}" if result["status"] is not None else result["error"]
+        for referrer in referrers:
+            broken.setdefault(group, {}).setdefault(referrer, []).append(f"{reason}\t{url}")
+
+    with stats.phase("output"):
+        for group, by_file in sorted(broken.items()):
+            console.print(f"{group}: {sum(len(v) for v in by_file.values())} broken", style=config.error_style, markup=False)
+            for referrer, lines in sorted(by_file.items()):
+                console.print(f"  {referrer}", style=config.warning_style, markup=False)
+                for line in lines:
+                    console.print(f"    {line}", style=config.info_style, markup=False)
+
+        broken_urls = sum(1 for url in url_files if not results[url]["ok"])
+        summary = f"checked {len(url_files)} urls ({len(to_probe)} probed, {len(url_files) - len(to_probe)} cached), {broken_urls} broken."
+        if skipped:
+            summary += f" {skipped} non-http image links were not checked."
+        console.print(("\n" if broken else "") + summary, style=config.error_style if broken_urls else config.success_style)
+    if broken_urls:
+        raise typer.Exit(code=1)
+
+
+@source_app.command("mirror")
+def source_mirror(
+    ctx: typer.Context,
+    name: Annotated[str, typer.Argument(help="Name of the source whose images are downloaded")],
+    dest_dir: Annotated[Path, typer.Argument(help="Directory to download the images into, keeping the URL paths below the source's base URL")],
+    files: Annotated[list[str] | None, typer.Option("--file", "-f", help="Only mirror images referenced by the specified files instead of all managed files. It will override the scan_glob configuration. Can be specified multiple times.")] = None,
+    timeout: Annotated[float, typer.Option("--timeout", help="Connect and read timeout in seconds for each request.")] = 30.0,
+    concurrency: Annotated[int, typer.Option("--concurrency", "-c", help="Maximum number of concurrent downloads.")] = 8,
+    no_index: Annotated[bool, typer.Option("--no-index", help="Parse every file without reading or updating the scan index in .parkive.")] = False,
+    jobs: Annotated[int | None, typer.Option("--jobs", "-j", help="Number of worker processes used to parse files. Defaults to the CPU count; small file sets are always processed serially.")] = None,
+):
+    """Download every image referenced under a source's base URL into a local directory."""
+    from .mirror import MANIFEST_FILENAME, mirror_urls
+    from .scan import SourceMatcher
+
+    user_config = ctx.obj["user_config"]
+    parkive_root = Path(ctx.obj["parkive_root"])
+    source_matcher = SourceMatcher(ctx.obj["sources"])
+    base_url = require_source(ctx.obj["sources"], name)
+
+    url_files, _ = collect_image_urls(parkive_root, user_config, files, no_index, jobs, lambda url: source_matcher.match(url) == name)
+    if not url_files:
+        console.print(f"no images are using source '{name}'.", style=config.warning_style, markup=False)
+        return
+
+    try:
+        summary = mirror_urls(list(url_files), base_url, dest_dir, timeout=timeout, concurrency=concurrency)
+    except (OSError, ValueError) as e:
+        console.print(f"Failed to mirror into {dest_dir}: {e}", style=config.error_style, markup=False)
+        raise typer.Exit(code=1)
+
+    with stats.phase("output"):
+        for url in summary["invalid"]:
+            console.print(f"skipped {url}: cannot map the url to a file path", style=config.warning_style, markup=False)
+        for url, owner in summary["conflicts"]:
+            console.print(f"skipped {url}: maps to the same file as {owner}", style=config.warning_style, markup=False)
+        for url, result in summary["failed"]:
+            reason = f"{result['status']} {result['error']}" if result["status"] is not None else result["error"]
+            console.print(f"failed {url}: {reason} (in {', '.join(url_files[url])})", style=config.error_style, markup=False)
+
+        console.print(
+            f"mirrored source '{name}' into {dest_dir}: {summary['downloaded']} downloaded ({summary['bytes']} bytes, "
+            f"{summary['deduplicated']} hardlinked as duplicates), {summary['skipped']} already mirrored, {len(summary['failed'])} failed.",
+            style=config.error_style if summary["failed"] else config.success_style,
+            markup=False,
+        )
+        if summary["failed"]:
+            console.print("run the command again to retry the failed downloads.", style=config.info_style)
+        else:
+            console.print(
+                f"serve {dest_dir} (except {MANIFEST_FILENAME}) from the new host, then switch the urls with 'parkive source change {name} <target>'.",
+                style=config.info_style,
+                markup=False,
+            )
+    if summary["failed"]:
+        raise typer.Exit(code=1)
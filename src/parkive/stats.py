@@ -0,0 +1,143 @@
+from contextlib import contextmanager
+from rich.console import Console
+
+import sys
+import json
+import time
+import heapq
+
+
+class RunStats:
+    """
+    一次命令运行的性能统计：各阶段的墙钟/CPU 时间、计数器以及耗时最长的 N 个文件。
+
+    阶段可以嵌套，每个阶段只记录自身的时间（进入子阶段时暂停计时），因此各阶段之和不超过总耗时，
+    未归入任何阶段的时间在报告中显示为 "other"。未启用时所有记录方法都直接返回，开销可以忽略。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, enabled: bool = False, top: int = 10) -> None:
+        self.enabled = enabled
+        self.top = top
+        self.phases: dict[str, list[float]] = {}
+        self.counters: dict[str, int] = {}
+        self.files: list[tuple[float, float, str]] = []
+        self.files_cpu = 0.0
+        self._stack: list[list] = []
+        self._start = (time.perf_counter(), time.process_time())
+
+    def _charge(self, frame: list, wall: float, cpu: float) -> None:
+        totals = self.phases.setdefault(frame[0], [0.0, 0.0, 0])
+        totals[0] += wall - frame[1]
+        totals[1] += cpu - frame[2]
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        if self._stack:
+            self._charge(self._stack[-1], wall, cpu)
+        frame = [name, wall, cpu]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter(), time.process_time()
+            self._charge(frame, wall, cpu)
+            self.phases[name][2] += 1
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][1:] = [wall, cpu]
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_file(self, path, wall: float, cpu: float) -> None:
+        """记录单个文件的处理耗时，只保留最慢的 top 个。"""
+        if not self.enabled:
+            return
+        self.files_cpu += cpu
+        item = (wall, cpu, str(path))
+        if len(self.files) < self.top:
+            heapq.heappush(self.files, item)
+        elif self.top > 0:
+            heapq.heappushpop(self.files, item)
+
+    def to_dict(self) -> dict:
+        wall = time.perf_counter() - self._start[0]
+        cpu = time.process_time() - self._start[1]
+        return {
+            "command": sys.argv[1:],
+            "total": {"wall_s": wall, "cpu_s": cpu, "files_cpu_s": self.files_cpu},
+            "phases": {
+                name: {"wall_s": w, "cpu_s": c, "calls": n}
+                for name, (w, c, n) in sorted(self.phases.items(), key=lambda item: -item[1][0])
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "slowest_files": [
+                {"path": path, "wall_s": w, "cpu_s": c} for w, c, path in sorted(self.files, reverse=True)
+            ],
+        }
+
+    def print_summary(self, console: Console) -> None:
+        from rich.table import Table
+
+        data = self.to_dict()
+        total = data["total"]
+
+        phases = Table(title="Phases", title_justify="left")
+        phases.add_column("phase")
+        phases.add_column("wall", justify="right")
+        phases.add_column("cpu", justify="right")
+        phases.add_column("calls", justify="right")
+        phases.add_column("%", justify="right")
+        accounted = 0.0
+        for name, phase in data["phases"].items():
+            accounted += phase["wall_s"]
+            phases.add_row(name, _ms(phase["wall_s"]), _ms(phase["cpu_s"]), str(phase["calls"]), _percent(phase["wall_s"], total["wall_s"]))
+        other = max(0.0, total["wall_s"] - accounted)
+        phases.add_row("other", _ms(other), "", "", _percent(other, total["wall_s"]), style="dim")
+        phases.add_row("total", _ms(total["wall_s"]), _ms(total["cpu_s"]), "", "", style="bold")
+        console.print(phases)
+
+        if data["counters"]:
+            counters = Table(title="Counters", title_justify="left")
+            counters.add_column("counter")
+            counters.add_column("value", justify="right")
+            for name, value in data["counters"].items():
+                counters.add_row(name, f"{value:,}")
+            console.print(counters)
+
+        if data["slowest_files"]:
+            files = Table(title=f"Slowest files (per-file cpu total {_ms(total['files_cpu_s'])})", title_justify="left")
+            files.add_column("file")
+            files.add_column("wall", justify="right")
+            files.add_column("cpu", justify="right")
+            for item in data["slowest_files"]:
+                files.add_row(item["path"], _ms(item["wall_s"]), _ms(item["cpu_s"]))
+            console.print(files)
+
+    def write_json(self, target: str) -> None:
+        text = json.dumps(self.to_dict(), indent=2, ensure_ascii=False)
+        if target == "-":
+            sys.stdout.write(text + "\n")
+        else:
+            with open(target, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f} ms"
+
+
+def _percent(part: float, total: float) -> str:
+    return f"{part / total * 100:.1f}" if total > 0 else ""
+
+
+# 当前进程的统计实例，由 cli 中的 --profile / --stats-json 启用
+stats = RunStats()
@@ -3,60 +3,309 @@ from typing import Annotated
 from rich.console import Console
 from . import config
 from .common import iter_files_to_process
+from .index import ScanIndex
+from .output import OutputFormat, RecordWriter
+from .stats import stats
 
+import time
 import typer
 import logging
-import re
 
 console = Console()
 log = logging.getLogger(__name__)
 tool_app = typer.Typer(no_args_is_help=True)
 
 
-EN_WORD_RE = re.compile(r"[A-Za-z0-9]+(?:['_-][A-Za-z0-9]+)*")
-CJK_CHAR_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
-
-
-def count_mixed_words(content: str) -> int:
-    """Count words for mixed Chinese/English text.
-    - English/alnum chunks count as 1 word each.
-    - Each CJK ideograph counts as 1 word.
-    """
-    en_count = len(EN_WORD_RE.findall(content))
-    cjk_count = len(CJK_CHAR_RE.findall(content))
-    return en_count + cjk_count
-
-
 @tool_app.command("wc")
 def word_count(
     ctx: typer.Context,
     files: Annotated[list[str] | None, typer.Option("--file", "-f", help="Only count the specified files instead of all managed files. It will override the scan_glob configuration. Can be specified multiple times.")] = None,
     glob: Annotated[list[str] | None, typer.Option("--glob", "-g", help="Override the scan_glob configuration with the specified glob patterns. Can be specified multiple times.")] = None,
+    no_index: Annotated[bool, typer.Option("--no-index", help="Parse every file without reading or updating the scan index in .parkive.")] = False,
+    rebuild_index: Annotated[bool, typer.Option("--rebuild-index", help="Discard the scan index in .parkive and rebuild it from scratch.")] = False,
+    jobs: Annotated[int | None, typer.Option("--jobs", "-j", help="Number of worker processes used to parse files. Defaults to the CPU count; small file sets are always processed serially.")] = None,
+    changed: Annotated[bool, typer.Option("--changed", help="Only process files that git reports as modified or untracked in the working tree.")] = False,
+    since: Annotated[str | None, typer.Option("--since", help="Only process files changed since the given git revision, plus uncommitted changes.")] = None,
+    output_format: Annotated[OutputFormat, typer.Option("--format", help="Output format. 'ndjson' and 'tsv' stream one unstyled record per file to stdout for use in scripts.")] = OutputFormat.table,
+    quiet: Annotated[bool, typer.Option("--quiet", "-q", help="Only print the totals, not one line per file.")] = False,
+    all_vaults: Annotated[bool, typer.Option("--all-vaults", help="Count words in every vault registered with 'parkive vaults add', one line per vault, several vaults at a time.")] = False,
+    concurrency: Annotated[int | None, typer.Option("--concurrency", help="With --all-vaults, the maximum number of vaults processed at the same time.")] = None,
 ):
     """Count words in managed files."""
+    from .vault import Vault
+
+    if all_vaults:
+        if files is not None:
+            console.print("--file cannot be combined with --all-vaults.", style=config.error_style)
+            raise typer.Exit(code=1)
+        _word_count_all_vaults(glob, no_index, rebuild_index, jobs, changed, since, output_format, quiet, concurrency)
+        return
+
+    vault = Vault(ctx.obj["parkive_root"], ctx.obj["user_config"], sources={}, use_index=not no_index, rebuild_index=rebuild_index)
+    out = RecordWriter(output_format, ["path", "words"], quiet=quiet)
+
+    def on_file(path: str, words: int) -> None:
+        with stats.phase("output"):
+            out.row({"path": path, "words": words})
+
+    def on_error(path: str, error: str) -> None:
+        with stats.phase("output"):
+            out.error(path, error)
+
+    # 逐文件的结果在扫描过程中输出，机器可读格式可以边扫描边交给下游
+    result = vault.word_count(files=vault.select(files, glob, changed, since), jobs=jobs, on_file=on_file, on_error=on_error)
+    with stats.phase("output"):
+        out.close({"files": result["count"], "words": result["total"]})
+
+    if output_format is OutputFormat.table:
+        console.print(f"total files: {result['count']}", style=config.info_style)
+        console.print(f"total words: {result['total']}", style=config.success_style)
+
+
+def _word_count_in_vault(root: Path, glob: list[str] | None, use_index: bool, rebuild_index: bool, jobs: int, changed: bool, since: str | None) -> dict:
+    from .vault import Vault
+
+    vault = Vault(root, sources={}, use_index=use_index, rebuild_index=rebuild_index)
+    # 只需要汇总：逐文件的字数可能很多，不收集也不传回主进程
+    result = vault.word_count(files=vault.select(None, glob, changed, since), jobs=jobs, on_file=lambda path, words: None)
+    return {"files": result["count"], "words": result["total"], "errors": result["errors"]}
+
+
+def _word_count_all_vaults(glob: list[str] | None, no_index: bool, rebuild_index: bool, jobs: int | None, changed: bool, since: str | None,
+                           output_format: OutputFormat, quiet: bool, concurrency: int | None) -> None:
+    """tool wc --all-vaults：每个知识库输出一行（按完成顺序），失败的知识库与无法解析的文件一样作为错误输出。"""
+    from .registry import finish_vaults, map_vaults, registered_vaults, vault_jobs, vault_workers
+
+    vaults = registered_vaults()
+    workers = vault_workers(vaults, concurrency)
+    start = time.perf_counter()
+    outcomes: dict[str, dict] = {}
+    total_files = total_words = 0
+    out = RecordWriter(output_format, ["vault", "files", "words"], quiet=quiet)
+    for name, root, outcome in map_vaults(_word_count_in_vault, vaults, workers, glob, not no_index, rebuild_index, vault_jobs(jobs, workers), changed, since):
+        outcomes[name] = outcome
+        with stats.phase("output"):
+            if "error" in outcome:
+                out.error(name, outcome["error"])
+                continue
+            result = outcome["result"]
+            for path, error in result["errors"]:
+                out.error(f"{root / path}", error)
+            out.row({"vault": name, "files": result["files"], "words": result["words"]})
+            total_files += result["files"]
+            total_words += result["words"]
+    out.close({"vaults": len(vaults), "files": total_files, "words": total_words})
+
+    if output_format is OutputFormat.table:
+        console.print(f"total files: {total_files}", style=config.info_style)
+        console.print(f"total words: {total_words}", style=config.success_style)
+        finish_vaults(outcomes, start)
+    elif any("error" in outcome for outcome in outcomes.values()):
+        raise typer.Exit(code=1)
+
+
+@tool_app.command("images")
+def image_graph(
+    ctx: typer.Context,
+    missing: Annotated[bool, typer.Option("--missing", help="Only report image references whose local file does not exist.")] = False,
+    orphans: Annotated[bool, typer.Option("--orphans", help="Only report image files that no managed file references.")] = False,
+    duplicates: Annotated[bool, typer.Option("--duplicates", help="Only report image files with identical content.")] = False,
+    no_index: Annotated[bool, typer.Option("--no-index", help="Parse every file and hash every image without reading or updating the caches in .parkive.")] = False,
+    jobs: Annotated[int | None, typer.Option("--jobs", "-j", help="Number of worker processes used to parse files and hash images. Defaults to the CPU count; small file sets are always processed serially.")] = None,
+    output_format: Annotated[OutputFormat, typer.Option("--format", help="Output format. 'ndjson' and 'tsv' stream one unstyled record per finding to stdout for use in scripts.")] = OutputFormat.table,
+    quiet: Annotated[bool, typer.Option("--quiet", "-q", help="Only print the totals, not one line per finding.")] = False,
+):
+    """Report missing, orphaned and duplicate local images."""
+    from .images import HashCache, build_image_graph
+
+    parkive_root = Path(ctx.obj["parkive_root"])
+    user_config = ctx.obj["user_config"]
+    scan_glob = user_config["scope"]["scan_glob"]
+    skip_dirs = user_config["scope"]["skip_dirs"]
+    # 不指定任何一项时报告全部三类问题
+    report_all = not (missing or orphans or duplicates)
+
+    index = ScanIndex(parkive_root, enabled=not no_index)
+    records = index.watched_records(scan_glob, skip_dirs)
+    if records is None:
+        records = index.scan(iter_files_to_process(parkive_root, scan_glob, skip_dirs), prune=True, jobs=jobs)
+    cache = HashCache(parkive_root, enabled=not no_index)
+    graph = build_image_graph(parkive_root, records, skip_dirs, cache, jobs)
+    index.save()
+    cache.save()
+
+    table = output_format is OutputFormat.table
+    out = RecordWriter(output_format, ["kind", "path", "detail"], quiet=quiet)
+    with stats.phase("output"):
+        if report_all or missing:
+            if table and not quiet:
+                console.print(f"Missing images ({len(graph['missing'])}):", style=config.warning_style)
+            for note, url in graph["missing"]:
+                out.row({"kind": "missing", "path": note, "detail": url})
+        if report_all or orphans:
+            if table and not quiet:
+                console.print(f"\nOrphaned images ({len(graph['orphans'])}):", style=config.warning_style)
+            for path, size in graph["orphans"]:
+                out.row({"kind": "orphan", "path": path, "detail": size})
+        if report_all or duplicates:
+            if table and not quiet:
+                console.print(f"\nDuplicate images ({len(graph['duplicates'])} groups):", style=config.warning_style)
+            for group in graph["duplicates"]:
+                # 每组的第一个文件作为保留的副本，其余文件的 detail 指向它
+                for path in group[1:]:
+                    out.row({"kind": "duplicate", "path": path, "detail": group[0]})
+        orphan_bytes = sum(size for _, size in graph["orphans"])
+        totals = {
+            "images": graph["images"],
+            "local_refs": graph["local_refs"],
+            "missing": len(graph["missing"]),
+            "orphans": len(graph["orphans"]),
+            "orphan_bytes": orphan_bytes,
+            "duplicate_groups": len(graph["duplicates"]),
+        }
+        out.close(totals)
+
+    if table:
+        console.print(
+            f"\n{graph['images']} image files, {graph['local_refs']} local image references: "
+            f"{len(graph['missing'])} missing, {len(graph['orphans'])} orphaned ({orphan_bytes} bytes), "
+            f"{len(graph['duplicates'])} groups of duplicates.",
+            style=config.success_style,
+        )
+
+
+@tool_app.command("search")
+def search(
+    ctx: typer.Context,
+    query: Annotated[str, typer.Argument(help="Words and/or Chinese text to search for. All terms must match unless --any is given.")],
+    limit: Annotated[int, typer.Option("--limit", "-n", help="Maximum number of results to show.")] = 20,
+    match_any: Annotated[bool, typer.Option("--any", help="Match files containing any of the terms instead of all of them.")] = False,
+    no_update: Annotated[bool, typer.Option("--no-update", help="Search the existing index without checking managed files for changes.")] = False,
+    rebuild_index: Annotated[bool, typer.Option("--rebuild-index", help="Discard the search index in .parkive and rebuild it from scratch.")] = False,
+    jobs: Annotated[int | None, typer.Option("--jobs", "-j", help="Number of worker processes used to index files. Defaults to the CPU count; small file sets are always processed serially.")] = None,
+    output_format: Annotated[OutputFormat, typer.Option("--format", help="Output format. 'ndjson' and 'tsv' stream one unstyled record per result to stdout for use in scripts.")] = OutputFormat.table,
+):
+    """Full-text search over managed files, ranked by relevance."""
+    from .search import SearchIndex, find_snippet
+
+    parkive_root = Path(ctx.obj["parkive_root"])
+    user_config = ctx.obj["user_config"]
+
+    index = SearchIndex(parkive_root, rebuild=rebuild_index)
+    try:
+        if not no_update or rebuild_index:
+            indexed, removed = index.update(
+                iter_files_to_process(parkive_root, user_config["scope"]["scan_glob"], user_config["scope"]["skip_dirs"]),
+                jobs=jobs,
+            )
+            log.debug(f"Search index updated: {indexed} files indexed, {removed} removed")
+        results = index.search(query, match_any=match_any)
+    finally:
+        index.close()
+
+    out = RecordWriter(output_format, ["path", "score", "line", "text"])
+    shown = 0
+    with stats.phase("output"):
+        for rel_path, score in results:
+            if shown >= limit:
+                break
+            try:
+                text = (parkive_root / rel_path).read_text(encoding="utf-8")
+            except (OSError, UnicodeDecodeError):
+                continue
+            snippet = find_snippet(text, query)
+            if snippet is None:
+                continue
+            shown += 1
+            lineno, line = snippet
+            out.row({"path": rel_path, "score": round(score, 3), "line": lineno, "text": line[:200]})
+        out.close({"results": shown})
+
+    if output_format is OutputFormat.table and shown == 0:
+        console.print("no matches.", style=config.warning_style)
+
+
+def load_link_graph(ctx: typer.Context, no_update: bool, no_index: bool, jobs: int | None):
+    """
+    由扫描索引建立笔记链接图。no_update 为 True 时只使用索引中保存的记录，不遍历知识库；
+    否则与 tool images 相同，parkive watch 运行时直接读取索引，不运行时增量扫描全部受管文件。
+    """
+    from .graph import LinkGraph
+
     parkive_root = Path(ctx.obj["parkive_root"])
     user_config = ctx.obj["user_config"]
-    scan_glob = user_config["scope"]["scan_glob"] if glob is None else glob
-
-    total_words = 0
-    counted_files = 0
-
-    for file_path in iter_files_to_process(
-        parkive_root=parkive_root,
-        scan_glob=scan_glob,
-        skip_dirs=user_config["scope"]["skip_dirs"],
-        specified_files=files,
-    ):
-        content = file_path.read_text(encoding="utf-8")
-        word_count_in_file = count_mixed_words(content)
-        total_words += word_count_in_file
-        counted_files += 1
-
-        try:
-            display_path = file_path.relative_to(parkive_root).as_posix()
-        except ValueError:
-            display_path = str(file_path)
-        console.print(f"{display_path}\t{word_count_in_file}", style=config.info_style)
-
-    console.print(f"total files: {counted_files}", style=config.info_style)
-    console.print(f"total words: {total_words}", style=config.success_style)
+    scan_glob = user_config["scope"]["scan_glob"]
+    skip_dirs = user_config["scope"]["skip_dirs"]
+
+    index = ScanIndex(parkive_root, enabled=not no_index)
+    if no_update and not no_index:
+        if not index.entries:
+            console.print("The scan index is empty, run the command without --no-update first.", style=config.error_style)
+            raise typer.Exit(code=1)
+        records = index.stored_records()
+    else:
+        records = index.watched_records(scan_glob, skip_dirs)
+        if records is None:
+            records = index.scan(iter_files_to_process(parkive_root, scan_glob, skip_dirs), prune=True, jobs=jobs)
+    graph = LinkGraph(parkive_root, records)
+    index.save()
+    return graph
+
+
+@tool_app.command("backlinks")
+def backlinks(
+    ctx: typer.Context,
+    note: Annotated[str, typer.Argument(help="Path of the note, relative to the current directory. The note itself does not need to exist any more.")],
+    no_update: Annotated[bool, typer.Option("--no-update", help="Answer from the scan index in .parkive without checking managed files for changes.")] = False,
+    no_index: Annotated[bool, typer.Option("--no-index", help="Parse every file without reading or updating the scan index in .parkive.")] = False,
+    jobs: Annotated[int | None, typer.Option("--jobs", "-j", help="Number of worker processes used to parse files. Defaults to the CPU count; small file sets are always processed serially.")] = None,
+    output_format: Annotated[OutputFormat, typer.Option("--format", help="Output format. 'ndjson' and 'tsv' stream one unstyled record per link to stdout for use in scripts.")] = OutputFormat.table,
+):
+    """List the managed files that link to a note."""
+    parkive_root = Path(ctx.obj["parkive_root"])
+    try:
+        target = (Path.cwd() / note).resolve().relative_to(parkive_root).as_posix()
+    except ValueError:
+        console.print(f"{note} is not inside the parkive root {parkive_root}.", style=config.error_style)
+        raise typer.Exit(code=1)
+
+    graph = load_link_graph(ctx, no_update, no_index, jobs)
+    found = graph.backlinks(target)
+    out = RecordWriter(output_format, ["path", "link"])
+    with stats.phase("output"):
+        for source, link in found:
+            out.row({"path": source, "link": link})
+        out.close({"backlinks": len(found), "files": len({source for source, _ in found})})
+
+    if output_format is OutputFormat.table:
+        console.print(f"{len(found)} links to {target} from {len({source for source, _ in found})} files.", style=config.success_style)
+
+
+@tool_app.command("broken-links")
+def broken_links(
+    ctx: typer.Context,
+    no_update: Annotated[bool, typer.Option("--no-update", help="Answer from the scan index in .parkive without checking managed files for changes.")] = False,
+    no_index: Annotated[bool, typer.Option("--no-index", help="Parse every file without reading or updating the scan index in .parkive.")] = False,
+    jobs: Annotated[int | None, typer.Option("--jobs", "-j", help="Number of worker processes used to parse files. Defaults to the CPU count; small file sets are always processed serially.")] = None,
+    output_format: Annotated[OutputFormat, typer.Option("--format", help="Output format. 'ndjson' and 'tsv' stream one unstyled record per broken link to stdout for use in scripts.")] = OutputFormat.table,
+    quiet: Annotated[bool, typer.Option("--quiet", "-q", help="Only print the totals, not one line per broken link.")] = False,
+):
+    """Report Markdown links between local files whose target does not exist."""
+    graph = load_link_graph(ctx, no_update, no_index, jobs)
+    found = graph.broken()
+    out = RecordWriter(output_format, ["path", "link", "target"], quiet=quiet)
+    with stats.phase("output"):
+        for note, message in graph.errors:
+            out.error(note, message)
+        for source, link, target in found:
+            out.row({"path": source, "link": link, "target": target})
+        links = sum(len(note_links) for note_links in graph.links.values())
+        out.close({"files": len(graph.notes), "links": links, "broken": len(found)})
+
+    if output_format is OutputFormat.table:
+        console.print(
+            f"{len(graph.notes)} files, {links} local links, {len(found)} broken.",
+            style=config.error_style if found else config.success_style,
+        )
+    if found:
+        raise typer.Exit(code=1)
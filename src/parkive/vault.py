@@ -0,0 +1,325 @@
+from pathlib import Path
+from . import config
+from .common import iter_files_to_process, iter_managed_files, map_files
+from .index import RACY_WINDOW_NS, ScanIndex
+from .journal import ChangeJournal, plan_file
+from .scan import SourceMatcher, prefix_match, unknown_source_kind
+from .stats import stats
+
+import os
+import time
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class Vault:
+    """
+    在进程内使用 parkive 的入口，供长期运行的服务调用，命令行中的 source status/inspect/change 和 tool wc 也都通过它实现。
+
+    创建时加载一次配置和来源并编译匹配器，之后的每次调用都复用：
+     - 扫描索引保存在内存中，只有 index.json 被其他进程（例如 parkive watch）改写后才重新加载
+     - 受管文件列表在遍历过的目录的 mtime 都没有变化时直接复用，不再遍历知识库
+    方法返回字典形式的结构化结果，files 参数可以传入任意的文件路径（str 或 PathLike，相对路径相对于知识库根目录）可迭代对象代替全部受管文件；
+    inspect 和 word_count 可以通过 on_file / on_error 回调在扫描过程中逐文件取得结果，返回值中只保留汇总。
+    配置或来源被修改后调用 reload()。Vault 不是线程安全的，每个线程应使用各自的实例。
+
+        vault = Vault("~/notes")
+        vault.status()["known"]                 # {"local": 120, "server": 3}
+        vault.change([("local", "server")])     # 与 parkive source change local server 相同
+    """
+
+    def __init__(self, path: str | os.PathLike | None = None, user_config: dict | None = None, sources: dict[str, str] | None = None,
+                 use_index: bool = True, rebuild_index: bool = False):
+        """
+        path 可以是知识库中的任意目录，从它开始向上寻找 .parkive，默认从当前工作目录开始。
+        user_config 和 sources 为 None 时从 .parkive 中读取，格式错误时抛出 ValueError。
+        use_index 为 False 时每次都重新解析文件且不读写扫描索引，rebuild_index 为 True 时丢弃已有索引从头建立。
+        """
+        start = None if path is None else Path(path).expanduser()
+        root = config.find_parkive_root(start)
+        if root is None:
+            raise FileNotFoundError(f"Cannot find .parkive directory from {start or Path.cwd()} upward.")
+        self.root = root
+        self._root_prefix = os.path.join(str(root), "")
+        self.use_index = use_index
+        self._rebuild_index = rebuild_index
+        self._user_config = user_config
+        self._sources = sources
+        self.reload(user_config is None, sources is None)
+
+    def reload(self, user_config: bool = True, sources: bool = True) -> None:
+        """重新读取配置和来源，并丢弃缓存的文件列表和扫描索引。"""
+        try:
+            if user_config:
+                self._user_config = config.read_user_config(self.root)
+            if sources:
+                self._sources = config.read_sources(self.root)
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Failed to load the configuration of {self.root}: {e}") from e
+        self.source_matcher = SourceMatcher(self._sources)
+        self._files: list[Path] | None = None
+        self._dir_mtimes: dict[str, int] = {}
+        self._index: ScanIndex | None = None
+        self._index_mtime: int | None = None
+
+    @property
+    def user_config(self) -> dict:
+        return self._user_config
+
+    @property
+    def sources(self) -> dict[str, str]:
+        return self._sources
+
+    @property
+    def scan_glob(self) -> list[str]:
+        return self._user_config["scope"]["scan_glob"]
+
+    @property
+    def skip_dirs(self) -> list[str]:
+        return self._user_config["scope"]["skip_dirs"]
+
+    def rel_path(self, file_path: Path) -> str:
+        """返回相对知识库根目录的 posix 路径，根目录之外的文件返回原路径。"""
+        path = str(file_path)
+        if path.startswith(self._root_prefix):
+            rel_path = path[len(self._root_prefix) :]
+            return rel_path if os.sep == "/" else rel_path.replace(os.sep, "/")
+        try:
+            return file_path.relative_to(self.root).as_posix()
+        except ValueError:
+            return path
+
+    def select(self, files: list[str] | None = None, glob: list[str] | None = None, changed: bool = False, since: str | None = None):
+        """
+        按命令行的 --file、--glob、--changed、--since 选项选择文件，返回可以传给各方法 files 参数的可迭代对象；
+        没有指定任何选项时返回 None，表示全部受管文件。
+        """
+        if files is None and glob is None and not changed and since is None:
+            return None
+        return iter_files_to_process(
+            parkive_root=self.root,
+            scan_glob=self.scan_glob if glob is None else glob,
+            skip_dirs=self.skip_dirs,
+            specified_files=files,
+            changed=changed,
+            since=since,
+        )
+
+    def _file_paths(self, files):
+        """把 files 中的每一项转换为 Path，相对路径相对于知识库根目录而不是当前工作目录。"""
+        for f in files:
+            yield self.root / Path(f)
+
+    def _dirs_unchanged(self) -> bool:
+        for dir_path, mtime_ns in self._dir_mtimes.items():
+            try:
+                if os.stat(dir_path).st_mtime_ns != mtime_ns:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def files(self, refresh: bool = False) -> list[Path]:
+        """
+        全部受管文件。在目录中新增、删除或重命名文件都会更新该目录的 mtime，因此遍历过的目录的 mtime 都没有变化时，
+        直接复用上次遍历的结果；与扫描索引相同，mtime 距遍历开始不足 RACY_WINDOW_NS 的目录使结果不被缓存。
+        """
+        if not refresh and self._files is not None and self._dirs_unchanged():
+            stats.count("file list reused")
+            return self._files
+        visited: list[str] = []
+        started = time.time_ns()
+        with stats.phase("walk"):
+            files = list(iter_managed_files(self.root, self.scan_glob, self.skip_dirs, visited))
+            dir_mtimes: dict[str, int] = {}
+            for dir_path in visited:
+                try:
+                    dir_mtimes[dir_path] = os.stat(dir_path).st_mtime_ns
+                except OSError:
+                    continue
+        if any(started - mtime_ns <= RACY_WINDOW_NS for mtime_ns in dir_mtimes.values()):
+            self._files, self._dir_mtimes = None, {}
+        else:
+            self._files, self._dir_mtimes = files, dir_mtimes
+        return files
+
+    def _index_file_mtime(self) -> int | None:
+        try:
+            return (self.root / ".parkive" / "cache" / "index.json").stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _scan_index(self) -> ScanIndex:
+        mtime_ns = self._index_file_mtime()
+        if self._index is None or (self.use_index and mtime_ns != self._index_mtime):
+            self._index = ScanIndex(self.root, enabled=self.use_index, rebuild=self._rebuild_index)
+            self._rebuild_index = False
+            self._index_mtime = mtime_ns
+        return self._index
+
+    def _save_index(self) -> None:
+        self._index.save()
+        self._index_mtime = self._index_file_mtime()
+
+    def records(self, files=None, jobs: int | None = None):
+        """
+        生成 (file_path, record)，record 与扫描索引中的记录相同（urls、links、words，无法解析时为 error）。
+        files 为 None 时处理全部受管文件：parkive watch 正在运行时直接读取索引，否则增量扫描并删除索引中已不存在的文件。
+        迭代结束后保存索引。
+        """
+        index = self._scan_index()
+        if files is None:
+            records = index.watched_records(self.scan_glob, self.skip_dirs)
+            if records is None:
+                managed_files = self.files()
+                stats.count("files matched", len(managed_files))
+                records = index.scan(managed_files, prune=True, jobs=jobs)
+        else:
+            records = index.scan(self._file_paths(files), jobs=jobs)
+        yield from records
+        self._save_index()
+
+    def require_source(self, name: str) -> str:
+        if name not in self._sources:
+            raise ValueError(f"source '{name}' not found.")
+        return self._sources[name]
+
+    def _parsed_records(self, files, jobs: int | None, errors: list[tuple[str, str]], on_error):
+        """生成可以解析的文件的 (file_path, record)；无法解析的文件交给 on_error(相对路径, 原因)，on_error 为 None 时收集到 errors 中。"""
+        for file_path, record in self.records(files, jobs):
+            if "error" not in record:
+                yield file_path, record
+            elif on_error is not None:
+                on_error(self.rel_path(file_path), record["error"])
+            else:
+                errors.append((self.rel_path(file_path), record["error"]))
+
+    def status(self, files=None, jobs: int | None = None, on_error=None) -> dict:
+        """
+        统计图片 URL 的来源，返回：
+         - known：{来源名: 图片数}，包括数量为 0 的来源
+         - unknown：{scheme://netloc: 图片数}，不属于任何来源的 URL
+         - errors：[(相对路径, 原因)]，无法解析的文件；指定 on_error 时改为在遇到时立即调用 on_error(相对路径, 原因)
+        """
+        known = {name: 0 for name in self._sources}
+        unknown: dict[str, int] = {}
+        errors: list[tuple[str, str]] = []
+        records = self._parsed_records(files, jobs, errors, on_error)
+        with stats.phase("classify"):
+            for file_path, record in records:
+                for url in record["urls"]:
+                    source_name = self.source_matcher.match(url)
+                    if source_name is not None:
+                        known[source_name] += 1
+                    else:
+                        kind = unknown_source_kind(url)
+                        unknown[kind] = unknown.get(kind, 0) + 1
+                        log.debug(f"Detected unknown source URL: {url} (kind: {kind}) in file {file_path}")
+        return {"known": known, "unknown": unknown, "errors": errors}
+
+    def inspect(self, name: str, files=None, jobs: int | None = None, on_file=None, on_error=None) -> dict:
+        """
+        统计使用来源 name 的图片，返回 {"name", "base_url", "files": {相对路径: 图片数}, "count": 文件数, "total", "errors"}。
+        指定 on_file 时每个文件解析完立即调用 on_file(相对路径, 图片数)，返回值中不再有 files；on_error 与 status 相同。
+        来源不存在时抛出 ValueError。
+        """
+        base_url = self.require_source(name)
+        counts: dict[str, int] = {}
+        errors: list[tuple[str, str]] = []
+        count = total = 0
+        records = self._parsed_records(files, jobs, errors, on_error)
+        with stats.phase("classify"):
+            for file_path, record in records:
+                images = sum(1 for url in record["urls"] if prefix_match(url, base_url))
+                if on_file is None:
+                    counts[self.rel_path(file_path)] = images
+                else:
+                    on_file(self.rel_path(file_path), images)
+                count += 1
+                total += images
+        result = {"name": name, "base_url": base_url, "count": count, "total": total, "errors": errors}
+        return result if on_file is not None else {**result, "files": counts}
+
+    def word_count(self, files=None, jobs: int | None = None, on_file=None, on_error=None) -> dict:
+        """
+        统计字数，返回 {"files": {相对路径: 字数}, "count": 文件数, "total", "errors"}。
+        指定 on_file 时每个文件解析完立即调用 on_file(相对路径, 字数)，返回值中不再有 files；on_error 与 status 相同。
+        """
+        counts: dict[str, int] = {}
+        errors: list[tuple[str, str]] = []
+        count = total = 0
+        for file_path, record in self._parsed_records(files, jobs, errors, on_error):
+            if on_file is None:
+                counts[self.rel_path(file_path)] = record["words"]
+            else:
+                on_file(self.rel_path(file_path), record["words"])
+            count += 1
+            total += record["words"]
+        result = {"count": count, "total": total, "errors": errors}
+        return result if on_file is not None else {**result, "files": counts}
+
+    def resolve_mappings(self, pairs) -> list[dict]:
+        """
+        把 [(源来源名, 目标来源名)]（或 {源: 目标}）解析为 [{"source", "target", "source_prefix", "target_prefix"}]。
+        来源不存在或同一个源出现多次时抛出 ValueError。
+        """
+        if isinstance(pairs, dict):
+            pairs = pairs.items()
+        mappings = []
+        seen_prefixes = set()
+        for src, tgt in pairs:
+            source_prefix = self.require_source(src)
+            target_prefix = self.require_source(tgt)
+            if source_prefix in seen_prefixes:
+                raise ValueError(f"source '{src}' is mapped more than once.")
+            seen_prefixes.add(source_prefix)
+            mappings.append({"source": src, "target": tgt, "source_prefix": source_prefix, "target_prefix": target_prefix})
+        if not mappings:
+            raise ValueError("No source mapping given.")
+        return mappings
+
+    def change(self, pairs, files=None, jobs: int | None = None, dry_run: bool = False) -> dict:
+        """
+        把图片 URL 的来源按 pairs（见 resolve_mappings）一次性替换，过程与 parkive source change 相同：先生成计划并写入日志，
+        再通过临时文件加重命名改写文件。返回：
+         - mappings：resolve_mappings 的结果
+         - entries：[{"path", "count", "counts": {源前缀: 数量}, ...}]，dry_run 时为计划改写的文件，否则为已改写的文件
+         - conflicts：计划之后被修改而跳过的条目，errors：[(相对路径, 原因)]，无法解析的文件
+        有未完成的 source change 时抛出 ValueError（dry_run 除外）。
+        """
+        mappings = self.resolve_mappings(pairs)
+        mapping = {m["source_prefix"]: m["target_prefix"] for m in mappings}
+        journal = ChangeJournal(self.root)
+        if journal.exists() and not dry_run:
+            raise ValueError("An interrupted source change is pending. Run 'parkive source resume' or 'parkive source rollback' first.")
+
+        if files is None:
+            managed_files = self.files()
+            stats.count("files matched", len(managed_files))
+        else:
+            with stats.phase("walk"):
+                managed_files = list(self._file_paths(files))
+
+        entries = []
+        errors: list[tuple[str, str]] = []
+        with stats.phase("plan"):
+            for file_path, planned in map_files(plan_file, managed_files, jobs, mapping):
+                if planned is None:
+                    continue
+                if "error" in planned:
+                    errors.append((self.rel_path(file_path), planned["error"]))
+                    continue
+                entries.append({"path": self.rel_path(file_path), **planned})
+        stats.count("urls replaced", sum(entry["count"] for entry in entries))
+        if dry_run:
+            return {"mappings": mappings, "entries": entries, "conflicts": [], "errors": errors}
+
+        with stats.phase("journal"):
+            journal.create({"mappings": mappings}, entries)
+        with stats.phase("apply"):
+            applied, conflicts = journal.apply(jobs)
+        with stats.phase("journal"):
+            journal.discard()
+        return {"mappings": mappings, "entries": applied, "conflicts": conflicts, "errors": errors}
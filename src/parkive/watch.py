@@ -0,0 +1,367 @@
+from pathlib import Path
+from datetime import datetime
+from rich.console import Console
+from . import config
+from .common import DirFilter, PathMatcher, acquire_lock, iter_managed_files, parkive_state_dir
+from .index import WATCH_LOCK_FILENAME, WATCH_STATE_FILENAME, ScanIndex
+from .scan import SourceMatcher
+
+import os
+import sys
+import json
+import time
+import errno
+import select
+import signal
+import struct
+import typer
+import logging
+
+
+console = Console()
+log = logging.getLogger(__name__)
+
+
+# inotify 事件掩码，见 <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+)
+STRUCTURAL_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+# 无论 skip_dirs 如何配置都不监视的目录：watch 自己写入的缓存和 git sync 修改的仓库数据
+ALWAYS_SKIPPED = {".parkive", ".git"}
+
+
+class InotifyWatcher:
+    """
+    通过 ctypes 调用 Linux 的 inotify 监视目录树。只监视不会被 skip_dirs 跳过的目录，新建的目录会自动加入监视。
+    空闲时阻塞在 select 上，不占用 CPU。
+    """
+
+    mode = "inotify"
+
+    def __init__(self, parkive_root: Path, dir_filter: DirFilter):
+        import ctypes
+        import ctypes.util
+
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = str(parkive_root)
+        self.dir_filter = dir_filter
+        # 监视描述符 => 目录相对路径（根目录为 ""，其余以 "/" 结尾）
+        self.dirs: dict[int, str] = {}
+        self.add_tree(self.root, "")
+
+    def _skip(self, name: str, rel_path: str) -> bool:
+        return rel_path in ALWAYS_SKIPPED or self.dir_filter.skip(name, rel_path)
+
+    def add_tree(self, dir_path: str, rel_dir: str) -> None:
+        """监视 dir_path 及其下所有不被跳过的目录。已经监视的目录会更新其相对路径（用于目录被移动之后）。"""
+        stack = [(dir_path, rel_dir)]
+        while stack:
+            path, rel = stack.pop()
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = self._ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    raise OSError(err, "inotify watch limit reached, see fs.inotify.max_user_watches")
+                continue
+            self.dirs[wd] = rel
+            try:
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                rel_path = rel + entry.name
+                if entry.is_dir(follow_symlinks=False) and not self._skip(entry.name, rel_path):
+                    stack.append((entry.path, rel_path + "/"))
+
+    def wait(self, timeout: float | None) -> list[tuple[str, bool, bool]] | None:
+        """
+        等待事件，返回 [(相对路径, 是否是目录, 是否改变了文件集合)]；超时返回 None。
+        事件队列溢出时返回 [("", True, True)]，表示需要重新遍历整个知识库。
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return None
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + EVENT_HEADER.size : offset + EVENT_HEADER.size + length].rstrip(b"\0"))
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    events.append(("", True, True))
+                    continue
+                if mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                rel_dir = self.dirs.get(wd)
+                if rel_dir is None or not name:
+                    continue
+                rel_path = rel_dir + name
+                is_dir = bool(mask & IN_ISDIR)
+                if is_dir:
+                    if self._skip(name, rel_path):
+                        continue
+                    if mask & IN_CREATE:
+                        self.add_tree(os.path.join(self.root, rel_path), rel_path + "/")
+                    elif mask & (IN_MOVED_FROM | IN_MOVED_TO):
+                        # 目录被移动后，其子目录的监视描述符不变但相对路径变了，重新登记整棵树
+                        self.add_tree(self.root, "")
+                events.append((rel_path, is_dir, bool(mask & STRUCTURAL_MASK)))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    在不支持 inotify 的平台上（或指定 --poll 时）定期遍历受管文件并比较 mtime 和大小。
+    只能发现受管文件的变化，CPU 占用与文件数量和轮询间隔成正比。
+    """
+
+    mode = "polling"
+
+    def __init__(self, parkive_root: Path, scan_glob: list[str], skip_dirs: list[str], interval: float):
+        self.parkive_root = parkive_root
+        self.scan_glob = scan_glob
+        self.skip_dirs = skip_dirs
+        self.interval = interval
+        self.snapshot = self._take_snapshot()
+        self.next_poll = time.monotonic() + interval
+
+    def _take_snapshot(self) -> dict[str, tuple[int, int]]:
+        snapshot = {}
+        for file_path in iter_managed_files(self.parkive_root, self.scan_glob, self.skip_dirs):
+            try:
+                st = file_path.stat()
+            except OSError:
+                continue
+            snapshot[file_path.relative_to(self.parkive_root).as_posix()] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def wait(self, timeout: float | None) -> list[tuple[str, bool, bool]] | None:
+        now = time.monotonic()
+        sleep = self.next_poll - now if timeout is None else min(timeout, self.next_poll - now)
+        if sleep > 0:
+            time.sleep(sleep)
+        if time.monotonic() < self.next_poll:
+            return None
+        self.next_poll = time.monotonic() + self.interval
+        snapshot = self._take_snapshot()
+        events = [(key, False, key not in self.snapshot) for key, value in snapshot.items() if self.snapshot.get(key) != value]
+        events.extend((key, False, True) for key in self.snapshot.keys() - snapshot.keys())
+        self.snapshot = snapshot
+        return events or None
+
+    def close(self) -> None:
+        pass
+
+
+class VaultWatch:
+    """
+    parkive watch 的状态：常驻内存的扫描索引，以及由索引增量维护的来源使用数量和字数。
+    每批变化只重新解析变化的文件；新建、删除或移动文件时才重新遍历目录（只 stat，不重新解析未修改的文件）。
+    """
+
+    def __init__(self, parkive_root: Path, scan_glob: list[str], skip_dirs: list[str], sources: dict[str, str], jobs: int | None):
+        self.parkive_root = parkive_root
+        self.scan_glob = scan_glob
+        self.skip_dirs = skip_dirs
+        self.jobs = jobs
+        self.matcher = PathMatcher([pattern.strip().strip("'\"`") for pattern in scan_glob])
+        self.source_names = sorted(sources)
+        self.source_matcher = SourceMatcher(sources)
+        self.index = ScanIndex(parkive_root)
+        self.index.racy_window_ns = 0
+        self.words = 0
+        self.known = {name: 0 for name in sources}
+        self.unknown = 0
+        # 索引键 => (计入总数时的记录, 字数, {来源名: 数量}, 未知来源数量)
+        self._contrib: dict[str, tuple[dict, int, dict[str, int], int]] = {}
+
+    def rescan(self) -> None:
+        files = list(iter_managed_files(self.parkive_root, self.scan_glob, self.skip_dirs))
+        for _ in self.index.scan(files, prune=True, jobs=self.jobs):
+            pass
+        # 保持索引条目与遍历顺序一致，使直接读取索引的命令输出顺序与正常扫描相同
+        entries = self.index.entries
+        self.index.entries = {key: entries[key] for key in map(self.index.key, files) if key in entries}
+
+    def update(self, rel_paths: set[str]) -> None:
+        files = [self.parkive_root / rel_path for rel_path in sorted(rel_paths)]
+        for _ in self.index.scan([f for f in files if f.is_file()], jobs=self.jobs):
+            pass
+
+    def refresh_totals(self) -> int:
+        """根据索引中变化过的条目更新总数，返回变化的文件数。"""
+        entries = self.index.entries
+        changed = 0
+        for key in self._contrib.keys() - entries.keys():
+            self._apply(self._contrib.pop(key), -1)
+            changed += 1
+        for key, entry in entries.items():
+            old = self._contrib.get(key)
+            if old is not None and old[0] is entry:
+                continue
+            if old is not None:
+                self._apply(old, -1)
+            known: dict[str, int] = {}
+            unknown = 0
+            for url in entry["urls"]:
+                name = self.source_matcher.match(url)
+                if name is None:
+                    unknown += 1
+                else:
+                    known[name] = known.get(name, 0) + 1
+            contrib = (entry, entry["words"], known, unknown)
+            self._contrib[key] = contrib
+            self._apply(contrib, 1)
+            changed += 1
+        return changed
+
+    def _apply(self, contrib: tuple[dict, int, dict[str, int], int], sign: int) -> None:
+        _, words, known, unknown = contrib
+        self.words += sign * words
+        self.unknown += sign * unknown
+        for name, count in known.items():
+            self.known[name] += sign * count
+
+    def summary(self) -> str:
+        sources = ", ".join(f"{name} {self.known[name]}" for name in self.source_names) or "(no sources)"
+        return f"{len(self.index.entries)} files, {self.words} words; {sources}; unknown {self.unknown}"
+
+
+def _process_batch(vault: VaultWatch, pending: set[str], rescan: bool) -> None:
+    if rescan:
+        vault.rescan()
+    else:
+        vault.update(pending)
+    changed = vault.refresh_totals()
+    vault.index.save()
+    if changed:
+        console.print(f"[{datetime.now().strftime('%X')}] {changed} files updated: {vault.summary()}", style=config.info_style)
+
+
+def _interrupt(signum, frame) -> None:
+    # 将 SIGTERM（kill、systemd stop 等）当作 Ctrl-C 处理，使 run_watch 的清理代码得以执行
+    raise KeyboardInterrupt
+
+
+def _run_sync(parkive_root: Path) -> None:
+    from .git import sync_repository
+
+    try:
+        sync_repository(parkive_root)
+    except typer.Exit:
+        console.print("git sync failed, it will be retried after the next change.", style=config.warning_style)
+
+
+def run_watch(parkive_root: Path, user_config: dict, sources: dict[str, str], debounce: float = 0.3,
+              sync_after: float | None = None, poll: bool = False, interval: float = 2.0, jobs: int | None = None) -> None:
+    """
+    监视受管文件直到被 Ctrl-C 或 SIGTERM 中断。期间扫描索引始终是最新的，source status、source inspect 和 tool wc
+    会直接读取索引而不再遍历知识库（见 ScanIndex.watched_records）。
+    """
+    scan_glob = user_config["scope"]["scan_glob"]
+    skip_dirs = user_config["scope"]["skip_dirs"]
+    cache_dir = parkive_state_dir(parkive_root, "cache")
+    lock = acquire_lock(cache_dir / WATCH_LOCK_FILENAME, blocking=False)
+    if lock is None:
+        console.print("parkive watch is already running for this vault.", style=config.error_style)
+        raise typer.Exit(code=1)
+
+    state_path = cache_dir / WATCH_STATE_FILENAME
+    vault = VaultWatch(parkive_root, scan_glob, skip_dirs, sources, jobs)
+    watcher = None
+    previous_handler = signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        if not poll:
+            try:
+                watcher = InotifyWatcher(parkive_root, DirFilter(skip_dirs))
+            except (OSError, AttributeError) as e:
+                console.print(f"inotify unavailable ({e}), falling back to polling.", style=config.warning_style)
+        if watcher is None:
+            watcher = PollingWatcher(parkive_root, scan_glob, skip_dirs, interval)
+
+        vault.rescan()
+        vault.refresh_totals()
+        vault.index.save()
+        state_path.write_text(json.dumps({
+            "pid": os.getpid(),
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "mode": watcher.mode,
+            "scan_glob": scan_glob,
+            "skip_dirs": skip_dirs,
+        }), encoding="utf-8")
+        console.print(f"watching {parkive_root} ({watcher.mode}): {vault.summary()}", style=config.success_style)
+        console.print("Press Ctrl-C to stop.", style=config.info_style)
+
+        pending: set[str] = set()
+        rescan = False
+        last_event = last_change = 0.0
+        sync_pending = False
+        while True:
+            # 没有待处理的变化时无限期阻塞，否则等到防抖或 git sync 的期限
+            deadlines = []
+            if pending or rescan:
+                deadlines.append(last_event + debounce)
+            if sync_pending and sync_after is not None:
+                deadlines.append(last_change + sync_after)
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+            events = watcher.wait(timeout)
+            now = time.monotonic()
+            for rel_path, is_dir, structural in events or []:
+                last_event = last_change = now
+                sync_pending = True
+                if is_dir:
+                    rescan = True
+                elif vault.matcher.match(rel_path):
+                    pending.add(rel_path)
+                    rescan = rescan or structural
+            if events:
+                continue
+
+            if (pending or rescan) and now - last_event >= debounce:
+                _process_batch(vault, pending, rescan)
+                pending, rescan = set(), False
+            if sync_pending and sync_after is not None and now - last_change >= sync_after:
+                sync_pending = False
+                _run_sync(parkive_root)
+    except KeyboardInterrupt:
+        console.print("stopped watching.", style=config.info_style)
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        if watcher is not None:
+            watcher.close()
+        state_path.unlink(missing_ok=True)
+        vault.index.drop_racy()
+        vault.index.save()
+        lock.close()
@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import time
+import tomllib
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import parkive
+
+
+SRC_DIR = str(Path(parkive.__file__).resolve().parent.parent)
+BUDGETS_PATH = Path(__file__).resolve().parents[1] / "benchmarks" / "budgets.toml"
+# budgets.toml 是参考机器上的上限，测试机器可能更慢，也可能同时运行其他测试，这里只拦截数量级上的退化
+BUDGET_FACTOR = 4
+# 只有部分子命令才需要的模块，导入 parkive.cli 或生成顶层帮助信息时不应加载它们
+HEAVY_MODULES = [
+    "rich.table",
+    "rich.logging",
+    "rich.progress",
+    "http.client",
+    "urllib.request",
+    "concurrent.futures",
+    "concurrent.futures.process",
+    "multiprocessing",
+    "mmap",
+    "tomli_w",
+    "parkive.scan",
+    "parkive.index",
+    "parkive.vault",
+    "parkive.source",
+    "parkive.git",
+    "parkive.tool",
+    "parkive.registry",
+]
+
+
+def run_python(code: str, cwd: Path | None = None) -> subprocess.CompletedProcess:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [SRC_DIR, os.environ.get("PYTHONPATH")]))}
+    env.pop("PARKIVE_LOG_LEVEL", None)
+    return subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+
+
+def loaded_modules(code: str, cwd: Path | None = None) -> set[str]:
+    """在新的解释器中执行 code，返回执行之后 sys.modules 中的模块名。"""
+    result = run_python(code + "\nimport sys, json\nprint(json.dumps(sorted(sys.modules)))", cwd)
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+
+def cli_code(args: list[str]) -> str:
+    """与 parkive 命令相同的入口，命令正常结束时 typer 抛出 SystemExit(0)。"""
+    return f"import sys\nfrom parkive import main\nsys.argv = ['parkive', *{args!r}]\ntry:\n    main()\nexcept SystemExit as e:\n    assert not e.code, e.code"
+
+
+@pytest.fixture
+def vault(tmp_path):
+    (tmp_path / ".parkive").mkdir()
+    (tmp_path / ".parkive" / "sources.toml").write_text('[sources]\nlocal = "http://localhost/img"\n', encoding="utf-8")
+    return tmp_path
+
+
+def test_import_cli_does_not_load_heavy_modules():
+    modules = loaded_modules("import parkive.cli")
+    assert "parkive.cli" in modules
+    assert sorted(modules.intersection(HEAVY_MODULES)) == []
+
+
+@pytest.mark.parametrize("args", [["--help"], ["git", "--help"]])
+def test_help_does_not_load_heavy_modules(args):
+    code = f"import parkive.cli\ntry:\n    parkive.cli.app({args!r})\nexcept SystemExit:\n    pass"
+    modules = loaded_modules(code)
+    # typer 用 rich.table 排版帮助信息；git --help 需要导入 git 子命令组本身
+    allowed = {"rich.table", "parkive.git"} if args[0] == "git" else {"rich.table"}
+    assert sorted(modules.intersection(HEAVY_MODULES) - allowed) == []
+
+
+def test_source_list_does_not_load_heavy_modules(vault):
+    modules = loaded_modules(cli_code(["source", "list"]), cwd=vault)
+    # source list 只需要导入 source 子命令组本身
+    assert sorted(modules.intersection(HEAVY_MODULES) - {"parkive.source"}) == []
+
+
+@pytest.mark.parametrize("budget, args", [("startup_help", ["--help"]), ("startup_source_list", ["source", "list"])])
+def test_startup_within_budget(budget, args, vault):
+    with BUDGETS_PATH.open("rb") as f:
+        limit = tomllib.load(f)["budgets"][budget] * BUDGET_FACTOR
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        run_python(cli_code(args), cwd=vault)
+        timings.append(time.perf_counter() - start)
+    assert min(timings) < limit, f"{' '.join(args)} took {min(timings):.2f} s, budget {limit:.2f} s"
+
+
+def test_vault_api_does_not_load_cli():
+    modules = loaded_modules("from parkive import Vault")
+    assert "parkive.vault" in modules
+    assert sorted(modules.intersection(["parkive.cli", "parkive.git", "typer", *HEAVY_MODULES]) - {"parkive.vault", "parkive.scan", "parkive.index", "mmap"}) == []
+
+
+@pytest.mark.parametrize(
+    "args, expected",
+    [
+        (["tool", "wc", "--all-vaults"], True),
+        (["--profile", "source", "status", "-j", "2", "--all-vaults"], True),
+        (["git", "sync", "--all-vaults", "--concurrency", "2"], True),
+        (["tool", "wc"], False),
+        (["tool", "search", "--", "--all-vaults"], False),
+        (["tool", "wc", "--glob", "--all-vaults"], False),
+        (["tool", "wc", "--", "--all-vaults"], False),
+        (["no-such-command", "--all-vaults"], False),
+    ],
+)
+def test_all_vaults_flag_is_read_from_parsed_options(args, expected):
+    import typer
+
+    from parkive.cli import app
+
+    ctx = typer.main.get_command(app).make_context("parkive", list(args))
+    assert ctx.meta["parkive.all_vaults"] is expected
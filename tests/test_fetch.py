@@ -0,0 +1,159 @@
+import time
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from typer.testing import CliRunner
+
+from parkive.cli import app
+from parkive.fetch import MAX_REDIRECTS, ConnectionPool, LinkCache, check_urls, probe_url
+from parkive.stats import stats
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    测试用的图片服务器，所有响应都带 Content-Length 以保持 keep-alive：
+     - /ok/*：200
+     - /missing/*：404
+     - /nohead/*：HEAD 返回 405，GET 返回 206
+     - /redirect/<n>：重定向 n 次之后到达 /ok/final.png
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def reply(self, status: int, body: bytes = b"", location: str | None = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        if location is not None:
+            self.send_header("Location", location)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def handle_request(self) -> None:
+        self.server.requests.append((self.command, self.path, self.headers.get("Range")))
+        if self.path.startswith("/ok/"):
+            self.reply(200, b"image")
+        elif self.path.startswith("/nohead/"):
+            if self.command == "HEAD":
+                self.reply(405)
+            else:
+                self.reply(206, b"i")
+        elif self.path.startswith("/redirect/"):
+            remaining = int(self.path.rsplit("/", 1)[1])
+            self.reply(302, location=f"/redirect/{remaining - 1}" if remaining > 1 else "/ok/final.png")
+        else:
+            self.reply(404, b"not found")
+
+    do_HEAD = do_GET = handle_request
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests = []
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+
+@pytest.fixture
+def pool():
+    pool = ConnectionPool(timeout=5)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def counters():
+    stats.reset(enabled=True)
+    yield stats.counters
+    stats.reset()
+
+
+def test_probe_ok_and_not_found(server, pool):
+    assert probe_url(pool, server.url + "/ok/a.png") == {"ok": True, "status": 200, "error": None}
+    assert probe_url(pool, server.url + "/missing/b.png") == {"ok": False, "status": 404, "error": "Not Found"}
+    assert [method for method, _, _ in server.requests] == ["HEAD", "HEAD"]
+
+
+def test_head_not_allowed_falls_back_to_ranged_get(server, pool):
+    assert probe_url(pool, server.url + "/nohead/a.png") == {"ok": True, "status": 206, "error": None}
+    assert server.requests == [("HEAD", "/nohead/a.png", None), ("GET", "/nohead/a.png", "bytes=0-0")]
+
+
+def test_redirects_are_followed_up_to_the_limit(server, pool):
+    assert probe_url(pool, server.url + f"/redirect/{MAX_REDIRECTS}")["ok"]
+    assert server.requests[-1][1] == "/ok/final.png"
+
+    server.requests.clear()
+    result = probe_url(pool, server.url + f"/redirect/{MAX_REDIRECTS + 1}")
+    assert result == {"ok": False, "status": 302, "error": "too many redirects"}
+    assert len(server.requests) == MAX_REDIRECTS + 1
+
+
+def test_connection_refused(pool):
+    # 绑定后立即关闭，得到一个没有进程监听的端口
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    result = probe_url(pool, f"http://127.0.0.1:{port}/a.png")
+    assert result["ok"] is False and result["status"] is None
+    assert "refused" in result["error"].lower()
+
+
+def test_check_urls_reuses_keep_alive_connections(server, counters):
+    urls = [f"{server.url}/ok/{i}.png" for i in range(5)] + [server.url + "/missing/x.png", server.url + "/nohead/y.png"]
+    results = check_urls(urls, timeout=5, concurrency=4, per_host=1)
+    assert {url: result["ok"] for url, result in results.items()} == {url: "missing" not in url for url in urls}
+    # 同一主机同时只有一个请求，所有请求（包括 404 和 HEAD 回退）共用一个连接
+    assert counters["connections opened"] == 1
+    assert counters["urls fetched"] == len(urls)
+
+
+def test_link_cache_expires_after_ttl(tmp_path):
+    (tmp_path / ".parkive").mkdir()
+    cache = LinkCache(tmp_path, ttl=100)
+    cache.put("http://a/fresh.png", {"ok": True, "status": 200, "error": None}, now=1000)
+    cache.put("http://a/stale.png", {"ok": False, "status": 404, "error": "Not Found"}, now=0)
+    assert cache.get("http://a/fresh.png", now=1100)["status"] == 200
+    assert cache.get("http://a/fresh.png", now=1101) is None
+    assert cache.get("http://a/missing.png", now=1000) is None
+
+    # 保存时丢弃已经过期的结果（以当前时间为准）
+    cache.put("http://a/now.png", {"ok": True, "status": 200, "error": None}, now=time.time())
+    cache.save()
+    reloaded = LinkCache(tmp_path, ttl=100)
+    assert list(reloaded.entries) == ["http://a/now.png"]
+
+
+def test_source_check_uses_cache_until_refresh(server, tmp_path, monkeypatch):
+    (tmp_path / ".parkive").mkdir()
+    (tmp_path / ".parkive" / "sources.toml").write_text(f'[sources]\nlocal = "{server.url}"\n', encoding="utf-8")
+    (tmp_path / "[bold]note.md").write_text(f"![]({server.url}/ok/a.png)\n![]({server.url}/missing/b.png)\n", encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("PARKIVE_CONFIG_DIR", str(tmp_path / "config"))
+    runner = CliRunner()
+
+    result = runner.invoke(app, ["source", "check"])
+    assert result.exit_code == 1
+    assert "checked 2 urls (2 probed, 0 cached), 1 broken." in result.output
+    # 文件名和 URL 原样输出，不被当作 rich 标记
+    assert "[bold]note.md" in result.output
+    assert len(server.requests) == 2
+
+    result = runner.invoke(app, ["source", "check"])
+    assert "checked 2 urls (0 probed, 2 cached), 1 broken." in result.output
+    assert len(server.requests) == 2
+
+    result = runner.invoke(app, ["source", "check", "--refresh"])
+    assert "checked 2 urls (2 probed, 0 cached), 1 broken." in result.output
+    assert len(server.requests) == 4
@@ -0,0 +1,165 @@
+import os
+import time
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import parkive
+from parkive.git import sync_repository
+from parkive.push_queue import MAX_ATTEMPTS, PushQueue, backoff_delay
+
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+SRC_DIR = str(Path(parkive.__file__).resolve().parent.parent)
+
+# 文件名中包含空格、通配符、冒号、方括号、引号和非 ASCII 字符；按 pathspec 解释时会匹配到其他文件或报错
+SPECIAL_NAMES = ["a b.md", "*.md", ":(glob)x.md", "[ab].md", "ab.md", "quote'\".md", "中文 笔记.md", "dir/with space/:top.md"]
+
+
+def git(cwd, *args) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True, encoding="utf-8").stdout
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    """已经推送过一次提交的工作仓库，origin 是本地的裸仓库。"""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    for role in ["AUTHOR", "COMMITTER"]:
+        monkeypatch.setenv(f"GIT_{role}_NAME", "parkive")
+        monkeypatch.setenv(f"GIT_{role}_EMAIL", "parkive@example.com")
+    remote = tmp_path / "remote.git"
+    work = tmp_path / "vault"
+    git(tmp_path, "init", "--bare", "-b", "main", str(remote))
+    git(tmp_path, "init", "-b", "main", str(work))
+    (work / ".parkive").mkdir()
+    (work / "note.md").write_text("first\n", encoding="utf-8")
+    git(work, "add", "--all")
+    git(work, "commit", "-m", "notes")
+    git(work, "remote", "add", "origin", str(remote))
+    git(work, "push", "-u", "origin", "main")
+    return work, remote
+
+
+def test_clean_tree_is_a_no_op(repo, capsys):
+    work, remote = repo
+    head = git(work, "rev-parse", "HEAD")
+    sync_repository(work)
+    assert "nothing to sync" in capsys.readouterr().out
+    assert git(work, "rev-parse", "HEAD") == head == git(remote, "rev-parse", "main")
+
+
+def test_sync_stages_special_paths_and_pushes(repo):
+    work, remote = repo
+    for name in SPECIAL_NAMES:
+        path = work / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name + "\n", encoding="utf-8")
+    (work / "note.md").write_text("second\n", encoding="utf-8")
+    head = git(work, "rev-parse", "HEAD")
+
+    sync_repository(work)
+
+    # 修改被合并进上一次提交（amend），并强制推送到 origin/main
+    assert git(work, "rev-parse", "HEAD") != head
+    assert git(work, "rev-list", "--count", "HEAD").strip() == "1"
+    assert git(work, "rev-parse", "HEAD") == git(remote, "rev-parse", "main")
+    assert git(work, "status", "--porcelain", "-z") == ""
+    files = set(git(remote, "ls-tree", "-r", "-z", "--name-only", "main").split("\0")) - {""}
+    assert files == {"note.md", *SPECIAL_NAMES}
+    assert git(remote, "show", "main:note.md") == "second\n"
+
+    # 推送之后再次同步不会产生新的提交
+    synced = git(work, "rev-parse", "HEAD")
+    sync_repository(work)
+    assert git(work, "rev-parse", "HEAD") == synced
+
+
+PUSH_ARGS = ["origin", "main", "--force"]
+
+
+def amend(work, text: str) -> str:
+    """修改 note.md 并合并进上一次提交，返回新的 HEAD。"""
+    (work / "note.md").write_text(text, encoding="utf-8")
+    git(work, "commit", "--all", "--amend", "--no-edit")
+    return git(work, "rev-parse", "HEAD").strip()
+
+
+def test_enqueue_merges_entries_with_the_same_args(repo):
+    work, _ = repo
+    queue = PushQueue(work)
+    assert queue.enqueue(PUSH_ARGS, "a") is False
+    assert queue.enqueue(["origin", "main:backup"], "a") is False
+    assert queue.enqueue(PUSH_ARGS, "b") is True
+    entries = queue.entries()
+    assert [(e["args"], e["commit"]) for e in entries] == [(["origin", "main:backup"], "a"), (PUSH_ARGS, "b")]
+    assert all(e["status"] == "pending" and e["attempts"] == 0 for e in entries)
+    assert queue.clear() == 2
+    assert queue.entries() == []
+
+
+def test_failed_pushes_back_off_then_give_up_and_flush_retries(repo, tmp_path):
+    work, remote = repo
+    head = amend(work, "second\n")
+    git(work, "remote", "set-url", "origin", str(tmp_path / "missing.git"))
+    queue = PushQueue(work)
+    queue.enqueue(PUSH_ARGS, head)
+
+    before = time.time()
+    ok, error = queue.attempt(queue.entries()[0])
+    assert not ok and error
+    [entry] = queue.entries()
+    assert entry["attempts"] == 1
+    assert entry["last_error"] == error
+    assert entry["status"] == "pending"
+    assert entry["next_attempt"] >= before + backoff_delay(1)
+
+    for _ in range(MAX_ATTEMPTS - 1):
+        queue.attempt(queue.entries()[0])
+    [entry] = queue.entries()
+    assert entry["attempts"] == MAX_ATTEMPTS
+    assert entry["status"] == "failed"
+    assert "failed:" in queue.log_path.read_text(encoding="utf-8")
+
+    # 放弃自动重试的条目仍会被 flush 推送
+    git(work, "remote", "set-url", "origin", str(remote))
+    [(_, ok, error)] = queue.flush()
+    assert ok and error is None
+    assert queue.entries() == []
+    assert git(remote, "rev-parse", "main").strip() == head
+
+
+def test_run_worker_drains_the_queue(repo):
+    work, remote = repo
+    head = amend(work, "second\n")
+    queue = PushQueue(work)
+    queue.enqueue(PUSH_ARGS, head)
+    queue.enqueue(["origin", "main:backup"], head)
+
+    queue.run_worker()
+
+    assert queue.entries() == []
+    assert not queue.worker_running()
+    assert git(remote, "rev-parse", "main").strip() == head
+    assert git(remote, "rev-parse", "backup").strip() == head
+
+
+def test_sync_background_pushes_from_a_worker(repo, monkeypatch, capsys):
+    work, remote = repo
+    # 后台工作进程以 python -m parkive.push_queue 启动，需要能从源码目录导入 parkive
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(filter(None, [SRC_DIR, os.environ.get("PYTHONPATH")])))
+    (work / "note.md").write_text("second\n", encoding="utf-8")
+
+    sync_repository(work, background=True)
+
+    assert "queued git push" in capsys.readouterr().out
+    head = git(work, "rev-parse", "HEAD").strip()
+    queue = PushQueue(work)
+    deadline = time.monotonic() + 30
+    while (queue.entries() or queue.worker_running()) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert queue.entries() == []
+    assert git(remote, "rev-parse", "main").strip() == head
@@ -0,0 +1,54 @@
+import pytest
+
+from parkive.graph import LinkGraph, resolve_link
+
+
+@pytest.mark.parametrize("link, note, expected", [
+    ("b.md", "dir/a.md", "dir/b.md"),
+    ("../b.md#sec", "dir/a.md", "b.md"),
+    ("/top.md?x=1", "dir/a.md", "top.md"),
+    ("../../out.md", "dir/a.md", "../out.md"),
+    ("C:/files/a.pdf", "a.md", "C:/files/a.pdf"),
+    ("#sec", "a.md", None),
+    ("?q", "a.md", None),
+    ("%23frag", "a.md", "%23frag"),
+    ("%3Fq", "dir/a.md", "dir/%3Fq"),
+])
+def test_resolve_link(link, note, expected):
+    assert resolve_link(link, note) == expected
+
+
+@pytest.fixture
+def graph(tmp_path):
+    (tmp_path / "attachments").mkdir()
+    (tmp_path / "attachments" / "doc 1.pdf").write_bytes(b"%PDF")
+    notes = {
+        "a.md": ["my%20note.md#part", "%23frag", "%3Fq", "#local", "attachments/doc%201.pdf", "missing.md"],
+        "my note.md": ["a.md%23sec", "a.md#sec", "my%20note.md"],
+        "dir/b.md": ["../a.md?x", "%2E%2E/my%20note.md"],
+    }
+    return LinkGraph(tmp_path, [(tmp_path / note, {"links": links}) for note, links in notes.items()])
+
+
+def test_encoded_links_resolve_to_notes_and_files(graph):
+    assert graph.target("my%20note.md#part", "a.md") == ("my note.md", True)
+    assert graph.target("attachments/doc%201.pdf", "a.md") == ("attachments/doc 1.pdf", True)
+    assert graph.target("%2E%2E/my%20note.md", "dir/b.md") == ("my note.md", True)
+    assert graph.target("#local", "a.md") == (None, True)
+
+
+def test_encoded_anchors_and_queries_fall_back_to_the_raw_path(graph):
+    # 解码后只剩锚点或查询参数的链接按原样的路径查找，不存在时报告为失效链接
+    assert graph.target("%23frag", "a.md") == ("%23frag", False)
+    assert graph.target("%3Fq", "a.md") == ("%3Fq", False)
+    assert graph.target("a.md%23sec", "my note.md") == ("a.md", True)
+    assert graph.broken() == [
+        ("a.md", "%23frag", "%23frag"),
+        ("a.md", "%3Fq", "%3Fq"),
+        ("a.md", "missing.md", "missing.md"),
+    ]
+
+
+def test_backlinks_skip_self_links(graph):
+    assert graph.backlinks("a.md") == [("dir/b.md", "../a.md?x"), ("my note.md", "a.md#sec"), ("my note.md", "a.md%23sec")]
+    assert graph.backlinks("my note.md") == [("a.md", "my%20note.md#part"), ("dir/b.md", "%2E%2E/my%20note.md")]
@@ -0,0 +1,37 @@
+from parkive.index import ScanIndex, scan_file
+
+
+def make_vault(root, count: int):
+    (root / ".parkive").mkdir()
+    files = []
+    for i in range(count):
+        path = root / f"note{i}.md"
+        path.write_text(f"![a](http://old/{i}.png) word{i} 中文\n", encoding="utf-8")
+        files.append(path)
+    return files
+
+
+def test_scan_yields_before_consuming_all_files(tmp_path):
+    files = make_vault(tmp_path, 5)
+    consumed = []
+
+    def walk():
+        for path in files:
+            consumed.append(path)
+            yield path
+
+    index = ScanIndex(tmp_path)
+    records = index.scan(walk(), jobs=1)
+    assert next(records) == (files[0], scan_file(files[0]))
+    assert consumed == files[:1]
+    assert list(records) == [(path, scan_file(path)) for path in files[1:]]
+
+
+def test_parallel_scan_matches_serial_scan(tmp_path):
+    files = make_vault(tmp_path, 150)
+    serial = dict(ScanIndex(tmp_path, enabled=False).scan(files, jobs=1))
+    index = ScanIndex(tmp_path)
+    parallel = list(index.scan(iter(files), jobs=2))
+    assert len(parallel) == len(files)
+    assert dict(parallel) == serial
+    assert index.misses == len(files)
@@ -0,0 +1,56 @@
+import os
+import stat
+
+import pytest
+
+from parkive.journal import ChangeJournal, plan_file
+
+
+MAPPING = {"http://old": "http://new"}
+
+
+@pytest.fixture
+def vault(tmp_path, monkeypatch):
+    (tmp_path / ".parkive").mkdir()
+    # 日志只能 fsync 自己写入的文件和目录，不能刷写整个系统
+    def fail_sync():
+        raise AssertionError("os.sync must not be called")
+    monkeypatch.setattr(os, "sync", fail_sync, raising=False)
+    return tmp_path
+
+
+def create_journal(root, names):
+    entries = []
+    for name in names:
+        planned = plan_file(root / name, MAPPING)
+        entries.append({"path": name, **planned})
+    journal = ChangeJournal(root)
+    journal.create({"mappings": [{"source": "old", "target": "new", "source_prefix": "http://old", "target_prefix": "http://new"}]}, entries)
+    return journal
+
+
+def mode(path):
+    return stat.S_IMODE(path.stat().st_mode)
+
+
+def test_apply_and_rollback_keep_permission_bits(vault):
+    script = vault / "script.md"
+    script.write_text("![a](http://old/a.png)\n", encoding="utf-8")
+    script.chmod(0o755)
+    private = vault / "private.md"
+    private.write_text('<img src="http://old/b.png">\n', encoding="utf-8")
+    private.chmod(0o600)
+
+    journal = create_journal(vault, ["script.md", "private.md"])
+    applied, conflicts = journal.apply(jobs=1)
+    assert len(applied) == 2 and not conflicts
+    assert script.read_text(encoding="utf-8") == "![a](http://new/a.png)\n"
+    assert mode(script) == 0o755
+    assert mode(private) == 0o600
+
+    restored, conflicts = journal.rollback()
+    assert restored == 2 and not conflicts
+    assert private.read_text(encoding="utf-8") == '<img src="http://old/b.png">\n'
+    assert mode(script) == 0o755
+    assert mode(private) == 0o600
+    assert not list(vault.glob("*.parkive-tmp"))
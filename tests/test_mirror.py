@@ -0,0 +1,123 @@
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from typer.testing import CliRunner
+
+from parkive import source
+from parkive.cli import app
+from parkive.mirror import MANIFEST_FILENAME, mirror_path, mirror_urls
+
+
+class Handler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.server.requests.append(self.path)
+        super().do_GET()
+
+
+@pytest.fixture
+def server(tmp_path):
+    """以 tmp_path/site 为根目录的静态文件服务器，base 是来源的前缀 <url>/img。"""
+    site = tmp_path / "site"
+    (site / "img" / "sub").mkdir(parents=True)
+    (site / "img" / "a.png").write_bytes(b"same image")
+    (site / "img" / "sub" / "copy.png").write_bytes(b"same image")
+    (site / "img" / "b.png").write_bytes(b"other image" * 100)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), partial(Handler, directory=str(site)))
+    httpd.requests = []
+    httpd.base = f"http://127.0.0.1:{httpd.server_address[1]}/img"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("http://h/img/a.png", "a.png"),
+    ("http://h/img/sub/a.png?v=1#top", "sub/a.png"),
+    ("http://h/imgx/a.png", "imgx/a.png"),
+    ("http://h/other/a.png", "other/a.png"),
+    ("http://h/img//sub///a.png", "sub/a.png"),
+    ("http://h/img/%E4%B8%AD%20a.png", "中 a.png"),
+    ("http://h/img/", None),
+    ("http://h/img/../a.png", None),
+    ("http://h/img/sub/./a.png", None),
+    ("http://h/img/%2E%2E/a.png", None),
+    ("http://h/img/..%2Fa.png", None),
+    ("http://h/img/a%5Cb.png", None),
+    ("http://h/img/a%00.png", None),
+])
+def test_mirror_path(url, expected):
+    assert mirror_path(url, "http://h/img/") == expected
+
+
+def test_mirror_path_without_base_path():
+    assert mirror_path("http://h/img/a.png", "http://h") == "img/a.png"
+
+
+def test_identical_content_is_hardlinked(server, tmp_path):
+    dest = tmp_path / "mirror"
+    summary = mirror_urls([server.base + "/a.png", server.base + "/sub/copy.png", server.base + "/b.png"], server.base, dest, timeout=5)
+    assert (summary["downloaded"], summary["deduplicated"], summary["failed"]) == (3, 1, [])
+    assert (dest / "sub" / "copy.png").read_bytes() == b"same image"
+    assert (dest / "a.png").stat().st_ino == (dest / "sub" / "copy.png").stat().st_ino
+    assert (dest / "a.png").stat().st_ino != (dest / "b.png").stat().st_ino
+    assert not list(dest.rglob("*.part")) and not list(dest.rglob("*.link"))
+
+
+def test_second_run_skips_mirrored_urls_and_redownloads_truncated_files(server, tmp_path):
+    dest = tmp_path / "mirror"
+    urls = [server.base + "/a.png", server.base + "/b.png", server.base + "/missing.png"]
+    summary = mirror_urls(urls, server.base, dest, timeout=5)
+    assert (summary["downloaded"], summary["skipped"]) == (2, 0)
+    assert [(url, result["status"]) for url, result in summary["failed"]] == [(server.base + "/missing.png", 404)]
+    assert (dest / MANIFEST_FILENAME).is_file()
+    assert not (dest / "missing.png").exists()
+
+    server.requests.clear()
+    summary = mirror_urls(urls, server.base, dest, timeout=5)
+    assert (summary["downloaded"], summary["skipped"]) == (0, 2)
+    assert server.requests == ["/img/missing.png"]
+
+    # 大小与清单不一致（例如被中断的复制）的文件会重新下载
+    (dest / "b.png").write_bytes(b"other")
+    server.requests.clear()
+    summary = mirror_urls(urls, server.base, dest, timeout=5)
+    assert (summary["downloaded"], summary["skipped"]) == (1, 1)
+    assert sorted(server.requests) == ["/img/b.png", "/img/missing.png"]
+    assert (dest / "b.png").read_bytes() == b"other image" * 100
+
+
+def test_urls_differing_only_in_query_conflict(server, tmp_path):
+    first, second = server.base + "/a.png?v=1", server.base + "/a.png?v=2"
+    summary = mirror_urls([first, second, "http://elsewhere/"], server.base, tmp_path / "mirror", timeout=5)
+    assert summary["downloaded"] == 1
+    assert summary["conflicts"] == [(second, first)]
+    assert summary["invalid"] == ["http://elsewhere/"]
+    assert server.requests == ["/img/a.png?v=1"]
+
+
+def test_source_mirror_prints_paths_without_markup(server, tmp_path, monkeypatch):
+    vault = tmp_path / "vault"
+    (vault / ".parkive").mkdir(parents=True)
+    (vault / ".parkive" / "sources.toml").write_text(f'[sources]\nsite = "{server.base}"\n', encoding="utf-8")
+    (vault / "note.md").write_text(f"![]({server.base}/a.png)\n![]({server.base}/[bold]missing.png)\n", encoding="utf-8")
+    monkeypatch.chdir(vault)
+    monkeypatch.setenv("PARKIVE_CONFIG_DIR", str(tmp_path / "config"))
+    # 不按终端宽度折行，便于按行比较
+    monkeypatch.setattr(source.console, "soft_wrap", True)
+
+    dest = tmp_path / "[bold]out"
+    result = CliRunner().invoke(app, ["source", "mirror", "site", str(dest)])
+    assert result.exit_code == 1
+    assert f"failed {server.base}/[bold]missing.png: 404 Not Found (in note.md)" in result.output
+    assert f"mirrored source 'site' into {dest}: 1 downloaded" in result.output
+    assert (dest / "a.png").read_bytes() == b"same image"
@@ -0,0 +1,36 @@
+import pytest
+
+from parkive.output import OutputFormat, RecordWriter
+
+
+# 搜索结果的片段和文件名可以包含任意方括号，其中 [/x] 在 Rich 标记中是不匹配的闭合标签
+SNIPPETS = ["see [/closing] tag", "[bold]not bold[/bold]", "list[int] and [link](a.md)", "[", "]"]
+
+
+@pytest.mark.parametrize("text", SNIPPETS)
+def test_table_rows_print_brackets_verbatim(text, capsys):
+    out = RecordWriter(OutputFormat.table, ["path", "text"])
+    out.row({"path": "notes/[draft].md", "text": text})
+    out.error("notes/[x].md", "bad [/red] input")
+    out.close({})
+    row, skipped = capsys.readouterr().out.splitlines()
+    # Rich 会把制表符展开为空格
+    assert row.split(None, 1) == ["notes/[draft].md", text]
+    assert skipped == "skipped notes/[x].md: bad [/red] input"
+
+
+@pytest.mark.parametrize("fmt", [OutputFormat.ndjson, OutputFormat.tsv])
+def test_machine_formats_print_brackets_verbatim(fmt, capsys):
+    out = RecordWriter(fmt, ["path", "text"])
+    out.row({"path": "notes/[draft].md", "text": SNIPPETS[0]})
+    out.close({"files": 1})
+    assert "[/closing]" in capsys.readouterr().out
+
+
+def test_tsv_escapes_tabs_newlines_and_backslashes(capsys):
+    out = RecordWriter(OutputFormat.tsv, ["path", "score", "line", "text"])
+    out.row({"path": "a\tb.md", "score": 1.5, "line": 3, "text": "alpha\tbeta gamma\nnext \\t"})
+    out.close({})
+    header, row = capsys.readouterr().out.splitlines()
+    assert header == "path\tscore\tline\ttext"
+    assert row.split("\t") == ["a\\tb.md", "1.5", "3", "alpha\\tbeta gamma\\nnext \\\\t"]
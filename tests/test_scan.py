@@ -0,0 +1,210 @@
+import re
+import sys
+import random
+
+import pytest
+
+from parkive import index, scan
+from parkive.scan import (
+    HTML_IMAGE_RE,
+    MD_IMAGE_RE,
+    SPACE_B,
+    PrefixRewriter,
+    _replace_images_two_pass,
+    count_mixed_words,
+    find_image_spans,
+    iter_image_urls,
+    iter_local_links,
+    may_contain_images,
+    rewrite_images_in_text,
+    validate_utf8,
+)
+
+
+# 用于拼接随机文档的片段：完整和不完整的 Markdown / HTML 图片标签、互相嵌套的标签、大小写和空白的变体
+FRAGMENTS = [
+    "![a](http://old/x.png)",
+    "![alt text](http://old/y.png \"title\")",
+    "![](http://other/z.png)",
+    "![a](<http://old/angle.png>)",
+    "![a](http://old/unclosed.png",
+    "![a]",
+    "![",
+    "](http://old/stray.png)",
+    '<img src="http://old/a.png">',
+    "<IMG SRC='http://old/b.png' alt=x>",
+    '<img alt="x" src = "http://old/c.png" />',
+    '<img\nsrc="http://old/d.png">',
+    "<imgsrc=\"http://old/e.png\">",
+    '<img src="http://old/unclosed.png',
+    '<img alt="![a](http://old/in-attr.png)" src="http://old/f.png">',
+    '![<img src="http://old/g.png">](http://old/h.png)',
+    '![x](http://old/<img src="http://old/i.png">)',
+    "<img",
+    "<",
+    "!",
+    "[",
+    "]",
+    "(",
+    ")",
+    '"',
+    "'",
+    ">",
+    " ",
+    "\n",
+    "\t",
+    "text ",
+    "中文",
+]
+
+
+def two_pass_urls(content: str) -> list[tuple[int, int]]:
+    """改为单次扫描之前的实现：先用 MD_IMAGE_RE 扫描一遍，再用 HTML_IMAGE_RE 扫描一遍，按出现位置返回 URL 的位置。"""
+    spans = [match.span("url") for match in MD_IMAGE_RE.finditer(content)]
+    spans += [match.span("url") for match in HTML_IMAGE_RE.finditer(content)]
+    return sorted(spans)
+
+
+def random_documents(count: int, seed: int = 20240101):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 12)))
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "",
+        "no images here",
+        "![a](http://old/x.png) and <img src=\"http://old/y.png\">",
+        '<img src="http://old/a.png"> ![b](http://old/b.png "t")',
+        "![a](http://old/x.png)![b](http://old/y.png)",
+        "<IMG Src='http://old/z.png'>",
+    ],
+)
+def test_single_pass_matches_two_pass(content):
+    spans = find_image_spans(content)
+    assert spans is not None
+    assert [(start, end) for _, start, end in spans] == two_pass_urls(content)
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        '![<img src="http://old/g.png">](http://old/h.png)',
+        '<img alt="![a](http://old/in-attr.png)" src="http://old/f.png">',
+        '<img src="![a](http://old/j.png)">',
+    ],
+)
+def test_nested_tags_fall_back_to_two_passes(content):
+    assert find_image_spans(content) is None
+    expected = sorted(content[start:end] for start, end in two_pass_urls(content))
+    assert sorted(iter_image_urls(content)) == expected
+
+
+def test_random_documents_match_two_pass():
+    rewriter = PrefixRewriter({"http://old": "http://new"})
+    for content in random_documents(5000):
+        expected = two_pass_urls(content)
+        spans = find_image_spans(content)
+        if spans is not None:
+            assert [(start, end) for _, start, end in spans] == expected, content
+        assert sorted(iter_image_urls(content)) == sorted(content[start:end] for start, end in expected), content
+        assert rewrite_images_in_text(content, rewriter) == _replace_images_two_pass(content, rewriter), content
+
+
+# Unicode 空白、非 ASCII 的字母以及大小写折叠后与 img / src 相同的字符，用于比较 str 和 bytes 两种模式
+UNICODE_FRAGMENTS = FRAGMENTS + [
+    "\u00a0",
+    "\u3000",
+    "\u2028",
+    "\u0085",
+    '![a](http://old/nbsp\u00a0"t")',
+    '![a](http://old/wide.png\u3000"t")',
+    "[note](docs/a\u00a0b.md)",
+    "[note](docs/中文.md)",
+    '<img\u00e9 src="http://old/k.png">',
+    '<img \u017frc="http://old/l.png">',
+    '<\u0130mg src="http://old/m.png">',
+    '<img src\u00a0=\u3000"http://old/n.png">',
+    "word's",
+    "\u1e9e",
+]
+
+
+def test_space_matches_unicode_whitespace():
+    space_bre = re.compile(SPACE_B.encode())
+    for code in range(sys.maxunicode + 1):
+        if 0xd800 <= code <= 0xdfff:
+            continue
+        char = chr(code)
+        assert (space_bre.fullmatch(char.encode("utf-8")) is not None) == (re.fullmatch(r"\s", char) is not None), hex(code)
+
+
+@pytest.mark.parametrize(
+    "content, urls",
+    [
+        ('<img data-中src="http://old/a.png">', []),
+        ('<imgé src="http://old/b.png">', []),
+        ('<img_x src="http://old/c.png">', []),
+        ('<İmg src="http://old/d.png">', ["http://old/d.png"]),
+        ('<ımg src="http://old/e.png">', ["http://old/e.png"]),
+        ('<img ſrc="http://old/f.png">', ["http://old/f.png"]),
+        ('<img 中 src="http://old/g.png">', ["http://old/g.png"]),
+        ('<img data-src="http://old/h.png">', ["http://old/h.png"]),
+        ('<img ésrc="http://old/i.png">', []),
+        ('<img 𝐚src="http://old/j.png">', []),
+        ('<img src="http://old/k.png" 中src="http://old/l.png">', ["http://old/k.png"]),
+    ],
+)
+def test_unicode_word_boundaries_and_case(content, urls):
+    # str 模式沿用 \b、\s 和 IGNORECASE 的 Unicode 语义，bytes 模式必须得到相同的结果
+    assert list(iter_image_urls(content)) == urls
+    assert [url.decode("utf-8") for url in iter_image_urls(content.encode("utf-8"))] == urls
+    spans = find_image_spans(content.encode("utf-8"))
+    assert [content.encode("utf-8")[start:end].decode("utf-8") for _, start, end in spans] == urls
+
+
+def test_bytes_mode_matches_str_mode():
+    rng = random.Random(20240202)
+    for _ in range(5000):
+        content = "".join(rng.choice(UNICODE_FRAGMENTS) for _ in range(rng.randint(1, 12)))
+        data = content.encode("utf-8")
+        spans = find_image_spans(content)
+        byte_spans = find_image_spans(data)
+        assert (spans is None) == (byte_spans is None), content
+        if spans is not None:
+            assert [content[start:end].encode("utf-8") for _, start, end in spans] == [data[start:end] for _, start, end in byte_spans], content
+        assert [url.encode("utf-8") for url in iter_image_urls(content)] == list(iter_image_urls(data)), content
+        assert [link.encode("utf-8") for link in iter_local_links(content)] == list(iter_local_links(data)), content
+        assert count_mixed_words(content) == count_mixed_words(data), content
+        assert may_contain_images(content) == may_contain_images(data), content
+
+
+@pytest.mark.parametrize("data", [b"", b"abc", "中文".encode("utf-8") * 5, b"ok\xff", "中".encode("utf-8")[:2], b"a" * 5 + b"\xe4\xb8x"])
+def test_validate_utf8_reports_absolute_position(data, monkeypatch):
+    monkeypatch.setattr(scan, "UTF8_CHECK_CHUNK", 4)
+    try:
+        data.decode("utf-8")
+    except UnicodeDecodeError as expected:
+        with pytest.raises(UnicodeDecodeError) as raised:
+            validate_utf8(data)
+        assert (raised.value.start, raised.value.end, raised.value.reason) == (expected.start, expected.end, expected.reason)
+    else:
+        validate_utf8(data)
+
+
+def test_large_file_must_be_utf8(tmp_path, monkeypatch):
+    monkeypatch.setattr(index, "LARGE_FILE_BYTES", 1)
+    note = tmp_path / "note.md"
+    note.write_bytes("![a](http://old/a.png) 中文\n".encode("utf-8") + b"\xff\n")
+    assert note.stat().st_size >= index.LARGE_FILE_BYTES
+    record = index.scan_file(note)
+    assert "error" in record and record["urls"] == []
+    note.write_bytes('![a](http://old/a.png) 中文 <img src\u3000="http://old/b.png">\n'.encode("utf-8"))
+    content = note.read_text(encoding="utf-8")
+    assert index.scan_file(note) == {
+        "urls": list(iter_image_urls(content)),
+        "links": list(iter_local_links(content)),
+        "words": count_mixed_words(content),
+    }
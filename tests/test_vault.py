@@ -0,0 +1,43 @@
+from pathlib import Path
+
+from parkive.vault import Vault
+
+
+def test_word_count_streams_files_to_callback(tmp_path):
+    (tmp_path / ".parkive").mkdir()
+    (tmp_path / "a.md").write_text("one two\n", encoding="utf-8")
+    (tmp_path / "b.md").write_text("中文\n", encoding="utf-8")
+    (tmp_path / "bad.md").write_bytes(b"\xff\n")
+    vault = Vault(tmp_path, sources={}, use_index=False)
+
+    rows, errors = [], []
+    result = vault.word_count(on_file=lambda path, words: rows.append((path, words)), on_error=lambda path, error: errors.append(path))
+    assert sorted(rows) == [("a.md", 2), ("b.md", 2)]
+    assert errors == ["bad.md"]
+    assert result == {"count": 2, "total": 4, "errors": []}
+
+    collected = vault.word_count()
+    assert collected["files"] == dict(rows)
+    assert [path for path, _ in collected["errors"]] == ["bad.md"]
+
+
+def test_files_accepts_str_and_paths_relative_to_the_root(tmp_path, monkeypatch):
+    root = tmp_path / "vault"
+    (root / ".parkive").mkdir(parents=True)
+    (root / "sub").mkdir()
+    (root / "a.md").write_text("one ![](http://old.example.com/a.png)\n", encoding="utf-8")
+    (root / "sub" / "b.md").write_text("two three ![](http://old.example.com/b.png)\n", encoding="utf-8")
+    # 相对路径相对于知识库根目录，而不是当前工作目录
+    monkeypatch.chdir(tmp_path)
+    vault = Vault(root, sources={"old": "http://old.example.com", "new": "http://new.example.com"})
+
+    files = ["a.md", Path("sub/b.md"), str(root / "sub" / "b.md")]
+    assert [vault.rel_path(path) for path, _ in vault.records(files)] == ["a.md", "sub/b.md", "sub/b.md"]
+    assert vault.word_count(["sub/b.md"])["files"] == {"sub/b.md": vault.word_count([root / "sub" / "b.md"])["total"]}
+    assert vault.inspect("old", iter(["./a.md", "sub/b.md"]))["files"] == {"a.md": 1, "sub/b.md": 1}
+    assert vault.status(["a.md"])["known"] == {"old": 1, "new": 0}
+
+    result = vault.change([("old", "new")], files=["sub/b.md"])
+    assert [entry["path"] for entry in result["entries"]] == ["sub/b.md"]
+    assert "http://new.example.com/b.png" in (root / "sub" / "b.md").read_text(encoding="utf-8")
+    assert "http://old.example.com/a.png" in (root / "a.md").read_text(encoding="utf-8")
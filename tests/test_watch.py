@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import parkive
+from parkive.index import WATCH_STATE_FILENAME, ScanIndex
+from parkive.scan import count_mixed_words
+from parkive.watch import PollingWatcher, VaultWatch
+
+
+SRC_DIR = str(Path(parkive.__file__).resolve().parent.parent)
+SCAN_GLOB = ["*.md", "**/*.md"]
+SKIP_DIRS = ["skipped"]
+SOURCES = {"cdn": "http://cdn.example.com"}
+A = "one two ![](http://cdn.example.com/a.png)\n"
+B = "three ![](http://other.example.com/b.png)\n"
+B2 = "three four five ![](http://cdn.example.com/b.png)\n"
+NEW = "six ![](http://x.example.com/n.png)\n"
+
+
+@pytest.fixture
+def vault(tmp_path):
+    (tmp_path / ".parkive").mkdir()
+    (tmp_path / "a.md").write_text(A, encoding="utf-8")
+    (tmp_path / "b.md").write_text(B, encoding="utf-8")
+    (tmp_path / "skipped").mkdir()
+    (tmp_path / "skipped" / "c.md").write_text("not counted\n", encoding="utf-8")
+    return tmp_path
+
+
+def poll_changes(watcher: PollingWatcher) -> set[tuple[str, bool]]:
+    """立即轮询一次，返回 {(相对路径, 是否改变了文件集合)}。"""
+    watcher.next_poll = 0.0
+    return {(rel_path, structural) for rel_path, _, structural in watcher.wait(0) or []}
+
+
+def words(*texts: str) -> int:
+    return sum(map(count_mixed_words, texts))
+
+
+def totals(watch: VaultWatch) -> tuple[int, int, dict[str, int], int]:
+    return len(watch.index.entries), watch.words, dict(watch.known), watch.unknown
+
+
+def test_polling_updates_totals_on_modify_create_and_delete(vault):
+    watch = VaultWatch(vault, SCAN_GLOB, SKIP_DIRS, SOURCES, jobs=1)
+    watcher = PollingWatcher(vault, SCAN_GLOB, SKIP_DIRS, interval=60)
+    watch.rescan()
+    assert watch.refresh_totals() == 2
+    assert totals(watch) == (2, words(A, B), {"cdn": 1}, 1)
+    # 没有变化时不重新计算任何文件
+    assert poll_changes(watcher) == set()
+    assert watch.refresh_totals() == 0
+
+    # 修改：只重新解析变化的文件
+    (vault / "b.md").write_text(B2, encoding="utf-8")
+    assert poll_changes(watcher) == {("b.md", False)}
+    watch.update({"b.md"})
+    assert watch.refresh_totals() == 1
+    assert totals(watch) == (2, words(A, B2), {"cdn": 2}, 0)
+
+    # 新建：改变了文件集合，需要重新遍历
+    (vault / "sub").mkdir()
+    (vault / "sub" / "new.md").write_text(NEW, encoding="utf-8")
+    (vault / "skipped" / "d.md").write_text("ignored\n", encoding="utf-8")
+    assert poll_changes(watcher) == {("sub/new.md", True)}
+    watch.rescan()
+    assert watch.refresh_totals() == 1
+    assert totals(watch) == (3, words(A, B2, NEW), {"cdn": 2}, 1)
+
+    # 删除：文件从索引和总数中移除
+    (vault / "a.md").unlink()
+    assert poll_changes(watcher) == {("a.md", True)}
+    watch.rescan()
+    assert watch.refresh_totals() == 1
+    assert totals(watch) == (2, words(B2, NEW), {"cdn": 1}, 1)
+    assert list(watch.index.entries) == ["b.md", "sub/new.md"]
+
+
+def wait_until(predicate, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(0.05)
+    raise AssertionError("timed out")
+
+
+def watched_words(vault) -> dict[str, int] | None:
+    records = ScanIndex(vault).watched_records(SCAN_GLOB, SKIP_DIRS)
+    if records is None:
+        return None
+    return {path.relative_to(vault).as_posix(): record["words"] for path, record in records}
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="SIGTERM cannot be handled on Windows")
+def test_watch_serves_records_and_cleans_up_on_sigterm(vault):
+    (vault / ".parkive" / "config.toml").write_text('[scope]\nscan_glob = ["*.md", "**/*.md"]\nskip_dirs = ["skipped"]\n', encoding="utf-8")
+    state_path = ScanIndex(vault).path.with_name(WATCH_STATE_FILENAME)
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [SRC_DIR, os.environ.get("PYTHONPATH")]))}
+    process = subprocess.Popen(
+        [sys.executable, "-c", "from parkive import main; main()", "watch", "--poll", "--interval", "0.1", "--debounce", "0", "--jobs", "1"],
+        cwd=vault,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    try:
+        assert wait_until(lambda: watched_words(vault)) == {"a.md": words(A), "b.md": words(B)}
+
+        (vault / "a.md").write_text(B2, encoding="utf-8")
+        (vault / "new.md").write_text(NEW, encoding="utf-8")
+        (vault / "b.md").unlink()
+        wait_until(lambda: watched_words(vault) == {"a.md": words(B2), "new.md": words(NEW)})
+
+        process.send_signal(signal.SIGTERM)
+        output, _ = process.communicate(timeout=30)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.communicate()
+
+    assert process.returncode == 0, output
+    assert "stopped watching." in output
+    # 退出时删除了 watch 状态文件，之后的命令不再信任索引
+    assert not state_path.exists()
+    assert watched_words(vault) is None